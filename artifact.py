@@ -0,0 +1,203 @@
+import base64
+import fnmatch
+import hashlib
+import os
+import py_compile
+import sys
+import tempfile
+import zipfile
+
+import mail
+from settings import ARTIFACT_EXCLUDED_PACKAGES, ARTIFACT_BOTO_SERVICES
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+ARTIFACT = os.path.join(ROOT, "function.zip")
+LAMBDA_RUNTIME = "python3.8"
+SITE_PACKAGES = os.path.join(ROOT, "venv", "lib", f"python{sys.version_info.major}.{sys.version_info.minor}",
+                             "site-packages")
+
+# Modules, packages and templates of the project used by the Lambda function. Any other file of the project
+# (the CLI, tests, benchmarks, local databases or e-mails written by "run") is never part of the artifact.
+INCLUDED = ["lambda_function.py", "settings.py", "cache.py", "extraction.py", "fanout.py", "history.py", "mail.py",
+            "metrics.py", "models.py", "scraper.py", "summary.py", "utils.py", "writer.py", "bookstores", "storage",
+            "templates"]
+# Files of the included packages that are never used by the Lambda function (the compiled templates are built
+# for each artifact)
+EXCLUDED = ["__pycache__", "*.pyc", ".*", "compiled"]
+# Files of the installed packages that are never used by the Lambda function
+EXCLUDED_PACKAGE_FILES = ["__pycache__", "*.pyc", "*.dist-info", "*.egg-info", "tests", "test", "*.pth"]
+# Every Lambda file is read-only and owned by another user, so the permissions do not need to be kept
+FILE_ATTRIBUTES = 0o100644 << 16
+# Fixed date of every file, so the same sources always result in the same zip
+DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+
+def is_excluded(name, patterns):
+    """
+    Check if a file or a folder matches any of the patterns
+    :param name: the name of the file or the folder
+    :param patterns: list of fnmatch patterns
+    :return: True if the file or the folder should not be part of the artifact
+    """
+    return any(fnmatch.fnmatch(name, pattern) for pattern in patterns)
+
+
+def walk(source, patterns, prefix=""):
+    """
+    List the files of a folder that are part of the artifact
+    :param source: the folder to list
+    :param patterns: the patterns of the files and folders to exclude
+    :param prefix: the folder of the files inside the artifact
+    :return: generator of (name inside the artifact, path) tuples
+    """
+    for root, dirs, files in os.walk(source):
+        dirs[:] = [name for name in dirs if not is_excluded(name, patterns)]
+        relative = os.path.relpath(root, source)
+        for file in files:
+            if not is_excluded(file, patterns):
+                yield os.path.normpath(os.path.join(prefix, relative, file)).replace(os.sep, "/"), \
+                      os.path.join(root, file)
+
+
+def walk_project(root=ROOT):
+    """
+    List the files of the project that are part of the artifact
+    :param root: the folder of the project
+    :return: generator of (name inside the artifact, path) tuples
+    """
+    for name in INCLUDED:
+        path = os.path.join(root, name)
+        if os.path.isdir(path):
+            yield from walk(path, EXCLUDED, name)
+        else:
+            yield name, path
+
+
+def get_package_patterns():
+    """
+    Get the patterns of the installed files that are not needed by the Lambda function
+    :return: list of fnmatch patterns
+    """
+    return EXCLUDED_PACKAGE_FILES + ARTIFACT_EXCLUDED_PACKAGES
+
+
+def get_sources(site_packages, compiled_templates):
+    """
+    List all the files of the artifact
+    :param site_packages: the site-packages folder with the dependencies of the function
+    :param compiled_templates: the folder with the compiled e-mail templates
+    :return: sorted list of (name inside the artifact, path) tuples
+    """
+    sources = list(walk_project())
+    sources += walk(compiled_templates, [], "templates/compiled")
+    for name, path in walk(site_packages, get_package_patterns()):
+        parts = name.split("/")
+        # The boto3 and botocore models of the services the function does not call are most of their size
+        if len(parts) > 3 and parts[0] in ("boto3", "botocore") and parts[1] == "data" \
+                and parts[2] not in ARTIFACT_BOTO_SERVICES:
+            continue
+        sources.append((name, path))
+    return sorted(sources)
+
+
+def get_file_hash(path):
+    """
+    Get the hash of the content of a file
+    :param path: the path of the file
+    :return: the SHA-256 hex digest of the file
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_manifest_hash(sources, precompile):
+    """
+    Get the hash that identifies the content of an artifact, before building it
+    :param sources: list of (name inside the artifact, path) tuples
+    :param precompile: whether the artifact has precompiled bytecode
+    :return: the SHA-256 hex digest of the names and contents of all the files
+    """
+    digest = hashlib.sha256(f"{LAMBDA_RUNTIME}:{precompile}".encode("utf-8"))
+    for name, path in sources:
+        digest.update(f"{name}:{get_file_hash(path)}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def get_code_hash(path):
+    """
+    Get the hash of an artifact, in the same format as the CodeSha256 of a Lambda function
+    :param path: the path of the artifact
+    :return: the base64 SHA-256 digest of the artifact
+    """
+    return base64.b64encode(bytes.fromhex(get_file_hash(path))).decode("ascii")
+
+
+def write(zipf, name, data):
+    """
+    Write a file to the artifact with fixed metadata
+    :param zipf: the artifact ZipFile object
+    :param name: the name of the file inside the artifact
+    :param data: the content of the file
+    """
+    info = zipfile.ZipInfo(name, DATE_TIME)
+    info.compress_type = zipfile.ZIP_DEFLATED
+    info.external_attr = FILE_ATTRIBUTES
+    zipf.writestr(info, data)
+
+
+def compile_source(name, path, target):
+    """
+    Compile a Python file into bytecode that does not depend on the modification time of the source
+    :param name: the name of the file inside the artifact
+    :param path: the path of the file
+    :param target: the path of the compiled file
+    :return: the compiled bytecode, or None if the file is not valid Python for this interpreter
+    """
+    try:
+        py_compile.compile(path, cfile=target, dfile=name, doraise=True,
+                           invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH)
+    except py_compile.PyCompileError:
+        return None
+    with open(target, "rb") as file:
+        return file.read()
+
+
+def build(output=ARTIFACT, site_packages=SITE_PACKAGES):
+    """
+    Build the deployment artifact of the Lambda function, unless it is already up to date.
+    The zip is deterministic: the same sources always result in the same bytes, and so in the same hash.
+    :param output: the path of the artifact
+    :param site_packages: the site-packages folder with the dependencies of the function
+    :return: the CodeSha256 of the artifact and whether it was built (False if it was already up to date)
+    """
+    # The bytecode only works in the Python version of the Lambda runtime
+    precompile = f"python{sys.version_info.major}.{sys.version_info.minor}" == LAMBDA_RUNTIME
+    with tempfile.TemporaryDirectory() as build_dir:
+        compiled_templates = os.path.join(build_dir, "templates")
+        mail.compile_templates(compiled_templates)
+        sources = get_sources(site_packages, compiled_templates)
+        manifest_hash = get_manifest_hash(sources, precompile)
+        try:
+            with open(output + ".manifest") as file:
+                if file.read() == manifest_hash and os.path.exists(output):
+                    return get_code_hash(output), False
+        except OSError:
+            pass
+
+        tag = sys.implementation.cache_tag
+        with zipfile.ZipFile(output + ".tmp", "w", allowZip64=True) as zipf:
+            for name, path in sources:
+                with open(path, "rb") as file:
+                    write(zipf, name, file.read())
+                if precompile and name.endswith(".py"):
+                    bytecode = compile_source(name, path, os.path.join(build_dir, "bytecode.pyc"))
+                    if bytecode is not None:
+                        folder, file_name = os.path.split(name)
+                        write(zipf, f"{folder}/__pycache__/{file_name[:-3]}.{tag}.pyc".lstrip("/"), bytecode)
+        os.replace(output + ".tmp", output)
+    with open(output + ".manifest", "w") as file:
+        file.write(manifest_hash)
+    return get_code_hash(output), True
@@ -0,0 +1,232 @@
+import argparse
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import boto3
+from tabulate import tabulate
+
+try:
+    from moto import mock_aws as mock_dynamodb
+except ImportError:
+    try:
+        from moto import mock_dynamodb
+    except ImportError:
+        from moto import mock_dynamodb2 as mock_dynamodb
+
+import bookstores
+import cache
+import lambda_function
+import mail
+import metrics
+import results
+import utils
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+# The ISBN written in each saved page, replaced by the ISBN of the requested book
+FIXTURE_ISBNS = {
+    "almedina": "9789724078489",
+    "amazon": "978-0141036144",
+    "bertrand": "9789722071017",
+    "bookdepository": "9780141036144",
+    "fca": "978-972-722-917-8",
+    "leyaonline": "9789722071017",
+    "lidel": "978-972-722-917-8",
+    "pactor": "978-972-722-917-8",
+    "wook": "9789722071017"
+}
+# Every book is watched in this number of bookstores
+STORES_PER_BOOK = 3
+REGION = "eu-west-1"
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    """
+    HTTP proxy that answers every request with the saved page of the bookstore of the requested host
+    """
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        bookstore = bookstores.get_module_name(url.hostname or self.headers["Host"].split(":")[0])
+        isbn = url.path.rstrip("/").rsplit("/", 1)[-1]
+        html = self.server.pages[bookstore]
+        if isbn.isdigit():
+            html = html.replace(FIXTURE_ISBNS[bookstore], isbn)
+        body = html.encode("utf-8")
+        time.sleep(self.server.latency)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        with self.server.lock:
+            self.server.requests += 1
+            self.server.bytes += len(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class NullSMTP:
+    """
+    SMTP connection that discards the e-mail, so the whole send path runs without a mail server
+    """
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def login(self, *args):
+        pass
+
+    def sendmail(self, *args):
+        pass
+
+
+def start_server(latency):
+    """
+    Start the fixture server in a background thread
+    :param latency: the seconds each response is delayed, to simulate the network
+    :return: the ThreadingHTTPServer object
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FixtureHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.lock = threading.Lock()
+    server.requests = server.bytes = 0
+    server.pages = {}
+    for bookstore in FIXTURE_ISBNS:
+        with open(os.path.join(FIXTURES, f"{bookstore}.html"), encoding="utf-8") as file:
+            server.pages[bookstore] = file.read()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def get_watch_list(size):
+    """
+    Build a synthetic watch list, spread over all the bookstores
+    :param size: the number of books to watch
+    :return: generator of books_to_watch items
+    """
+    hosts = {}
+    for host, bookstore in bookstores.HOSTS.items():
+        hosts.setdefault(bookstore, host)
+    names = sorted(FIXTURE_ISBNS)
+    for i in range(size):
+        isbn = 9790000000000 + i // STORES_PER_BOOK
+        bookstore = names[i % len(names)]
+        yield {
+            "isbn": isbn,
+            "bookstore": bookstore,
+            # Plain http, so the requests are sent to the proxy instead of being tunneled
+            "url": f"http://www.{hosts[bookstore]}/book/{isbn}",
+            "watch_status": True
+        }
+
+
+def create_tables(db):
+    """
+    Create the tables of the function, with the same keys as the deploy command
+    :param db: the instance of the database
+    """
+    tables = {
+        "books_to_watch": [("isbn", "HASH", "N"), ("bookstore", "RANGE", "S")],
+        "books_price_data": [("isbn", "HASH", "N"), ("timestamp", "RANGE", "S")],
+        "books_price_summary": [("isbn", "HASH", "N")]
+    }
+    for name, keys in tables.items():
+        db.create_table(
+            TableName=name,
+            KeySchema=[{"AttributeName": key, "KeyType": key_type} for key, key_type, _ in keys],
+            AttributeDefinitions=[{"AttributeName": key, "AttributeType": kind} for key, _, kind in keys],
+            BillingMode="PAY_PER_REQUEST"
+        )
+
+
+def run(size, server):
+    """
+    Run the Lambda function over a fresh database with a synthetic watch list
+    :param size: the number of books to watch
+    :param server: the fixture server
+    :return: dictionary with the measures of the run
+    """
+    with mock_dynamodb():
+        db = boto3.Session(aws_access_key_id="testing", aws_secret_access_key="testing",
+                           region_name=REGION).resource("dynamodb")
+        create_tables(db)
+        with db.Table("books_to_watch").batch_writer() as batch:
+            for item in get_watch_list(size):
+                batch.put_item(Item=item)
+
+        requests, fetched = server.requests, server.bytes
+        get_db, smtp = utils.get_db, mail.smtplib.SMTP_SSL
+        utils.get_db = lambda: db
+        mail.smtplib.SMTP_SSL = NullSMTP
+        try:
+            start = time.perf_counter()
+            stats = lambda_function.lambda_handler({}, None)
+            elapsed = time.perf_counter() - start
+        finally:
+            utils.get_db, mail.smtplib.SMTP_SSL = get_db, smtp
+
+    return {
+        "books": size,
+        "seconds": elapsed,
+        "books_per_second": size / elapsed,
+        "requests": server.requests - requests,
+        "fetched_kib": (server.bytes - fetched) / 1024,
+        "max_rss_mib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "handler": stats,
+        # The totals of the run emitted by the function (stage times, consumed capacity...)
+        "metrics": {name: value for name, value in metrics.get_records()[0].items() if name != "_aws"}
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end time of the Lambda function against a local "
+                                                 "DynamoDB (moto) and a local server with the saved pages")
+    parser.add_argument("--books", type=int, action="append",
+                        help="the size of the watch list, between 100 and 100000 (can be repeated, "
+                             "defaults to 100 and 1000)")
+    parser.add_argument("--latency", type=float, default=50, help="the response time of the bookstores in ms")
+    parser.add_argument("--cache", action="store_true", help="enable the HTTP cache (in a temporary folder)")
+    parser.add_argument("--output", help="append the results to this JSON lines file")
+    args = parser.parse_args()
+    sizes = args.books or [100, 1000]
+    if any(not 100 <= size <= 100000 for size in sizes):
+        parser.error("the size of the watch list must be between 100 and 100000")
+
+    # moto never checks the credentials, but boto3 needs some to sign the requests
+    os.environ.update(AWS_ACCESS_KEY_ID="testing", AWS_SECRET_ACCESS_KEY="testing", AWS_DEFAULT_REGION=REGION)
+    server = start_server(args.latency / 1000)
+    os.environ["HTTP_PROXY"] = f"http://127.0.0.1:{server.server_address[1]}"
+    os.environ.pop("NO_PROXY", None)
+    os.environ.pop("no_proxy", None)
+
+    measures = []
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache.HTTP_CACHE_DIR = cache_dir if args.cache else None
+        for size in sizes:
+            measures.append(run(size, server))
+    server.shutdown()
+
+    print(tabulate([[m["books"], m["seconds"], m["books_per_second"], m["requests"], m["fetched_kib"],
+                     m["max_rss_mib"]] for m in measures],
+                   ["books", "s", "books/s", "requests", "fetched KiB", "max RSS MiB"], floatfmt=".1f"))
+    if args.output:
+        results.save(args.output, "handler", {"latency_ms": args.latency, "cache": args.cache}, measures)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from tabulate import tabulate
+
+import results
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def get_import_times(module):
+    """
+    Import a module in a fresh interpreter with '-X importtime'
+    :param module: the name of the module to import
+    :return: dictionary with the self and cumulative microseconds of every module imported, by name
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=ROOT,
+                            stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = {"self": int(own), "cumulative": int(cumulative)}
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report the import time of the Lambda function cold start")
+    parser.add_argument("--module", default="lambda_function", help="the module imported by the Lambda runtime")
+    parser.add_argument("--top", type=int, default=15, help="the number of packages to show")
+    parser.add_argument("--repeat", type=int, default=5, help="the number of cold imports (the best one is kept)")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    parser.add_argument("--output", help="append the results to this JSON lines file")
+    parser.add_argument("--max-ms", type=float, help="exit with an error if the import takes longer than this")
+    args = parser.parse_args()
+
+    times = min((get_import_times(args.module) for _ in range(args.repeat)),
+                key=lambda t: t[args.module]["cumulative"])
+    total = times[args.module]["cumulative"] / 1000
+    # Group the nested modules by their top level package
+    packages = {}
+    for name, time in times.items():
+        package = name.split(".")[0]
+        packages[package] = packages.get(package, 0) + time["self"] / 1000
+    top = sorted(packages.items(), key=lambda p: p[1], reverse=True)[:args.top]
+
+    if args.json:
+        print(json.dumps({"module": args.module, "total_ms": total, "packages_ms": dict(top)}))
+    else:
+        print(tabulate(top, ["package", "ms"], floatfmt=".1f"))
+        print(f"\nimport {args.module}: {total:.1f} ms")
+    if args.output:
+        results.save(args.output, "importtime", {"module": args.module, "repeat": args.repeat},
+                      [{"module": args.module, "total_ms": total, "packages_ms": dict(top)}])
+    if args.max_ms is not None and total > args.max_ms:
+        sys.exit(f"The import of {args.module} took {total:.1f} ms, more than {args.max_ms} ms")
+
+
+if __name__ == "__main__":
+    main()
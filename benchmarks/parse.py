@@ -0,0 +1,81 @@
+import argparse
+import importlib
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bs4 import BeautifulSoup
+from tabulate import tabulate
+
+import results
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+FILLER = '<div class="filler"><ul>{}</ul><p>{}</p></div>'.format(
+    "".join(f'<li><a href="/category/{i}">Category {i}</a></li>' for i in range(20)), "Lorem ipsum dolor sit amet " * 20)
+
+
+def load_fixture(bookstore, size):
+    """
+    Load the saved page of a bookstore, padded with unrelated markup to look like a real product page
+    :param bookstore: the name of the bookstore module
+    :param size: the minimum size of the page in bytes
+    :return: the page HTML content
+    """
+    with open(os.path.join(FIXTURES, f"{bookstore}.html"), encoding="utf-8") as file:
+        html = file.read()
+    padding = FILLER * max(0, (size - len(html)) // len(FILLER) + 1)
+    # Half of the padding before the product, half after, like navigation menus and footers
+    html = html.replace("<body>", "<body>" + padding[:len(padding) // 2], 1)
+    return html.replace("</body>", padding[len(padding) // 2:] + "</body>", 1).encode("utf-8")
+
+
+def measure(function, repeat):
+    """
+    Measure the execution time and the peak memory of a function
+    :param function: the function to measure
+    :param repeat: the number of executions
+    :return: the best execution time in milliseconds and the peak memory in KiB
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best * 1000, peak / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per bookstore parse time and peak memory, before and after "
+                                                 "partial parsing")
+    parser.add_argument("--size", type=int, default=300 * 1024, help="the size of each page in bytes")
+    parser.add_argument("--repeat", type=int, default=5, help="the number of executions of each measure")
+    parser.add_argument("--bookstore", action="append", help="only measure this bookstore (can be repeated)")
+    parser.add_argument("--output", help="append the results to this JSON lines file")
+    args = parser.parse_args()
+
+    measures = []
+    for bookstore in sorted(name[:-5] for name in os.listdir(FIXTURES) if name.endswith(".html")):
+        if args.bookstore and bookstore not in args.bookstore:
+            continue
+        spec = importlib.import_module(f"bookstores.{bookstore}").SPEC
+        html = load_fixture(bookstore, args.size)
+        url = f"https://{bookstore}.example/book"
+        full_ms, full_kib = measure(lambda: spec.extract(BeautifulSoup(html, features="html.parser")), args.repeat)
+        partial_ms, partial_kib = measure(lambda: spec.parse(html, url), args.repeat)
+        measures.append({"bookstore": bookstore, "page_kib": len(html) // 1024, "full_ms": full_ms,
+                         "full_peak_kib": full_kib, "partial_ms": partial_ms, "partial_peak_kib": partial_kib})
+    print(tabulate([[*m.values(), m["full_ms"] / m["partial_ms"]] for m in measures],
+                   ["bookstore", "KiB", "full ms", "full peak KiB", "partial ms", "partial peak KiB", "speedup"],
+                   floatfmt=".1f"))
+    if args.output:
+        results.save(args.output, "parse", {"size": args.size, "repeat": args.repeat}, measures)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+import json
+import os
+import platform
+import subprocess
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def get_commit():
+    """
+    Get the commit of the measured code
+    :return: the hash of the current commit, or None outside of a git repository
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, universal_newlines=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save(path, benchmark, parameters, results):
+    """
+    Append the results of a benchmark to a JSON lines file, so the runs of different commits can be compared
+    :param path: the path of the file
+    :param benchmark: the name of the benchmark
+    :param parameters: dictionary with the arguments of the run
+    :param results: list of dictionaries with the measures
+    """
+    record = {
+        "benchmark": benchmark,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "commit": get_commit(),
+        "python": platform.python_version(),
+        "parameters": parameters,
+        "results": results
+    }
+    with open(path, "a") as file:
+        file.write(json.dumps(record) + "\n")
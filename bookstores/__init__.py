@@ -1,5 +1,63 @@
-import pkgutil
+import importlib
+from urllib.parse import urlparse
 
-__path__ = pkgutil.extend_path(__path__, __name__)
-for importer, modname, ispkg in pkgutil.walk_packages(path=__path__, prefix=__name__ + '.'):
-    __import__(modname)
+# The scraper module of each bookstore host, imported only when the first url of the host is scraped
+HOSTS = {
+    "almedina.net": "almedina",
+    "amazon.co.uk": "amazon",
+    "amazon.com": "amazon",
+    "amazon.de": "amazon",
+    "amazon.es": "amazon",
+    "amazon.fr": "amazon",
+    "amazon.it": "amazon",
+    "bertrand.pt": "bertrand",
+    "bookdepository.com": "bookdepository",
+    "fca.pt": "fca",
+    "leyaonline.com": "leyaonline",
+    "lidel.pt": "lidel",
+    "pactor.pt": "pactor",
+    "wook.pt": "wook"
+}
+
+_scrapers = {}
+
+
+def get_module_name(host):
+    """
+    Get the name of the scraper module of a host, also matching its subdomains (e.g. www.wook.pt)
+    :param host: the host name of the url
+    :return: the name of the module in the bookstores package
+    """
+    labels = host.split(".")
+    for i in range(len(labels) - 1):
+        name = HOSTS.get(".".join(labels[i:]))
+        if name:
+            return name
+    raise ValueError(f"There is no bookstore available for the host '{host}'. The available ones are: "
+                     f"{', '.join(HOSTS)}")
+
+
+def get_name(url):
+    """
+    Get the name of the bookstore of a url, used to group its metrics
+    :param url: the url of the book in the bookstore
+    :return: the name of the module of the bookstore, or the host name if there is none
+    """
+    host = (urlparse(url).hostname or "").lower()
+    try:
+        return get_module_name(host)
+    except ValueError:
+        return host
+
+
+def get_scraper(url):
+    """
+    Get the scraper module of the bookstore of a url, importing it on first use
+    :param url: the url of the book in the bookstore
+    :return: the bookstore module, with the get_info function
+    """
+    host = (urlparse(url).hostname or "").lower()
+    scraper = _scrapers.get(host)
+    if scraper is None:
+        scraper = _scrapers[host] = importlib.import_module(f"{__name__}.{get_module_name(host)}")
+    return scraper
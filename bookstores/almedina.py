@@ -3,33 +3,32 @@ import sys
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import utils
-from bs4 import BeautifulSoup
-from models import Book
+from extraction import Field, Price, Spec
 
 
-def get_info(url):
-    html = utils.get_page(url)
-    soup = BeautifulSoup(html, 'html.parser')
-    price = get_price(soup)
-    return Book(int(get_isbn(soup)), price["promo_price"], price["regular_price"],
-                price["currency"], "Almedina", url, get_photo_url(soup))
+def get_price_token(position):
+    def getter(tag):
+        tokens = [token for token in tag.get("content", "").split(" ") if token.strip()]
+        return tokens[position] if len(tokens) > position else None
+    return getter
 
 
-def get_price(soup):
-    price = soup.select(".price-regular > span")[0].attrs.get("content")
-    result = [price.replace("\xa0", "") for price in
-              list(filter(None, list(map(lambda s: s.strip(), list(filter(None, price.strip().split(" ")))))))]
-    return {
-        "promo_price": float(result[0][:-1].replace(",", ".")),
-        "regular_price": float(result[1][:-1].replace(",", ".")),
-        "currency": price.strip().split(" ")[0][-1]
-    }
+def get_isbn(tag):
+    return "".join(tag.find_all(string=True, recursive=False))[1:]
 
 
-def get_isbn(soup):
-    soup.select(".prod-details-wrapper > ul > li > b")[3].decompose()
-    return soup.select(".prod-details-wrapper > ul > li")[3].string[1:]
+SPEC = Spec(
+    bookstore="Almedina",
+    fields={
+        "current": Field(".price-regular > span", getter=get_price_token(0)),
+        "old": Field(".price-regular > span", getter=get_price_token(1), required=False),
+        "isbn": Field(".prod-details-wrapper > ul > li", getter=get_isbn, index=3),
+        "photo_url": Field(".product-image-wrapper > .product-image-container > img", attribute="src")
+    },
+    price=Price(current="current", old="old"),
+    regions=[".price-regular", ".prod-details-wrapper", ".product-image-wrapper"]
+)
 
 
-def get_photo_url(soup):
-    return soup.select(".product-image-wrapper > .product-image-container > img")[0]["src"]
+def get_info(url):
+    return utils.get_book(url, SPEC.parse)
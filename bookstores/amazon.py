@@ -1,54 +1,58 @@
 import os
 import sys
+import threading
+from urllib.parse import urlparse
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import utils
+from extraction import Field, Price, Spec
 
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from bs4 import BeautifulSoup
-from models import Book
 
+def get_isbn(tag):
+    return tag.find_parent().text.split(':')[-1].strip().replace("-", "")
 
-def get_info(url):
-    soup = request_page(url)
-    price = get_price(soup)
-    return Book(int(get_isbn(soup)), price["promo_price"], price["regular_price"],
-                price["currency"], "Amazon", url, get_photo_url(soup))
 
+SPEC = Spec(
+    bookstore="Amazon",
+    fields={
+        "current": Field(".offer-price"),
+        "old": Field("#buyBoxInner > ul > li > span > .a-text-strike", required=False),
+        "isbn": Field('span.a-text-bold:contains("ISBN-13"), b:contains("ISBN-13")', getter=get_isbn),
+        "photo_url": Field("#imgBlkFront", attribute="src")
+    },
+    price=Price(current="current", old="old"),
+    regions=["#buyBoxInner", ".offer-price", "#imgBlkFront", "#detailBullets_feature_div",
+             "#detailBulletsWrapper_feature_div", "#productDetailsTable", "#prodDetails"]
+)
 
-def get_price(soup):
-    price = {"promo_price": None, "regular_price": None}
-    try:
-        if soup.select("#buyBoxInner > ul > li > span > .a-text-strike") != []:
-            price["regular_price"] = float(soup.select("#buyBoxInner > ul > li > span > .a-text-strike")[0].string[:-2].replace(",", "."))
-            price["promo_price"] = float(soup.select(".offer-price")[0].string[:-2].replace(",", "."))
-        else:
-            price["regular_price"] = float(soup.select(".offer-price")[0].string[:-2].replace(",", "."))
-        price["currency"] = soup.select(".offer-price")[0].string[-1]
-    except ValueError:
-        if soup.select("#buyBoxInner > ul > li > span > .a-text-strike") != []:
-            price["regular_price"] = float(soup.select("#buyBoxInner > ul > li > span > .a-text-strike")[0].string[1:].replace(",", "."))
-            price["promo_price"] = float(soup.select(".offer-price")[0].string[1:].replace(",", "."))
-        else:
-            price["regular_price"] = float(soup.select(".offer-price")[0].string[1:].replace(",", "."))
-        price["currency"] = soup.select(".offer-price")[0].string[0]
-    return price
 
+_warm_up_lock = threading.Lock()
 
-def get_isbn(soup):
-    return soup.select_one('span.a-text-bold:contains("ISBN-13"), b:contains("ISBN-13")')\
-        .find_parent().text.split(':')[-1].strip().replace("-", "")
 
-
-def get_photo_url(soup):
-    return soup.select("#imgBlkFront")[0]["src"]
+def get_info(url):
+    return utils.get_book(url, SPEC.parse, headers=request_headers(url))
 
 
-def request_page(url):
+def request_headers(url):
+    parsed = urlparse(url)
     headers = {
-        "Host": ("https://" + url.split("://")[1].split("/")[0] + "/").split("://")[1].split("/")[0],
+        "Host": parsed.netloc,
         "User-Agent": "Mozilla/5.0 (X11; Fedora; Linux x86_64; rv:79.0) Gecko/20100101 Firefox/79.0",
         "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8"
     }
-    utils.get_page("https://" + url.split("://")[1].split("/")[0] + "/", headers=headers)
-    html = utils.get_page(url, headers=headers)
-    return BeautifulSoup(html, features="lxml")
+    warm_up(url, headers)
+    return headers
+
+
+def warm_up(url, headers):
+    """
+    Visit the home page of the host once per session, so the session has the cookies of the bookstore
+    :param url: the url of the book in the bookstore
+    :param headers: the headers of the requests to the host
+    """
+    session = utils.get_session(url)
+    with _warm_up_lock:
+        if not getattr(session, "warmed_up", False):
+            parsed = urlparse(url)
+            utils.get_page(f"{parsed.scheme}://{parsed.netloc}/", headers=headers)
+            session.warmed_up = True
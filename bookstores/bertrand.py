@@ -3,35 +3,21 @@ import sys
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import utils
-from bs4 import BeautifulSoup
-from models import Book
+from extraction import Field, Price, Spec
+
+SPEC = Spec(
+    bookstore="Bertrand",
+    fields={
+        "current": Field("#productPageRightSectionTop-saleAction-price-current"),
+        "old": Field("#productPageRightSectionTop-saleAction-price-old", required=False),
+        "isbn": Field("#productPageSectionDetails-collapseDetalhes-content-isbn > .info"),
+        "photo_url": Field("#productPageLeftSectionTop-images > .cover > img", attribute="src")
+    },
+    price=Price(current="current", old="old"),
+    regions=["#productPageRightSectionTop-saleAction-price-current", "#productPageRightSectionTop-saleAction-price-old",
+             "#productPageSectionDetails-collapseDetalhes-content-isbn", "#productPageLeftSectionTop-images"]
+)
 
 
 def get_info(url):
-    html = utils.get_page(url)
-    soup = BeautifulSoup(html, 'html.parser')
-    price = get_price(soup)
-    return Book(int(get_isbn(soup)), price["promo_price"], price["regular_price"],
-                price["currency"], "Bertrand", url, get_photo_url(soup))
-
-
-def get_price(soup):
-    price = {"promo_price": None, "regular_price": None}
-    if soup.select("#productPageRightSectionTop-saleAction-price-old") != []:
-        price["regular_price"] = float(
-            soup.select("#productPageRightSectionTop-saleAction-price-old")[0].string[:-1].replace(",", "."))
-        price["promo_price"] = float(
-            soup.select("#productPageRightSectionTop-saleAction-price-current")[0].string[:-1].replace(",", "."))
-    else:
-        price["regular_price"] = float(
-            soup.select("#productPageRightSectionTop-saleAction-price-current")[0].string[:-1].replace(",", "."))
-    price["currency"] = soup.select("#productPageRightSectionTop-saleAction-price-current")[0].string[-1]
-    return price
-
-
-def get_isbn(soup):
-    return soup.select("#productPageSectionDetails-collapseDetalhes-content-isbn > .info")[0].string
-
-
-def get_photo_url(soup):
-    return soup.select("#productPageLeftSectionTop-images > .cover > img")[0]["src"]
+    return utils.get_book(url, SPEC.parse)
@@ -1,32 +1,27 @@
 import os
 import sys
-from urllib.parse import urljoin
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import utils
-from bs4 import BeautifulSoup
-from models import Book
+from extraction import Field, Price, Spec
 
 
-def get_info(url):
-    html = utils.get_page(url)
-    soup = BeautifulSoup(html, 'html.parser')
-    price = get_price(soup)
-    return Book(int(get_isbn(soup)), price["promo_price"], price["regular_price"],
-                price["currency"], "LIDEL", url, urljoin(url, get_photo_url(soup)))
-
+def get_isbn(tag):
+    return tag.string[6:].replace("-", "")
 
-def get_price(soup):
-    return {
-        "promo_price": float(soup.select(".precoDetalhe > span")[0].nextSibling.strip()[2:].replace(",", ".")),
-        "regular_price": float(soup.select(".precoDetalhe > span")[0].string[2:].replace(",", ".")),
-        "currency": soup.select(".precoDetalhe > span")[0].string[0]
-    }
 
+SPEC = Spec(
+    bookstore="LIDEL",
+    fields={
+        "current": Field(".precoDetalhe > span", getter=lambda tag: tag.nextSibling.strip()),
+        "old": Field(".precoDetalhe > span"),
+        "isbn": Field("#listSpecsDetalhe .impar > td", getter=get_isbn, index=1),
+        "photo_url": Field("#tabLivro > .bgDetalheLivro > .capaLivroDetalhe > a > img", attribute="src")
+    },
+    price=Price(current="current", old="old", currency="old"),
+    regions=[".precoDetalhe", "#listSpecsDetalhe", "#tabLivro"]
+)
 
-def get_isbn(soup):
-    return soup.select("#listSpecsDetalhe .impar > td")[1].string[6:].replace("-", "")
 
-
-def get_photo_url(soup):
-    return soup.select("#tabLivro > .bgDetalheLivro > .capaLivroDetalhe > a > img")[0]["src"]
+def get_info(url):
+    return utils.get_book(url, SPEC.parse)
@@ -0,0 +1,99 @@
+import hashlib
+import json
+import os
+
+from settings import HTTP_CACHE_DIR
+
+# The entries of the books being scraped, whose validators are kept with the book in books_to_watch so they
+# survive the Lambda containers, which never keep HTTP_CACHE_DIR from one day to the next
+_entries = {}
+
+
+def get_path(url):
+    """
+    Get the path of the cache entry of the given url
+    :param url: the url of the page
+    :return: the path of the JSON file with the cache entry
+    """
+    return os.path.join(HTTP_CACHE_DIR, hashlib.sha256(url.encode("utf-8")).hexdigest() + ".json")
+
+
+def load(url):
+    """
+    Load the cache entry of the given url
+    :param url: the url of the page
+    :return: the cache entry dictionary, or None if the cache is disabled or the url was never cached
+    """
+    if url in _entries:
+        return _entries[url]
+    if not HTTP_CACHE_DIR:
+        return None
+    try:
+        with open(get_path(url), encoding="utf-8") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def save(url, entry):
+    """
+    Save the cache entry of the given url, replacing the previous one atomically
+    :param url: the url of the page
+    :param entry: the cache entry dictionary (validators, body hash and the extracted book fields)
+    """
+    _entries[url] = entry
+    if not HTTP_CACHE_DIR:
+        return
+    os.makedirs(HTTP_CACHE_DIR, exist_ok=True)
+    path = get_path(url)
+    with open(path + ".tmp", "w", encoding="utf-8") as file:
+        json.dump(entry, file)
+    os.replace(path + ".tmp", path)
+
+
+def prime(books):
+    """
+    Load the cache entries stored with the books to watch, as the books are read
+    :param books: iterable of books_to_watch items, with the validators of their url in the 'http_cache' attribute
+    (see pop) and the static information of the book (see utils.METADATA)
+    :return: generator of the same books
+    """
+    for book in books:
+        if book.get("http_cache"):
+            try:
+                stored = json.loads(book["http_cache"])
+            except ValueError:
+                stored = None
+            if stored and book.get("store_name"):
+                _entries[book["url"]] = {
+                    "etag": stored.get("etag"),
+                    "last_modified": stored.get("last_modified"),
+                    "book": {
+                        "isbn": int(book["isbn"]),
+                        "promo_price": stored.get("promo_price"),
+                        "regular_price": stored.get("regular_price"),
+                        "currency": book.get("currency"),
+                        "bookstore": book["store_name"],
+                        "url": book["url"],
+                        "photo_url": book.get("photo_url")
+                    }
+                }
+        yield book
+
+
+def pop(url):
+    """
+    Take the cache entry of a book just scraped, to be stored with the book to watch
+    :param url: the url of the page
+    :return: the JSON string with the validators of the page and the prices of the book, or None if
+    there is no entry or the page has no validators
+    """
+    entry = _entries.pop(url, None)
+    # Only the validators and the prices, as the rest of the book is already in books_to_watch. The hash of the body
+    # changes with any dynamic part of the page, so it is only kept in HTTP_CACHE_DIR, or the books to watch would
+    # be written again on every run.
+    if entry is None or not (entry.get("etag") or entry.get("last_modified")):
+        return None
+    stored = {"etag": entry.get("etag"), "last_modified": entry.get("last_modified"),
+              "promo_price": entry["book"]["promo_price"], "regular_price": entry["book"]["regular_price"]}
+    return json.dumps(stored, sort_keys=True)
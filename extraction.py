@@ -0,0 +1,178 @@
+import re
+from urllib.parse import urljoin
+
+import soupsieve
+from bs4 import BeautifulSoup, SoupStrainer
+
+from models import Book
+from settings import PARSER
+
+AMOUNT = re.compile(r"\d[\d.,]*")
+NOT_SYMBOL = re.compile(r"[\d.,\s]")
+
+
+def amount(text):
+    """
+    Parse the amount of a price string, whatever the position of the currency symbol
+    :param text: the price string (e.g. '12,34 €' or '£12.34')
+    :return: the float value of the price
+    """
+    number = AMOUNT.search(text).group().rstrip(".,")
+    if "," in number and "." in number:
+        thousands = "." if number.rfind(",") > number.rfind(".") else ","
+        number = number.replace(thousands, "")
+    return float(number.replace(",", "."))
+
+
+def symbol(text):
+    """
+    Parse the currency symbol of a price string
+    :param text: the price string (e.g. '12,34 €' or '£12.34')
+    :return: the currency symbol of the price
+    """
+    return NOT_SYMBOL.sub("", text)
+
+
+def get_strainer(regions):
+    """
+    Build the SoupStrainer that only keeps the given regions of a document
+    :param regions: list of '#id', '.class' or '[attribute=value]' strings identifying the root of each region
+    :return: SoupStrainer instance, or None to parse the whole document
+    """
+    if not regions:
+        return None
+    ids = {region[1:] for region in regions if region.startswith("#")}
+    classes = {region[1:] for region in regions if region.startswith(".")}
+    attributes = {tuple(region[1:-1].split("=", 1)) for region in regions if region.startswith("[")}
+
+    def keep(name, attrs):
+        return attrs.get("id") in ids \
+               or not classes.isdisjoint(attrs.get("class", "").split()) \
+               or any(attrs.get(attribute) == value for attribute, value in attributes)
+    return SoupStrainer(keep)
+
+
+class Field:
+    """
+    The declaration of a value to extract from a page
+    """
+    def __init__(self, selector, attribute=None, getter=None, index=0, required=True):
+        """
+        The constructor for Field
+        :param selector: the CSS selector of the element with the value
+        :param attribute: the attribute of the element with the value (if None, the element's string is used)
+        :param getter: function that receives the element and returns the value (replaces attribute)
+        :param index: the index of the element among all the elements matched by the selector
+        :param required: whether a missing value is an error
+        """
+        self.selector = selector
+        self.pattern = soupsieve.compile(selector)
+        self.attribute = attribute
+        self.getter = getter
+        self.index = index
+        self.required = required
+
+    def get(self, tag):
+        """
+        Get the value of this field from the matched element
+        :param tag: the element matched by the selector
+        :return: the value of this field
+        """
+        if self.getter:
+            return self.getter(tag)
+        if self.attribute:
+            return tag.get(self.attribute)
+        return tag.string
+
+
+class Price:
+    """
+    The rule to build the price of a book from the extracted fields
+    """
+    def __init__(self, current, old=None, currency=None):
+        """
+        The constructor for Price
+        :param current: the name of the field with the price the book is sold at
+        :param old: the name of the field with the price before the discount (only present in promotions)
+        :param currency: the name of the field with the currency symbol (defaults to current)
+        """
+        self.current = current
+        self.old = old
+        self.currency = currency or current
+
+    def __call__(self, values):
+        """
+        Build the price dictionary
+        :param values: the values extracted from the page
+        :return: dictionary with the promo_price, regular_price and currency keys
+        """
+        if self.old and values.get(self.old) is not None:
+            regular_price, promo_price = amount(values[self.old]), amount(values[self.current])
+        else:
+            regular_price, promo_price = amount(values[self.current]), None
+        return {
+            "promo_price": promo_price,
+            "regular_price": regular_price,
+            "currency": symbol(values[self.currency])
+        }
+
+
+class Spec:
+    """
+    The extraction specification of a bookstore.
+    All the selectors are compiled once and evaluated in a single walk over the document.
+    """
+    def __init__(self, bookstore, fields, price, regions=None, features=PARSER):
+        """
+        The constructor for Spec
+        :param bookstore: the name of the bookstore
+        :param fields: dictionary of Field instances, with at least the 'isbn' and 'photo_url' keys
+        :param price: the Price rule of the bookstore
+        :param regions: the regions of the page with all the fields (see get_strainer), the rest is never parsed
+        :param features: the BeautifulSoup parser to use
+        """
+        self.bookstore = bookstore
+        self.fields = fields
+        self.price = price
+        self.strainer = get_strainer(regions)
+        self.features = features
+        self.pattern = soupsieve.compile(", ".join(field.selector for field in fields.values()))
+
+    def extract(self, soup):
+        """
+        Extract the values of all the fields from the document
+        :param soup: the BeautifulSoup document
+        :return: dictionary with the value of each field
+        """
+        values = {}
+        matches = dict.fromkeys(self.fields, 0)
+        for tag in self.pattern.iselect(soup):
+            for name, field in self.fields.items():
+                if name not in values and field.pattern.match(tag):
+                    if matches[name] == field.index:
+                        values[name] = field.get(tag)
+                    matches[name] += 1
+            if len(values) == len(self.fields):
+                break
+        for name, field in self.fields.items():
+            if field.required and values.get(name) is None:
+                raise ValueError(f"{self.bookstore}: could not find '{name}' ({field.selector})")
+        return values
+
+    def parse(self, html, url):
+        """
+        Parse the page of a book
+        :param html: the page HTML content
+        :param url: the url of the book in the bookstore
+        :return: Book instance with the information extracted
+        """
+        try:
+            values = self.extract(BeautifulSoup(html, features=self.features, parse_only=self.strainer))
+        except ValueError:
+            if self.strainer is None:
+                raise
+            # The layout moved a field out of the declared regions, so fall back to the whole document
+            values = self.extract(BeautifulSoup(html, features=self.features))
+        price = self.price(values)
+        return Book(int(values["isbn"]), price["promo_price"], price["regular_price"], price["currency"],
+                    self.bookstore, url, urljoin(url, values["photo_url"]))
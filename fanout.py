@@ -0,0 +1,245 @@
+import json
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+import cache
+import mail
+import metrics
+import scraper
+from settings import AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_DEFAULT_REGION, FANOUT_SHARDS, MAX_WORKERS, \
+    MAX_WORKERS_PER_DOMAIN, FANOUT_RESERVED_SECONDS
+
+FUNCTION_NAME = "thebookisright"
+# The workers are invoked asynchronously, and retrying a call would scrape its shard twice
+LAMBDA_CONFIG = Config(connect_timeout=10, read_timeout=30, retries={"max_attempts": 0})
+# The table with the results of the workers of each run, until the last one sends the e-mail
+RUNS_TABLE = "fanout_runs"
+# The seconds a run is kept in RUNS_TABLE (deleted by its TTL)
+RUN_EXPIRATION = 7 * 24 * 3600
+# The failed books listed in the result of a run, which must fit in the response of an invocation
+REPORTED_FAILURES = 100
+
+
+def get_deadline(context, reserved=FANOUT_RESERVED_SECONDS):
+    """
+    Get the time after which an invocation must stop scraping, so it still has the time to store the prices and
+    send the e-mail before the function times out
+    :param context: the context argument provided by AWS (None outside of Lambda)
+    :param reserved: the seconds kept for storing the prices and sending the e-mail
+    :return: the time.time() of the deadline, or None without a context
+    """
+    if context is None:
+        return None
+    return time.time() + context.get_remaining_time_in_millis() / 1000 - reserved
+
+
+def work(storage, shard=None, shards=None, bookstores=None, isbns=None, max_workers=MAX_WORKERS,
+         max_per_domain=MAX_WORKERS_PER_DOMAIN, store=True, deadline=None):
+    """
+    Scrape and store the prices of the watched books, or of a single shard of them
+    :param storage: the Storage instance of the database
+    :param shard: the shard of the watch list to scrape (None for the whole watch list)
+    :param shards: the total number of shards
+    :param bookstores: the only bookstores to scrape (as in the books_to_watch key), None for all of them
+    :param isbns: the only books to scrape, None for all of them
+    :param max_workers: the maximum number of books being scraped at the same time
+    :param max_per_domain: the maximum number of books being scraped at the same time from the same host, by all the
+    shards together (each shard has its part, and at least one)
+    :param store: whether to record the prices scraped
+    :param deadline: the time.time() after which no more books are scraped (see get_deadline)
+    :return: dictionary with the number of books scraped, unchanged (not recorded again), failed and skipped, the
+    first failures, and the throughput counters of the price writes (None when they are not stored), and also the
+    'scraped' books (see scraper.scrape) when they are not stored
+    """
+    if shards:
+        max_per_domain = max(1, max_per_domain // shards)
+    books = cache.prime(storage.get_books_to_watch(shard=shard, shards=shards))
+    if bookstores:
+        books = (book for book in books if book["bookstore"] in bookstores)
+    if isbns:
+        books = (book for book in books if int(book["isbn"]) in isbns)
+    with metrics.timer("ScrapeTime"):
+        books, failures = scraper.scrape(books, max_workers, max_per_domain, deadline=deadline)
+    metrics.add("Books", len(books))
+    if store:
+        with metrics.timer("StoreTime"):
+            stored = storage.store(books)
+    else:
+        stored = {"unchanged": 0, "books_price_data": None}
+    metrics.add("Unchanged", stored["unchanged"])
+    skipped = sum(failure["skipped"] for failure in failures)
+    metrics.add("Failed", len(failures) - skipped)
+    metrics.add("Skipped", skipped)
+    result = {
+        "books": len(books),
+        "unchanged": stored["unchanged"],
+        "failed": len(failures) - skipped,
+        "skipped": skipped,
+        "failures": failures[:REPORTED_FAILURES],
+        "books_price_data": stored["books_price_data"]
+    }
+    if not store:
+        result["scraped"] = books
+    return result
+
+
+def report(storage):
+    """
+    Build and send the e-mail with the prices of all the watched books
+    :param storage: the Storage instance of the database
+    """
+    with metrics.timer("PreprocessTime"):
+        data = mail.preprocess(storage)
+    mail.send(data)
+
+
+def invoke_local(event):
+    """
+    Run a worker in the current process, as the deployed function would
+    :param event: the event of the worker
+    :return: the result of the worker
+    """
+    import lambda_function
+    return lambda_function.lambda_handler(event, None)
+
+
+def merge(results):
+    """
+    Add up the results of the workers. The workers run at the same time, so the writing time is the longest one.
+    :param results: list of worker results
+    :return: dictionary with the number of shards, the failures and the throughput counters of the price writes
+    (see work)
+    """
+    # The workers that did not store their prices have no throughput counters
+    stats = [result["books_price_data"] for result in results if result["books_price_data"] is not None]
+    items = sum(s["items"] for s in stats)
+    elapsed = max((s["elapsed"] for s in stats), default=0)
+    return {
+        "shards": len(results),
+        "books": sum(result["books"] for result in results),
+        "unchanged": sum(result["unchanged"] for result in results),
+        "failed": sum(result["failed"] for result in results),
+        "skipped": sum(result["skipped"] for result in results),
+        "failures": [failure for result in results for failure in result["failures"]][:REPORTED_FAILURES],
+        "books_price_data": {
+            "table": "books_price_data",
+            "items": items,
+            "requests": sum(s["requests"] for s in stats),
+            "retries": sum(s["retries"] for s in stats),
+            "consumed_capacity": sum(s["consumed_capacity"] for s in stats),
+            "elapsed": elapsed,
+            "items_per_second": items / elapsed if elapsed else 0
+        } if stats else None
+    }
+
+
+def dispatch(shards=FANOUT_SHARDS):
+    """
+    Split the watch list into shards and scrape all of them in parallel local processes, waiting for all of them.
+    Each shard is a segment of a parallel scan of books_to_watch, so the workers never scrape the same book.
+    A failed shard does not stop the others, and it is reported in the result.
+    :param shards: the number of worker processes
+    :return: the merged results of the workers (see merge), with the errors of the 'failed_shards'
+    """
+    events = [{"mode": "worker", "shard": shard, "shards": shards} for shard in range(shards)]
+    results, failed_shards = [], {}
+    with metrics.timer("DispatchTime"), ProcessPoolExecutor(max_workers=shards) as executor:
+        futures = {executor.submit(invoke_local, event): event["shard"] for event in events}
+        for future, shard in futures.items():
+            try:
+                results.append(future.result())
+            except Exception as err:
+                failed_shards[shard] = str(err)
+    metrics.add("FailedShards", len(failed_shards))
+    return dict(merge(results), failed_shards=failed_shards)
+
+
+def start(db, storage, shards=FANOUT_SHARDS):
+    """
+    Split the watch list into shards, each one scraped by an asynchronous invocation of the deployed function.
+    The invocations are not waited for: each worker records its result in RUNS_TABLE, and the last one to finish
+    sends the e-mail (see finish).
+    :param db: the instance of the database
+    :param storage: the Storage instance of the database
+    :param shards: the number of worker invocations
+    :return: dictionary with the id of the 'run' and the number of 'shards'
+    """
+    run = uuid.uuid4().hex
+    db.meta.client.put_item(TableName=RUNS_TABLE, Item={
+        "run": run,
+        "shards": shards,
+        "results": {},
+        "expires": int(time.time()) + RUN_EXPIRATION
+    })
+    client = boto3.Session(
+        aws_access_key_id=AWS_ACCESS_KEY_ID,
+        aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
+        region_name=AWS_DEFAULT_REGION
+    ).client("lambda", config=LAMBDA_CONFIG)
+    with metrics.timer("DispatchTime"):
+        for shard in range(shards):
+            event = {"mode": "worker", "shard": shard, "shards": shards, "run": run}
+            try:
+                client.invoke(FunctionName=FUNCTION_NAME, InvocationType="Event",
+                              Payload=json.dumps(event).encode("utf-8"))
+            except Exception as err:
+                # The shard is finished as failed, so the run still ends once the other ones finish
+                finish(db, storage, event, {"error": str(err)})
+    return {"run": run, "shards": shards}
+
+
+def finish(db, storage, event, result):
+    """
+    Record the result of a worker of an asynchronous run, and send the e-mail if it was the last one to finish.
+    The result of each shard is only recorded once, so an invocation delivered twice, or a shard marked as failed by
+    start whose invocation did run, is not counted again, and the e-mail is only sent once.
+    :param db: the instance of the database
+    :param storage: the Storage instance of the database
+    :param event: the event of the worker (see start)
+    :param result: the result of the worker (see work), or the 'error' of a failed shard
+    :return: the merged results of the workers (see dispatch) if this was the last one, None otherwise
+    """
+    # Each shard keeps its part of the failures, so the results of all of them fit in the item
+    failures = result.get("failures", [])[:max(1, REPORTED_FAILURES // event["shards"])]
+    result = dict(result, shard=event["shard"], failures=failures)
+    try:
+        response = db.meta.client.update_item(
+            TableName=RUNS_TABLE,
+            Key={"run": event["run"]},
+            UpdateExpression="SET #results.#shard = :result",
+            ConditionExpression="attribute_not_exists(#results.#shard)",
+            ExpressionAttributeNames={"#results": "results", "#shard": str(event["shard"])},
+            # As JSON, since DynamoDB does not store the floats of the write counters
+            ExpressionAttributeValues={":result": json.dumps(result)},
+            ReturnValues="ALL_NEW"
+        )
+    except ClientError as err:
+        if err.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
+        return None
+    item = response["Attributes"]
+    if len(item["results"]) < item["shards"]:
+        return None
+    # Every shard finished, but another invocation may have seen it too
+    try:
+        db.meta.client.update_item(
+            TableName=RUNS_TABLE,
+            Key={"run": event["run"]},
+            UpdateExpression="SET mailed = :mailed",
+            ConditionExpression="attribute_not_exists(mailed)",
+            ExpressionAttributeValues={":mailed": True}
+        )
+    except ClientError as err:
+        if err.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
+        return None
+    results = [json.loads(result) for result in item["results"].values()]
+    failed_shards = {result["shard"]: result["error"] for result in results if "error" in result}
+    metrics.add("FailedShards", len(failed_shards))
+    report(storage)
+    return dict(merge([result for result in results if "error" not in result]), failed_shards=failed_shards)
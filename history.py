@@ -0,0 +1,453 @@
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal, ROUND_HALF_UP
+
+from boto3.dynamodb.conditions import Attr, Key
+
+import metrics
+from settings import RAW_RETENTION_DAYS, DAILY_RETENTION_DAYS, ROLLUP_MAX_WORKERS
+from writer import BufferedWriter
+
+TABLE = "books_price_data"
+# The timestamps of the compact items start with a prefix, followed by the seconds since the epoch and the store:
+# 'r#' for each price observation, and 'd#' and 'w#' for the aggregates of a day and of a week of observations.
+# The timestamps of the previous format start with the year, so all of them sort before the compact ones.
+RAW = "r#"
+DAILY = "d#"
+WEEKLY = "w#"
+LEGACY_END = ":"
+# The prices are stored as integers, in hundredths
+PRICE_DIGITS = 2
+DAY = 24 * 60 * 60
+WEEK = 7 * DAY
+
+
+def get_timestamp(store, moment=None, prefix=RAW):
+    """
+    Get the timestamp (range key) of a price observation or aggregate
+    :param store: the bookstore of the observation, as in the books_to_watch key
+    :param moment: the datetime or the seconds since the epoch of the observation (None for now), or the start of
+    the period of the aggregate
+    :param prefix: RAW, DAILY or WEEKLY
+    :return: the timestamp string, e.g. 'r#1602961200#wook'
+    """
+    if moment is None:
+        moment = int(time.time())
+    elif not isinstance(moment, int):
+        moment = to_epoch(moment)
+    return f"{prefix}{moment:010d}#{store}"
+
+
+def get_epoch(timestamp):
+    """
+    Get the time of a compact price observation or aggregate
+    :param timestamp: the timestamp string
+    :return: the seconds since the epoch of the observation, or of the start of the period of the aggregate
+    """
+    return int(timestamp[len(RAW):len(RAW) + 10])
+
+
+def to_epoch(moment):
+    """
+    Convert a date or a datetime into seconds since the epoch. Naive datetimes are in UTC.
+    :param moment: the date or datetime
+    :return: the number of seconds since the epoch
+    """
+    if not isinstance(moment, datetime):
+        moment = datetime(moment.year, moment.month, moment.day)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return int(moment.timestamp())
+
+
+def to_end(moment):
+    """
+    Convert the end of a period into seconds since the epoch. Naive datetimes are in UTC.
+    :param moment: the date, whose whole day is in the period, or the datetime
+    :return: the last second of the period, since the epoch
+    """
+    if isinstance(moment, datetime):
+        return to_epoch(moment)
+    return to_epoch(moment + timedelta(days=1)) - 1
+
+
+def to_legacy(epoch):
+    """
+    Get the timestamp of the previous format of a moment
+    :param epoch: the seconds since the epoch
+    :return: the timestamp string, as str(datetime) in UTC
+    """
+    return str(datetime.fromtimestamp(epoch, timezone.utc).replace(tzinfo=None))
+
+
+def parse_timestamp(timestamp):
+    """
+    Parse the timestamp of a price observation, in any of the formats
+    :param timestamp: the timestamp string
+    :return: the datetime of the observation, in UTC
+    """
+    if timestamp[:len(RAW)] in (RAW, DAILY, WEEKLY):
+        return datetime.fromtimestamp(get_epoch(timestamp), timezone.utc)
+    # The previous format is str(datetime.now()) in the Lambda function, which runs in UTC
+    return datetime.fromisoformat(timestamp).replace(tzinfo=timezone.utc)
+
+
+def get_store(timestamp):
+    """
+    Get the bookstore of a compact price observation or aggregate
+    :param timestamp: the timestamp string of the observation
+    :return: the bookstore, as in the books_to_watch key
+    """
+    return timestamp[len(RAW) + 11:]
+
+
+def is_compact(item):
+    """
+    Check the format of a books_price_data item
+    :param item: the books_price_data item
+    :return: True if the item is in the compact format
+    """
+    return item["timestamp"][:len(RAW)] in (RAW, DAILY, WEEKLY)
+
+
+def to_cents(price):
+    """
+    Convert a price to the integer stored in the compact items
+    :param price: the price (float or Decimal)
+    :return: the price in hundredths
+    """
+    return int(Decimal(str(price)).scaleb(PRICE_DIGITS).to_integral_value(ROUND_HALF_UP))
+
+
+def compact(item):
+    """
+    Get the compact format of a price observation, with only the prices and the timestamp.
+    The url, photo_url, bookstore name and currency never change, so they are only kept in books_to_watch.
+    :param item: the complete price observation (see expand), with a compact timestamp
+    :return: the books_price_data item, where the regular price is omitted when it is the promotional one
+    """
+    row = {"isbn": item["isbn"], "timestamp": item["timestamp"], "p": to_cents(item["promo_price"])}
+    if item["regular_price"] != item["promo_price"]:
+        row["r"] = to_cents(item["regular_price"])
+    return row
+
+
+def expand(item, metadata):
+    """
+    Get the complete price observation of a books_price_data item, in any of the formats
+    :param item: the books_price_data item
+    :param metadata: dictionary with the books_to_watch items of the book, by bookstore (see get_metadata)
+    :return: dictionary with the isbn, promo_price, regular_price, currency, bookstore, url, photo_url and timestamp,
+    and also min_price and max_price for the aggregates, where the prices are the last ones of the period
+    """
+    if not is_compact(item):
+        return item
+    store = get_store(item["timestamp"])
+    watch = metadata.get(store, {})
+    promo_price = Decimal(item["p"]).scaleb(-PRICE_DIGITS)
+    observation = {
+        "isbn": item["isbn"],
+        "promo_price": promo_price,
+        "regular_price": Decimal(item["r"]).scaleb(-PRICE_DIGITS) if "r" in item else promo_price,
+        "currency": watch.get("currency", ""),
+        "bookstore": watch.get("store_name", store),
+        "url": watch.get("url"),
+        "photo_url": watch.get("photo_url"),
+        "timestamp": item["timestamp"]
+    }
+    if "lo" in item:
+        observation["min_price"] = Decimal(item["lo"]).scaleb(-PRICE_DIGITS)
+        observation["max_price"] = Decimal(item["hi"]).scaleb(-PRICE_DIGITS)
+    return observation
+
+
+def get_metadata(db, isbn):
+    """
+    Get the static information of a book in each bookstore
+    :param db: the instance of the database
+    :param isbn: the ISBN-13 of the book
+    :return: dictionary with the books_to_watch items of the book, by bookstore
+    """
+    response = db.Table("books_to_watch").query(KeyConditionExpression=Key("isbn").eq(isbn),
+                                                ReturnConsumedCapacity="TOTAL")
+    metrics.add_capacity(response)
+    return {watch["bookstore"]: watch for watch in response["Items"]}
+
+
+def query(db, key_condition, newest_first=False, limit=None):
+    """
+    Stream the books_price_data items matching a key condition, following LastEvaluatedKey until the end
+    :param db: the instance of the database
+    :param key_condition: the KeyConditionExpression of the query
+    :param newest_first: whether to read the items from the newest to the oldest
+    :param limit: the maximum number of items (None for all of them)
+    :return: generator of books_price_data items ordered by timestamp
+    """
+    kwargs = {
+        "TableName": TABLE,
+        "KeyConditionExpression": key_condition,
+        "ScanIndexForward": not newest_first,
+        "ReturnConsumedCapacity": "TOTAL"
+    }
+    while limit is None or limit > 0:
+        if limit is not None:
+            kwargs["Limit"] = limit
+        response = db.meta.client.query(**kwargs)
+        metrics.add_capacity(response)
+        yield from response["Items"]
+        if limit is not None:
+            limit -= len(response["Items"])
+        if "LastEvaluatedKey" not in response:
+            return
+        kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def get_conditions(isbn, since=None, until=None):
+    """
+    Get the key conditions of the items of a book in each format, from the newest to the oldest data
+    :param isbn: the ISBN-13 of the book
+    :param since: the start of the period (datetime or date, naive ones are in UTC), None for all
+    :param until: the end of the period (datetime or date, naive ones are in UTC), None for now
+    :return: list of KeyConditionExpression for the raw prices, the daily and the weekly aggregates, and the
+    prices of the previous format
+    """
+    conditions = []
+    for prefix in (RAW, DAILY, WEEKLY):
+        start = f"{prefix}{to_epoch(since):010d}" if since is not None else prefix
+        end = f"{prefix}{to_end(until) + 1:010d}" if until is not None else prefix + "~"
+        conditions.append(Key("isbn").eq(isbn) & Key("timestamp").between(start, end))
+    start = to_legacy(to_epoch(since)) if since is not None else "0"
+    # The previous timestamps have microseconds, which sort after the whole second and before '~'
+    end = to_legacy(to_end(until)) + "~" if until is not None else LEGACY_END
+    conditions.append(Key("isbn").eq(isbn) & Key("timestamp").between(start, end))
+    return conditions
+
+
+def is_current(item):
+    """
+    Check if a books_price_data item should be read
+    :param item: the books_price_data item
+    :return: False for the items already rolled up, which are about to expire
+    """
+    return "expires" not in item
+
+
+def get_time(item):
+    """
+    Get the time of a price observation, to sort the items of all the formats together
+    :param item: the books_price_data item or price observation
+    :return: the datetime of the observation
+    """
+    return parse_timestamp(item["timestamp"])
+
+
+def get_all(db, isbn):
+    """
+    Get all the prices recorded of a book, where the oldest ones are daily or weekly aggregates
+    :param db: the instance of the database
+    :param isbn: the ISBN-13 of the book
+    :return: list of price observations (see expand), from the oldest to the newest
+    """
+    return get_since(db, isbn, None)
+
+
+def get_latest(db, isbn, limit, since=None, until=None):
+    """
+    Get the latest prices recorded of a book, optionally in a period of time
+    :param db: the instance of the database
+    :param isbn: the ISBN-13 of the book
+    :param limit: the number of prices
+    :param since: the start of the period (datetime or date, naive ones are in UTC), None for all
+    :param until: the end of the period (datetime or date, naive ones are in UTC), None for now
+    :return: list of price observations (see expand), from the newest to the oldest
+    """
+    metadata = get_metadata(db, isbn)
+    items = []
+    for key_condition in get_conditions(isbn, since, until):
+        if len(items) >= limit:
+            break
+        items += filter(is_current, query(db, key_condition, newest_first=True, limit=limit - len(items)))
+    return [expand(item, metadata) for item in items]
+
+
+def get_since(db, isbn, since, until=None):
+    """
+    Get the prices recorded of a book in a period of time
+    :param db: the instance of the database
+    :param isbn: the ISBN-13 of the book
+    :param since: the start of the period (datetime or date, naive ones are in UTC)
+    :param until: the end of the period (datetime or date, naive ones are in UTC), None for now
+    :return: list of price observations (see expand), from the oldest to the newest
+    """
+    metadata = get_metadata(db, isbn)
+    items = [item for key_condition in get_conditions(isbn, since, until)
+             for item in query(db, key_condition) if is_current(item)]
+    return sorted((expand(item, metadata) for item in items), key=get_time)
+
+
+def migrate(db):
+    """
+    Convert the prices recorded in the previous format into the compact one.
+    The static information of each book is copied to books_to_watch, unless it is already there, and the
+    previous items of each page are only deleted once all their compact versions are written, so it can be run
+    again if it is interrupted. The items whose url is no longer in the watch list cannot be assigned to a bookstore
+    of books_to_watch, so they are kept as they are.
+    :param db: the instance of the database
+    :return: dictionary with the number of items 'migrated', and the number of items kept of each (isbn, url) that
+    is not in the watch list ('unresolved')
+    """
+    metadata = {}
+    migrated = 0
+    unresolved = Counter()
+    books_to_watch = db.Table("books_to_watch")
+    kwargs = {"TableName": TABLE, "FilterExpression": Attr("url").exists(), "ReturnConsumedCapacity": "TOTAL"}
+    price_writer = BufferedWriter(db, TABLE, keys=("isbn", "timestamp"))
+    while True:
+        response = db.meta.client.scan(**kwargs)
+        metrics.add_capacity(response)
+        converted = []
+        for item in response["Items"]:
+            isbn = item["isbn"]
+            if isbn not in metadata:
+                metadata[isbn] = get_metadata(db, isbn)
+            store = next((name for name, watch in metadata[isbn].items() if watch.get("url") == item["url"]), None)
+            if store is None:
+                unresolved[(int(isbn), item["url"])] += 1
+                continue
+            watch = metadata[isbn][store]
+            if "photo_url" not in watch:
+                books_to_watch.update_item(
+                    Key={"isbn": isbn, "bookstore": store},
+                    UpdateExpression="SET photo_url = if_not_exists(photo_url, :photo_url), "
+                                     "currency = if_not_exists(currency, :currency), "
+                                     "store_name = if_not_exists(store_name, :store_name)",
+                    ExpressionAttributeValues={":photo_url": item["photo_url"], ":currency": item["currency"],
+                                               ":store_name": item["bookstore"]}
+                )
+                watch.update(photo_url=item["photo_url"], currency=item["currency"], store_name=item["bookstore"])
+            timestamp = get_timestamp(store, parse_timestamp(item["timestamp"]))
+            price_writer.put(compact(dict(item, timestamp=timestamp)))
+            converted.append({"isbn": isbn, "timestamp": item["timestamp"]})
+        # The compact items must be written before any of the previous ones is deleted
+        price_writer.flush()
+        for key in converted:
+            price_writer.delete(key)
+        price_writer.flush()
+        migrated += len(converted)
+        if "LastEvaluatedKey" not in response:
+            return {"migrated": migrated, "unresolved": dict(unresolved)}
+        kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def enable_expiration(db):
+    """
+    Enable the TTL of books_price_data on the 'expires' attribute, so the rolled up items are deleted
+    :param db: the instance of the database
+    :return: True if it was enabled now, False if it already was
+    """
+    response = db.meta.client.describe_time_to_live(TableName=TABLE)
+    if response["TimeToLiveDescription"]["TimeToLiveStatus"] in ("ENABLED", "ENABLING"):
+        return False
+    db.meta.client.update_time_to_live(TableName=TABLE, TimeToLiveSpecification={"Enabled": True,
+                                                                                  "AttributeName": "expires"})
+    return True
+
+
+def aggregate(items, timestamp):
+    """
+    Build the aggregate of the price observations, or aggregates, of a bookstore in a period
+    :param items: the compact books_price_data items of the period, from the oldest to the newest
+    :param timestamp: the timestamp of the aggregate
+    :return: the books_price_data item with the lowest ('lo'), the highest ('hi') and the last prices
+    """
+    last = items[-1]
+    row = {
+        "isbn": last["isbn"],
+        "timestamp": timestamp,
+        "lo": min(item.get("lo", item["p"]) for item in items),
+        "hi": max(item.get("hi", item["p"]) for item in items),
+        "p": last["p"]
+    }
+    if "r" in last:
+        row["r"] = last["r"]
+    return row
+
+
+def roll(db, isbn, prefix, period, cutoff, writer, expires):
+    """
+    Replace the items of a book older than a cutoff with one aggregate per bookstore and period.
+    The items are kept until they expire, but they are no longer read. The aggregates are written before any item
+    is marked, and they are built from the items already marked too, so it can be run again if it is interrupted.
+    :param db: the instance of the database
+    :param isbn: the ISBN-13 of the book
+    :param prefix: the prefix of the items to roll up (RAW or DAILY)
+    :param period: the seconds of each period (DAY or WEEK)
+    :param cutoff: the seconds since the epoch before which the items are rolled up
+    :param writer: the BufferedWriter of books_price_data
+    :param expires: the seconds since the epoch when the rolled up items are deleted
+    :return: the number of items rolled up
+    """
+    target = DAILY if period == DAY else WEEKLY
+    groups = {}
+    for item in query(db, Key("isbn").eq(isbn) & Key("timestamp").between(prefix, f"{prefix}{cutoff:010d}")):
+        epoch = get_epoch(item["timestamp"])
+        # The epoch started on a Thursday, and the weeks start on Monday
+        start = epoch - (epoch + 3 * DAY) % period if period == WEEK else epoch - epoch % period
+        groups.setdefault(get_timestamp(get_store(item["timestamp"]), start, target), []).append(item)
+    # Only the periods with items not rolled up yet, the other ones are already aggregated
+    items = [item for group in groups.values() for item in group if is_current(item)]
+    periods = {timestamp for timestamp, group in groups.items() if any(map(is_current, group))}
+    if not periods:
+        return 0
+    # The aggregates of an interrupted rollup were built when none of their items had expired yet, so their last
+    # prices are kept, and merged with the items that were not marked
+    aggregates = {item["timestamp"]: item for item in
+                  query(db, Key("isbn").eq(isbn) & Key("timestamp").between(min(periods), max(periods)))}
+    for timestamp in periods:
+        previous = [aggregates[timestamp]] if timestamp in aggregates else []
+        writer.put(aggregate(groups[timestamp] + previous, timestamp))
+    writer.flush()
+    for item in items:
+        writer.put(dict(item, expires=expires))
+    return len(items)
+
+
+def rollup(db, now=None):
+    """
+    Downsample the old prices of every book: the observations older than RAW_RETENTION_DAYS into daily aggregates,
+    and the daily aggregates older than DAILY_RETENTION_DAYS into weekly ones. The rolled up items expire
+    through the TTL of the table (the 'expires' attribute). The prices of the previous format must be migrated first.
+    :param db: the instance of the database
+    :param now: the seconds since the epoch of the rollup (None for now)
+    :return: dictionary with the number of books, and of raw and daily items rolled up
+    """
+    now = int(time.time()) if now is None else now
+    # Whole days and weeks, so a period is never split between an aggregate and the raw items
+    raw_cutoff = (now - RAW_RETENTION_DAYS * DAY) // DAY * DAY
+    daily_cutoff = now - DAILY_RETENTION_DAYS * DAY
+    daily_cutoff -= (daily_cutoff + 3 * DAY) % WEEK
+    isbns = set()
+    kwargs = {"TableName": "books_to_watch", "ProjectionExpression": "isbn", "ReturnConsumedCapacity": "TOTAL"}
+    while True:
+        response = db.meta.client.scan(**kwargs)
+        metrics.add_capacity(response)
+        isbns.update(item["isbn"] for item in response["Items"])
+        if "LastEvaluatedKey" not in response:
+            break
+        kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    def roll_book(isbn):
+        with BufferedWriter(db, TABLE, keys=("isbn", "timestamp")) as writer:
+            raw = roll(db, isbn, RAW, DAY, raw_cutoff, writer, now)
+            # The new daily aggregates must be written before they are rolled up into weeks
+            writer.flush()
+            return raw, roll(db, isbn, DAILY, WEEK, daily_cutoff, writer, now)
+
+    stats = {"books": len(isbns), "raw": 0, "daily": 0}
+    with ThreadPoolExecutor(max_workers=ROLLUP_MAX_WORKERS) as executor:
+        for raw, daily in executor.map(roll_book, sorted(isbns)):
+            stats["raw"] += raw
+            stats["daily"] += daily
+    return stats
@@ -1,31 +1,50 @@
-from boto3.dynamodb.conditions import Attr
-
 import utils
-import bookstores
-import mail
-import tldextract
+import fanout
+import history
+import metrics
+import storage
+from settings import FANOUT_SHARDS
 
 
 def lambda_handler(event, context):
     """
-    The main function to execute
+    The main function to execute.
+    By default it scrapes the whole watch list. With {"mode": "dispatch", "shards": N}, the watch list is split
+    over N asynchronous invocations with {"mode": "worker", "shard": i, "shards": N, "run": id}, which only scrape
+    and store their shard, and the last one to finish sends the e-mail (see fanout.start). With {"mode": "rollup"},
+    it only rolls up the old prices (see history.rollup).
     :param event: the event argument provided by AWS
     :param context: the context argument provided by AWS
+    :return: the summary of the run: the number of books scraped, the books that failed or were skipped, and the
+    throughput counters of the price writes (of every worker, for the last one of a run); the id of the run started;
+    or the number of prices rolled up
     """
-    db = utils.get_db()
-    get_books_to_watch(db)
-    for book in get_books_to_watch(db):
-        getattr(bookstores, tldextract.extract(book["url"]).domain).get_info(book["url"]).store(db)
-    mail.send(mail.preprocess(db))
-
-
-def get_books_to_watch(db):
-    """
-    Get all the books to scrape prices
-    :param db: the instance of the database
-    :return: the filtered database items
-    """
-    response = db.Table("books_to_watch").scan(
-        FilterExpression=Attr("watch_status").eq(True)
-    )
-    return response['Items']
+    event = event or {}
+    metrics.reset()
+    try:
+        if event.get("mode") == "rollup":
+            # Only the DynamoDB tables are rolled up
+            return history.rollup(utils.get_db())
+        backend = storage.get_storage()
+        try:
+            if event.get("mode") == "dispatch":
+                return fanout.start(utils.get_db(), backend, event.get("shards", FANOUT_SHARDS))
+            deadline = fanout.get_deadline(context)
+            if event.get("mode") == "worker":
+                if "run" not in event:
+                    # A local process of dispatch, which waits for the result
+                    return fanout.work(backend, event["shard"], event["shards"], deadline=deadline)
+                try:
+                    stats = fanout.work(backend, event["shard"], event["shards"], deadline=deadline)
+                except Exception as err:
+                    fanout.finish(utils.get_db(), backend, event, {"error": str(err)})
+                    raise
+                # The last worker to finish sends the e-mail
+                return fanout.finish(utils.get_db(), backend, event, stats) or stats
+            stats = fanout.work(backend, deadline=deadline)
+            fanout.report(backend)
+            return stats
+        finally:
+            backend.close()
+    finally:
+        metrics.emit()
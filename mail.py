@@ -1,4 +1,4 @@
-import datetime
+import os
 import smtplib
 import ssl
 from email.mime.multipart import MIMEMultipart
@@ -6,42 +6,16 @@ from email.mime.text import MIMEText
 from email.header import Header
 from email.utils import formataddr
 
-from boto3.dynamodb.conditions import Attr, Key
-from bs4 import BeautifulSoup
-from jinja2 import Environment, select_autoescape, FileSystemLoader
-
+import history
+import metrics
+import summary
 from models import RowItem
 from settings import FROM_EMAIL, TO_EMAIL, SMTP_USERNAME, SMTP_PASSWORD, SMTP_HOST, SMTP_PORT
 
+TEMPLATES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+COMPILED_TEMPLATES = os.path.join(TEMPLATES, "compiled")
 
-def distinct(books):
-    """
-    Remove unnecessary repeating book rows from the database query
-    :param books: list of book dictionaries
-    :return: list with distinct books based on the input list
-    """
-    analysed = {}
-    distinct_books = []
-    for book in books:
-        if book["url"] not in analysed.get(book["isbn"], []):
-            if book["isbn"] in analysed:
-                analysed[book["isbn"]].append(book["url"])
-            else:
-                analysed[book["isbn"]] = [book["url"]]
-            distinct_books.append(book)
-    return distinct_books
-
-
-def get_book_to_watch_qty(db, isbn):
-    """
-    Get the number of different bookstores with the same book to watch
-    :param db: the instance of the database
-    :param isbn: the ISBN-13 of the book
-    :return: the number of bookstores
-    """
-    return len(db.Table("books_to_watch").scan(
-        FilterExpression=Attr("watch_status").eq(True) & Attr("isbn").eq(isbn)
-    )["Items"])
+_environment = None
 
 
 def order_promo_prices(array, offer):
@@ -58,90 +32,171 @@ def order_promo_prices(array, offer):
 
 def get_cheapest_offer(array):
     """
-    Order a list of books based on the 'promo_price' attribute
-    :param array: the list to sort
+    Get the cheapest book of a list based on the 'promo_price' attribute
+    :param array: the list of books
     :return: the cheapest book available
     """
-    return sorted(array, key=lambda i: i["promo_price"])[0]
-
-
-def get_similar_offers(data, max_len_offers):
-    """
-    Order a list of books based on the 'timestamp' attribute to get the similar offers available
-    :param data: the list to sort
-    :param max_len_offers: the maximum number of elements
-    :return: the similar offers for a book
-    """
-    return sorted(data, key=lambda i: i["timestamp"], reverse=True)[:max_len_offers]
+    return min(array, key=lambda i: i["promo_price"])
 
 
 def strptime_to_str(timestamp):
     """
     Return a string representation of the date only given a timestamp string
-    :param timestamp: string representation of time in the format '%Y-%m-%d %H:%M:%S.%f'
+    :param timestamp: the timestamp of a price observation, in any of the formats of history.parse_timestamp
     :return: the date string of the given timestamp
     """
-    return datetime.datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S.%f').date()
+    return history.parse_timestamp(timestamp).date()
 
 
-def get_lowest_values(ordered_list):
+def get_lowest_values(offer):
     """
     Create all the lowest values for the e-mail construction
-    :param ordered_list: the ordered list based on the 'promo_price' attribute
+    :param offer: the lowest offer recorded of a book
     :return: lowest, lowest_date, lowest_price_discount, lowest_bookstore variables
     """
-    lowest = f"{ordered_list[0]['promo_price']}{ordered_list[0]['currency']}"
-    lowest_date = strptime_to_str(ordered_list[0]["timestamp"])
-    lowest_price_discount = (1 - float(ordered_list[0]["promo_price"]) / float(
-        ordered_list[0]["regular_price"])) * 100
-    lowest_bookstore = ordered_list[0]["bookstore"]
+    lowest = f"{offer['promo_price']}{offer['currency']}"
+    lowest_date = strptime_to_str(offer["timestamp"])
+    lowest_price_discount = (1 - float(offer["promo_price"]) / float(offer["regular_price"])) * 100
+    lowest_bookstore = offer["bookstore"]
     return lowest, lowest_date, lowest_price_discount, lowest_bookstore
 
 
-def get_highest_values(ordered_list):
+def get_highest_values(offer):
     """
     Create all the highest values for the e-mail construction
-    :param ordered_list: the ordered list based on the 'promo_price' attribute
+    :param offer: the highest offer recorded of a book
     :return: highest, highest_date, highest_price_discount, highest_bookstore variables
     """
-    highest = f"{ordered_list[-1]['promo_price']}{ordered_list[-1]['currency']}"
-    highest_date = strptime_to_str(ordered_list[-1]["timestamp"])
-    highest_price_discount = (1 - float(ordered_list[-1]["promo_price"]) / float(
-        ordered_list[-1]["regular_price"])) * 100
-    highest_bookstore = ordered_list[-1]["bookstore"]
+    highest = f"{offer['promo_price']}{offer['currency']}"
+    highest_date = strptime_to_str(offer["timestamp"])
+    highest_price_discount = (1 - float(offer["promo_price"]) / float(offer["regular_price"])) * 100
+    highest_bookstore = offer["bookstore"]
     return highest, highest_date, highest_price_discount, highest_bookstore
 
 
-def preprocess(db):
+def get_row(isbn, book_summary, urls):
+    """
+    Create the e-mail row of a book
+    :param isbn: the ISBN-13 of the book
+    :param book_summary: the books_price_summary item of the book
+    :param urls: the urls where the book is watched
+    :return: RowItem instance, or None if there is no offer from the watched urls
+    """
+    offers = [book_summary["offers"][url] for url in urls if url in book_summary["offers"]]
+    if not offers:
+        return None
+    lowest, lowest_date, lowest_price_discount, lowest_bookstore = get_lowest_values(book_summary["lowest"])
+    highest, highest_date, highest_price_discount, highest_bookstore = get_highest_values(book_summary["highest"])
+    current_price = get_cheapest_offer(offers)
+    current_discount = (1 - float(current_price["promo_price"]) / float(current_price["regular_price"])) * 100
+    other_offers = order_promo_prices(offers, current_price)
+    return RowItem(isbn, current_price["promo_price"], current_price["regular_price"],
+                   current_price["currency"], current_price["bookstore"], current_price["url"],
+                   highest, highest_date, highest_price_discount, highest_bookstore, lowest,
+                   lowest_date, lowest_price_discount, lowest_bookstore, current_discount,
+                   current_price["photo_url"], other_offers)
+
+
+def add_scraped(summaries, books):
+    """
+    Add the prices just scraped, which were not stored, to the summaries of the watched books, as storing them
+    would (see Storage.store)
+    :param summaries: list of (isbn, summary, urls) tuples (see Storage.get_summaries)
+    :param books: list of (book to watch, Book instance) tuples, as returned by scraper.scrape
+    :return: list of (isbn, summary, urls) tuples sorted by isbn
+    """
+    merged = {int(isbn): (book_summary, urls) for isbn, book_summary, urls in summaries}
+    items = {}
+    for book_to_watch, book in books:
+        isbn = int(book_to_watch["isbn"])
+        book_summary, urls = merged.get(isbn, (None, set()))
+        merged[isbn] = book_summary, urls | {book_to_watch["url"]}
+        item = book.to_item(book_to_watch["bookstore"])
+        if not summary.is_unchanged((book_summary or {}).get("offers", {}).get(book.url), item):
+            items.setdefault(isbn, []).append(item)
+    for isbn, new_items in items.items():
+        book_summary, urls = merged[isbn]
+        merged[isbn] = summary.merge(book_summary, new_items), urls
+    return [(isbn, *merged[isbn]) for isbn in sorted(merged) if merged[isbn][0] is not None]
+
+
+def preprocess(storage, books=None):
     """
     The preprocessing of the data collected
-    :param db: the instance of the database
+    :param storage: the Storage instance of the database
+    :param books: the books just scraped that were not stored, as returned by scraper.scrape (None if they were)
     :return: instances of RowItem splitted into groups of 3
     """
-    books = db.Table("books_to_watch").scan(
-        FilterExpression=Attr("watch_status").eq(True)
-    )["Items"]
-    content = []
-    seen = []
-    for book in books:
-        if book["isbn"] not in seen:
-            data = db.Table("books_price_data").query(KeyConditionExpression=Key("isbn").eq(book["isbn"]))["Items"]
-            ordered_list = sorted(data, key=lambda i: i["promo_price"])
-            lowest, lowest_date, lowest_price_discount, lowest_bookstore = get_lowest_values(ordered_list)
-            highest, highest_date, highest_price_discount, highest_bookstore = get_highest_values(ordered_list)
-            max_len_offers = get_book_to_watch_qty(db, book["isbn"])
-            current_price = get_cheapest_offer(get_similar_offers(data, max_len_offers))
-            current_discount = (1 - float(current_price["promo_price"]) / float(current_price["regular_price"])) * 100
-            other_offers = order_promo_prices(get_similar_offers(data, max_len_offers), current_price)
-            content.append(RowItem(book["isbn"], current_price["promo_price"], current_price["regular_price"],
-                                   current_price["currency"], current_price["bookstore"], current_price["url"],
-                                   highest, highest_date, highest_price_discount, highest_bookstore, lowest,
-                                   lowest_date, lowest_price_discount, lowest_bookstore, current_discount,
-                                   current_price["photo_url"], other_offers))
-            seen.append(book["isbn"])
+    summaries = storage.get_summaries()
+    if books:
+        summaries = add_scraped(summaries, books)
+    rows = (get_row(isbn, book_summary, urls) for isbn, book_summary, urls in summaries)
+    content = [row for row in rows if row]
     return [content[i * 3:(i + 1) * 3] for i in range((len(content) + 3 - 1) // 3)]
 
 
+def get_environment():
+    """
+    Get the Jinja environment of the e-mail templates, created only once per container.
+    Templates precompiled with compile_templates are loaded as Python modules, so they are never parsed at runtime.
+    :return: Jinja's Environment object
+    """
+    global _environment
+    if _environment is None:
+        # Only needed to send the e-mail, so it is not imported on the Lambda cold start
+        from jinja2 import ChoiceLoader, FileSystemLoader, ModuleLoader
+        loaders = [FileSystemLoader(TEMPLATES)]
+        if os.path.isdir(COMPILED_TEMPLATES):
+            loaders.insert(0, ModuleLoader(COMPILED_TEMPLATES))
+        _environment = create_environment(ChoiceLoader(loaders))
+    return _environment
+
+
+def create_environment(loader):
+    """
+    Create a Jinja environment with the settings of the e-mail templates
+    :param loader: the Jinja loader of the templates
+    :return: Jinja's Environment object
+    """
+    from jinja2 import Environment, select_autoescape
+    return Environment(loader=loader, autoescape=select_autoescape(['html']))
+
+
+def compile_templates(target=COMPILED_TEMPLATES):
+    """
+    Compile all the e-mail templates into Python modules, to be loaded by get_environment
+    :param target: the folder of the compiled templates
+    """
+    from jinja2 import FileSystemLoader
+    create_environment(FileSystemLoader(TEMPLATES)).compile_templates(target, zip=None, ignore_errors=False)
+
+
+def render(data):
+    """
+    Render the plain-text and the HTML versions of the e-mail
+    :param data: data previously collected and analyzed in preprocess method
+    :return: the plain-text and the HTML contents
+    """
+    env = get_environment()
+    return env.get_template('mail.txt').render(rows=data), env.get_template('mail.html').render(rows=data)
+
+
+def save(data, path):
+    """
+    Write the e-mail to files instead of sending it
+    :param data: data previously collected and analyzed in preprocess method
+    :param path: the path of the HTML version, next to which the plain-text version is written with .txt
+    :return: the paths of the plain-text and the HTML files
+    """
+    with metrics.timer("RenderTime"):
+        text, html = render(data)
+    text_path = os.path.splitext(path)[0] + ".txt"
+    for file_path, content in ((text_path, text), (path, html)):
+        with open(file_path, "w", encoding="utf-8") as file:
+            file.write(content)
+    return text_path, path
+
+
 def send(data):
     """
     Send the e-mail with all the information collected
@@ -156,16 +211,9 @@ def send(data):
     msg['From'] = sender
     msg['To'] = receiver
 
-    env = Environment(
-        loader=FileSystemLoader('templates'),
-        autoescape=select_autoescape(['html'])
-    )
-
-    template = env.get_template('mail.html')
-
     # Create the body of the message (a plain-text and an HTML version).
-    html = template.render(rows=data)
-    text = BeautifulSoup(html, features="html.parser").get_text('\n')
+    with metrics.timer("RenderTime"):
+        text, html = render(data)
 
     # Record the MIME types of both parts - text/plain and text/html.
     part1 = MIMEText(text, 'plain')
@@ -180,6 +228,6 @@ def send(data):
     # Create a secure SSL context
     context = ssl.create_default_context()
 
-    with smtplib.SMTP_SSL(SMTP_HOST, SMTP_PORT, context=context) as server:
+    with metrics.timer("SmtpTime"), smtplib.SMTP_SSL(SMTP_HOST, SMTP_PORT, context=context) as server:
         server.login(SMTP_USERNAME, SMTP_PASSWORD)
         server.sendmail(sender, receiver, msg.as_string())
@@ -0,0 +1,198 @@
+import bisect
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+NAMESPACE = "TheBookIsRight"
+# Upper bounds, in milliseconds, of the buckets of the latency histograms (the last bucket has no bound)
+BUCKETS = (50, 100, 250, 500, 1000, 2500, 5000, 10000)
+BUCKET_NAMES = [str(bound) for bound in BUCKETS] + ["+Inf"]
+# The CloudWatch unit of the metrics, by the suffix of their name
+UNITS = {"Time": "Milliseconds", "Bytes": "Bytes"}
+
+_lock = threading.Lock()
+_run = {"metrics": {}, "histograms": {}}
+_bookstores = {}
+
+
+def get_unit(name):
+    """
+    Get the CloudWatch unit of a metric
+    :param name: the name of the metric
+    :return: the unit of the metric ('Count' by default)
+    """
+    return next((unit for suffix, unit in UNITS.items() if name.endswith(suffix)), "Count")
+
+
+def get_scope(bookstore):
+    """
+    Get the metrics of the run, or of a single bookstore
+    :param bookstore: the name of the bookstore, or None for the whole run
+    :return: dictionary with the 'metrics' and 'histograms' dictionaries
+    """
+    if bookstore is None:
+        return _run
+    return _bookstores.setdefault(bookstore, {"metrics": {}, "histograms": {}})
+
+
+def reset():
+    """
+    Clear all the metrics, since a warm Lambda container keeps the module between runs
+    """
+    with _lock:
+        _run["metrics"].clear()
+        _run["histograms"].clear()
+        _bookstores.clear()
+
+
+def add(name, value=1, bookstore=None):
+    """
+    Add a value to the total of a metric
+    :param name: the name of the metric
+    :param value: the value to add
+    :param bookstore: the name of the bookstore, or None for the whole run
+    """
+    with _lock:
+        metrics = get_scope(bookstore)["metrics"]
+        metrics[name] = metrics.get(name, 0) + value
+
+
+def add_capacity(response):
+    """
+    Add the DynamoDB capacity consumed by a request, sent with ReturnConsumedCapacity='TOTAL'
+    :param response: the response of the request
+    """
+    capacity = response.get("ConsumedCapacity", [])
+    # The batch requests return the capacity of each table
+    if isinstance(capacity, dict):
+        capacity = [capacity]
+    add("ConsumedCapacity", sum(float(table.get("CapacityUnits", 0)) for table in capacity))
+
+
+def observe(name, value, bookstore=None):
+    """
+    Add a latency to the total and to the histogram of a metric
+    :param name: the name of the metric
+    :param value: the latency in milliseconds
+    :param bookstore: the name of the bookstore, or None for the whole run
+    """
+    with _lock:
+        scope = get_scope(bookstore)
+        scope["metrics"][name] = scope["metrics"].get(name, 0) + value
+        histogram = scope["histograms"].setdefault(name, [0] * len(BUCKET_NAMES))
+        histogram[bisect.bisect_left(BUCKETS, value)] += 1
+
+
+@contextmanager
+def timer(name, bookstore=None):
+    """
+    Measure the time of a block of code, even if it raises an exception.
+    The stages of the run are totals, the operations of a bookstore also have a histogram.
+    :param name: the name of the metric (ending with 'Time')
+    :param bookstore: the name of the bookstore, or None for the whole run
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = (time.perf_counter() - start) * 1000
+        if bookstore is None:
+            add(name, elapsed)
+        else:
+            observe(name, elapsed, bookstore)
+
+
+def get_records(timestamp=None):
+    """
+    Get the metrics in the CloudWatch Embedded Metric Format: one record for the run, and one for each bookstore
+    with the 'Bookstore' dimension. The histograms are extra properties, visible in CloudWatch Logs Insights.
+    :param timestamp: the time of the metrics in seconds since the epoch (defaults to now)
+    :return: list of EMF dictionaries
+    """
+    timestamp = int((timestamp if timestamp is not None else time.time()) * 1000)
+    with _lock:
+        scopes = [(None, _run)] + sorted(_bookstores.items())
+        records = []
+        for bookstore, scope in scopes:
+            record = {
+                "_aws": {
+                    "Timestamp": timestamp,
+                    "CloudWatchMetrics": [{
+                        "Namespace": NAMESPACE,
+                        "Dimensions": [["Bookstore"]] if bookstore else [[]],
+                        "Metrics": [{"Name": name, "Unit": get_unit(name)} for name in sorted(scope["metrics"])]
+                    }]
+                }
+            }
+            if bookstore:
+                record["Bookstore"] = bookstore
+            record.update(scope["metrics"])
+            for name, histogram in scope["histograms"].items():
+                record[name + "Histogram"] = dict(zip(BUCKET_NAMES, histogram))
+            records.append(record)
+    return records
+
+
+def emit():
+    """
+    Print the metrics as JSON lines, which CloudWatch turns into metrics when printed by a Lambda function
+    :return: the list of EMF dictionaries printed
+    """
+    records = get_records()
+    for record in records:
+        print(json.dumps(record, default=float))
+    return records
+
+
+def summarize(lines):
+    """
+    Add up the metrics of all the runs in a log
+    :param lines: iterable of log lines (the lines without an EMF record are ignored)
+    :return: dictionary with the number of 'runs', the 'run' metrics and the metrics of the 'bookstores'
+    """
+    summary = {"runs": 0, "run": {"metrics": {}, "histograms": {}}, "bookstores": {}}
+    for line in lines:
+        # CloudWatch exports prefix each line with the time and the request id
+        start = line.find("{")
+        if start < 0:
+            continue
+        try:
+            record = json.loads(line[start:])
+        except ValueError:
+            continue
+        if not isinstance(record, dict) or "_aws" not in record:
+            continue
+        if "Bookstore" in record:
+            scope = summary["bookstores"].setdefault(record["Bookstore"], {"metrics": {}, "histograms": {}})
+        else:
+            scope = summary["run"]
+            summary["runs"] += 1
+        for definition in record["_aws"]["CloudWatchMetrics"]:
+            for metric in definition["Metrics"]:
+                name = metric["Name"]
+                scope["metrics"][name] = scope["metrics"].get(name, 0) + record.get(name, 0)
+                histogram = record.get(name + "Histogram")
+                if histogram:
+                    total = scope["histograms"].setdefault(name, dict.fromkeys(BUCKET_NAMES, 0))
+                    for bucket, count in histogram.items():
+                        total[bucket] = total.get(bucket, 0) + count
+    return summary
+
+
+def percentile(histogram, fraction):
+    """
+    Estimate a percentile from a histogram
+    :param histogram: dictionary with the count of each bucket, by the name of the bucket
+    :param fraction: the percentile between 0 and 1 (e.g. 0.9)
+    :return: the name of the bucket with the percentile (its upper bound), or None for an empty histogram
+    """
+    total = sum(histogram.values())
+    if not total:
+        return None
+    seen = 0
+    for bucket in BUCKET_NAMES:
+        seen += histogram.get(bucket, 0)
+        if seen >= fraction * total:
+            return bucket
+
@@ -1,6 +1,7 @@
-from datetime import datetime
 from decimal import Decimal
 
+import history
+
 
 class Book:
     """
@@ -123,24 +124,38 @@ class Book:
         """
         self.photo_url = photo_url
 
-    def store(self, db):
-        """
-        Store this Book instance in the database
-        :param db: the instance of the database
-        """
-        db.Table("books_price_data").put_item(
-            Item={
-                "isbn": self.isbn,
-                "promo_price": Decimal(str(self.promo_price))
-                if self.promo_price is not None else Decimal(str(self.regular_price)),
-                "regular_price": Decimal(str(self.regular_price)),
-                "currency": self.currency,
-                "bookstore": self.bookstore,
-                "url": self.url,
-                "photo_url": self.photo_url,
-                "timestamp": str(datetime.now())
-            }
-        )
+    def to_dict(self):
+        """
+        Get the dictionary representation of the Book instance
+        :return: dictionary with the arguments of the constructor
+        """
+        return {
+            "isbn": self.isbn,
+            "promo_price": self.promo_price,
+            "regular_price": self.regular_price,
+            "currency": self.currency,
+            "bookstore": self.bookstore,
+            "url": self.url,
+            "photo_url": self.photo_url
+        }
+
+    def to_item(self, store):
+        """
+        Get the complete price observation of this Book instance, observed now
+        :param store: the bookstore of the book, as in the books_to_watch key
+        :return: the price observation, in the format returned by history.expand
+        """
+        return {
+            "isbn": self.isbn,
+            "promo_price": Decimal(str(self.promo_price))
+            if self.promo_price is not None else Decimal(str(self.regular_price)),
+            "regular_price": Decimal(str(self.regular_price)),
+            "currency": self.currency,
+            "bookstore": self.bookstore,
+            "url": self.url,
+            "photo_url": self.photo_url,
+            "timestamp": history.get_timestamp(store)
+        }
 
     def __str__(self):
         """
@@ -0,0 +1,207 @@
+import heapq
+import random
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlparse
+
+import requests
+
+import bookstores
+import metrics
+from settings import MAX_WORKERS, MAX_WORKERS_PER_DOMAIN, RETRY_BUDGET, MAX_ATTEMPTS, RETRY_BACKOFF, \
+    BREAKER_THRESHOLD
+
+# The books waiting for a free slot of their host, by worker, before no more books are read from the watch list
+PARKED_PER_WORKER = 4
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker of each host: after a number of consecutive books that failed, the host is considered down
+    and its remaining books are skipped, instead of each one waiting for its own timeouts
+    """
+    def __init__(self, threshold=BREAKER_THRESHOLD):
+        """
+        The constructor for CircuitBreaker
+        :param threshold: the number of consecutive failed books that open the circuit of a host
+        """
+        self.threshold = threshold
+        self.failures = Counter()
+
+    def is_open(self, domain):
+        """
+        Check if the books of a host should be skipped
+        :param domain: the host name (see get_domain)
+        :return: True if the host failed too many consecutive times
+        """
+        return self.failures[domain] >= self.threshold
+
+    def success(self, domain):
+        """
+        Record a book scraped successfully, which closes the circuit unless it is already open
+        :param domain: the host name (see get_domain)
+        """
+        if not self.is_open(domain):
+            self.failures[domain] = 0
+
+    def failure(self, domain):
+        """
+        Record a book that failed, once it is not tried again
+        :param domain: the host name (see get_domain)
+        """
+        self.failures[domain] += 1
+
+
+def get_domain(url):
+    """
+    Get the host used to limit the concurrent requests to the same website
+    :param url: the url of the book in the bookstore
+    :return: the host name of the given url
+    """
+    return urlparse(url).hostname
+
+
+def get_info(url):
+    """
+    Fetch and parse a single book with the scraper of its bookstore
+    :param url: the url of the book in the bookstore
+    :return: Book instance with the information collected
+    """
+    try:
+        return bookstores.get_scraper(url).get_info(url)
+    except Exception:
+        metrics.add("Errors", bookstore=bookstores.get_name(url))
+        raise
+
+
+def get_failure(book, bookstore, error=None, reason=None):
+    """
+    Describe a book that could not be scraped
+    :param book: the book to watch
+    :param bookstore: the name of the bookstore of the book
+    :param error: the exception raised by the last attempt, or None if the book was skipped
+    :param reason: why the book was skipped (by default, because its bookstore failed too many times)
+    :return: dictionary with the isbn, bookstore, url and error of the book, and whether it was skipped
+    """
+    return {
+        "isbn": int(book["isbn"]) if book.get("isbn") is not None else None,
+        "bookstore": bookstore,
+        "url": book["url"],
+        "error": f"{type(error).__name__}: {error}" if error else reason or f"{bookstore} failed too many times",
+        "skipped": error is None
+    }
+
+
+def scrape(books, max_workers=MAX_WORKERS, max_per_domain=MAX_WORKERS_PER_DOMAIN, retry_budget=RETRY_BUDGET,
+           max_attempts=MAX_ATTEMPTS, breaker=None, max_parked=None, deadline=None, retry_backoff=RETRY_BACKOFF):
+    """
+    Scrape all the given books concurrently.
+    At most max_workers pages are processed at the same time, and never more than max_per_domain of them
+    from the same host, so the total time is bound by the slowest bookstore instead of the sum of all requests.
+    The books are read as they are needed: once max_parked of them are waiting for their host, no more are read
+    until one of them starts, so the memory used does not depend on the size of the watch list.
+    A book that fails never stops the others: only network errors are tried again, after a random exponential
+    backoff and while the retry budget of the run lasts, and the remaining books of a host are skipped once its
+    circuit breaker opens. After the deadline, no more books are started: the remaining ones are skipped once the
+    running ones finish.
+    :param books: iterable of books to watch (dictionaries with, at least, the 'url' key)
+    :param max_workers: the maximum number of books being scraped at the same time
+    :param max_per_domain: the maximum number of books being scraped at the same time from the same host
+    :param retry_budget: the maximum number of retries of the whole run
+    :param max_attempts: the maximum number of attempts of each book
+    :param breaker: the CircuitBreaker of the hosts (a new one by default)
+    :param max_parked: the maximum number of books waiting for their host (PARKED_PER_WORKER per worker by default)
+    :param deadline: the time.time() after which no more books are started (None to scrape all of them)
+    :param retry_backoff: the base number of seconds of the exponential backoff before a book is tried again
+    :return: list of (book to watch, Book instance) tuples in the same order as the given books, and list of the
+    books that failed or were skipped (see get_failure)
+    """
+    books = enumerate(books)
+    breaker = breaker or CircuitBreaker()
+    max_parked = max_parked or PARKED_PER_WORKER * max_workers
+    results = {}
+    failures = {}
+    parked = {}
+    # The books to try again, as (time to retry, index, book, attempt, domain) tuples
+    delayed = []
+    running = {}
+    in_flight = Counter()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        def submit(index, book, attempt, domain):
+            if breaker.is_open(domain):
+                bookstore = bookstores.get_name(book["url"])
+                metrics.add("Skipped", bookstore=bookstore)
+                failures[index] = get_failure(book, bookstore, reason=f"{domain} failed too many times")
+                return
+            running[executor.submit(get_info, book["url"])] = (index, book, attempt, domain)
+            in_flight[domain] += 1
+
+        def skip(index, book):
+            bookstore = bookstores.get_name(book["url"])
+            metrics.add("Skipped", bookstore=bookstore)
+            failures[index] = get_failure(book, bookstore, reason="not scraped before the deadline")
+
+        def fill():
+            if deadline is not None and time.time() >= deadline:
+                for queue in parked.values():
+                    while queue:
+                        skip(*queue.popleft()[:2])
+                while delayed:
+                    skip(*heapq.heappop(delayed)[1:3])
+                for index, book in books:
+                    skip(index, book)
+                return
+            # The retries whose backoff is over are tried again as soon as their host has a free slot
+            while delayed and delayed[0][0] <= time.time():
+                _, index, book, attempt, domain = heapq.heappop(delayed)
+                parked.setdefault(domain, deque()).appendleft((index, book, attempt))
+            # Resume the books waiting for their host to free a slot, one host at a time
+            progress = True
+            while progress and len(running) < max_workers:
+                progress = False
+                for domain, queue in parked.items():
+                    if queue and in_flight[domain] < max_per_domain and len(running) < max_workers:
+                        submit(*queue.popleft(), domain)
+                        progress = True
+            # Then consume new books while there are free workers, unless too many books are already waiting
+            while len(running) < max_workers and sum(map(len, parked.values())) < max_parked:
+                try:
+                    index, book = next(books)
+                except StopIteration:
+                    return
+                domain = get_domain(book["url"])
+                if in_flight[domain] < max_per_domain:
+                    submit(index, book, 1, domain)
+                else:
+                    parked.setdefault(domain, deque()).append((index, book, 1))
+
+        fill()
+        while running or delayed:
+            # Wake up for the next retry, even if no book finishes before it
+            timeout = max(0, delayed[0][0] - time.time()) if delayed else None
+            if running:
+                done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+            else:
+                time.sleep(timeout)
+                done = ()
+            for future in done:
+                index, book, attempt, domain = running.pop(future)
+                in_flight[domain] -= 1
+                bookstore = bookstores.get_name(book["url"])
+                try:
+                    results[index] = book, future.result()
+                    breaker.success(domain)
+                except Exception as err:
+                    if isinstance(err, requests.RequestException) and attempt < max_attempts and retry_budget > 0:
+                        retry_budget -= 1
+                        metrics.add("Retries", bookstore=bookstore)
+                        retry = time.time() + random.uniform(0, retry_backoff * 2 ** (attempt - 1))
+                        heapq.heappush(delayed, (retry, index, book, attempt + 1, domain))
+                    else:
+                        breaker.failure(domain)
+                        failures[index] = get_failure(book, bookstore, err)
+            fill()
+
+    return [results[index] for index in sorted(results)], [failures[index] for index in sorted(failures)]
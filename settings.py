@@ -10,6 +10,69 @@ SMTP_USERNAME = ""
 SMTP_PASSWORD = ""
 SMTP_HOST = ""
 SMTP_PORT = 465
+MAIL_MAX_WORKERS = 8
 
 #CRON SETTINGS
-CRON = "0 19 * * ? *"
\ No newline at end of file
+CRON = "0 19 * * ? *"
+
+# SCRAPER SETTINGS
+MAX_WORKERS = 16
+MAX_WORKERS_PER_DOMAIN = 2
+# The number of failed requests of a run that are tried again (timeouts, connection errors...)
+RETRY_BUDGET = 20
+# The number of times a single book is tried
+MAX_ATTEMPTS = 2
+# The base number of seconds of the random exponential backoff before a failed book is tried again
+RETRY_BACKOFF = 1.0
+# The number of consecutive failures after which the remaining books of a bookstore are skipped
+BREAKER_THRESHOLD = 5
+
+# FAN-OUT SETTINGS
+# The number of worker invocations that share the watch list (1 scrapes everything in a single invocation)
+FANOUT_SHARDS = 1
+# The seconds of each invocation kept to store the prices and send the e-mail: no more books are scraped after that
+FANOUT_RESERVED_SECONDS = 120
+
+# HTTP SETTINGS
+HTTP_POOL_SIZE = 4
+HTTP_TIMEOUT = (5, 30)
+# The attempts to connect again to a host that refused or did not answer the connection
+HTTP_RETRIES = 3
+HTTP_BACKOFF_FACTOR = 0.5
+HTTP_CACHE_DIR = "/tmp/thebookisright/cache"
+
+# PARSER SETTINGS
+PARSER = "lxml"
+
+# DATABASE SETTINGS
+WRITE_BATCH_SIZE = 25
+WRITE_MAX_RETRIES = 8
+WRITE_BACKOFF = 0.1
+SCAN_SEGMENTS = 4
+# The last time each book was seen with the same prices is only written again after this many days
+SEEN_REFRESH_DAYS = 7
+# The books_to_watch items updated at the same time after each run
+WATCH_MAX_WORKERS = 8
+
+# STORAGE SETTINGS
+# The database of the watch list and the prices: "dynamodb" (the deployed function), "sqlite" or "postgresql"
+STORAGE_BACKEND = "dynamodb"
+# Relative to the ~/.thebookisright folder, unless it is an absolute path
+SQLITE_PATH = "thebookisright.db"
+POSTGRESQL_DSN = ""
+# The books of import-books written at a time
+IMPORT_BATCH_SIZE = 500
+# The books of import-books written at the same time to DynamoDB
+IMPORT_MAX_WORKERS = 8
+
+# HISTORY SETTINGS
+# The prices older than this are rolled up into daily aggregates, and the daily aggregates into weekly ones
+RAW_RETENTION_DAYS = 30
+DAILY_RETENTION_DAYS = 365
+ROLLUP_CRON = "0 3 ? * SUN *"
+ROLLUP_MAX_WORKERS = 8
+
+# DEPLOYMENT SETTINGS
+ARTIFACT_EXCLUDED_PACKAGES = ["pip", "setuptools", "wheel", "pkg_resources", "_distutils_hack", "easy_install.py",
+                              "psycopg2", "psycopg2_binary.libs", "typer", "click", "tabulate", "docutils", "bin"]
+ARTIFACT_BOTO_SERVICES = ["dynamodb", "lambda"]
@@ -0,0 +1,24 @@
+import importlib
+
+from settings import STORAGE_BACKEND
+from storage.base import Storage
+
+# The module and the class of each backend, imported only when it is used (psycopg2 is not part of the artifact)
+BACKENDS = {
+    "dynamodb": ("dynamodb", "DynamoDBStorage"),
+    "sqlite": ("sqlite", "SQLiteStorage"),
+    "postgresql": ("postgresql", "PostgreSQLStorage")
+}
+
+
+def get_storage(backend=STORAGE_BACKEND, **kwargs):
+    """
+    Connect to the database of the watch list and the prices
+    :param backend: the name of the backend: 'dynamodb', 'sqlite' or 'postgresql'
+    :param kwargs: the arguments of the constructor of the backend (e.g. path for SQLite, dsn for PostgreSQL)
+    :return: Storage instance
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"There is no storage backend '{backend}'. The available ones are: {', '.join(BACKENDS)}")
+    module, name = BACKENDS[backend]
+    return getattr(importlib.import_module(f"{__name__}.{module}"), name)(**kwargs)
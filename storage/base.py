@@ -0,0 +1,105 @@
+from abc import ABC, abstractmethod
+
+
+class Storage(ABC):
+    """
+    The database of the watch list, the price history and the summaries of the books.
+    Every backend returns the books and the prices as dictionaries in the same format, so the rest of the code
+    never depends on the database that stores them.
+    """
+    @abstractmethod
+    def get_books(self, bookstore=None, watch_status=None, limit=None):
+        """
+        Stream the books of the watch list, as they are read from the database
+        :param bookstore: the only bookstore to list, None for all of them
+        :param watch_status: True for the watched books only, False for the unwatched ones, None for all of them
+        :param limit: the maximum number of books, None for all of them
+        :return: generator of books_to_watch items, with only the isbn, bookstore, url, watch_status and the name of
+        the bookstore (when the book was already scraped)
+        """
+
+    @abstractmethod
+    def get_books_to_watch(self, shard=None, shards=None):
+        """
+        Stream the books to scrape prices
+        :param shard: the only shard of the watch list to read, when the watch list is split over several runs
+        :param shards: the total number of shards the watch list is split into (required with shard)
+        :return: generator of the watched books, with the isbn, bookstore and url, the static information of the
+        book in the bookstore (see utils.METADATA) and the cache entry of its page (see cache.prime)
+        """
+
+    @abstractmethod
+    def add_book(self, isbn, bookstore, url):
+        """
+        Add a book to the watch list, or replace the url of a book already in it
+        :param isbn: the ISBN-13 of the book
+        :param bookstore: the name of the bookstore
+        :param url: the url of the book in the bookstore
+        """
+
+    @abstractmethod
+    def add_books(self, books):
+        """
+        Add books to the watch list in bulk, or replace the url and watch status of the ones already in it
+        :param books: list of books_to_watch items (isbn, bookstore, url and watch_status)
+        :return: list of (books_to_watch item, error message) tuples of the books that could not be added
+        """
+
+    @abstractmethod
+    def set_watch_status(self, isbn, bookstore, watch_status):
+        """
+        Stop or resume watching the price of a book
+        :param isbn: the ISBN-13 of the book
+        :param bookstore: the name of the bookstore
+        :param watch_status: whether the book is scraped
+        """
+
+    @abstractmethod
+    def delete_book(self, isbn, bookstore):
+        """
+        Delete a book from the watch list. Its price history is kept, and so is the static information of the book
+        in the bookstore that the price history needs (the book is only marked as deleted).
+        :param isbn: the ISBN-13 of the book
+        :param bookstore: the name of the bookstore
+        """
+
+    @abstractmethod
+    def store(self, books):
+        """
+        Record the prices of the books just scraped, only when they changed, and keep their static information
+        :param books: list of (book to watch, Book instance) tuples, as returned by scraper.scrape
+        :return: dictionary with the number of books whose prices did not change, and the throughput counters of
+        the price writes (see writer.BufferedWriter.get_stats)
+        """
+
+    @abstractmethod
+    def get_history(self, isbn, since=None, until=None, limit=None):
+        """
+        Get the prices recorded of a book
+        :param isbn: the ISBN-13 of the book
+        :param since: the start of the period (datetime or date, naive ones are in UTC), None for all
+        :param until: the end of the period (datetime or date, naive ones are in UTC), None for now
+        :param limit: the number of latest prices, None for all of them
+        :return: list of price observations (see history.expand), from the oldest to the newest, or from the newest
+        to the oldest with a limit
+        """
+
+    @abstractmethod
+    def get_all_history(self):
+        """
+        Stream the prices recorded of every book, as they are read from the database
+        :return: generator of price observations (see history.expand)
+        """
+
+    @abstractmethod
+    def get_summaries(self):
+        """
+        Get the summaries of the prices of the watched books, to build the e-mail
+        :return: list of (isbn, summary, urls) tuples sorted by isbn, where the summary has the lowest and highest
+        offers recorded and the last offer of each url (see summary.build), and urls are the watched urls of the book
+        """
+
+    def close(self):
+        """
+        Release the connection to the database
+        """
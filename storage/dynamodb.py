@@ -0,0 +1,183 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import reduce
+from itertools import islice
+from operator import and_
+
+from boto3.dynamodb.conditions import Attr
+from botocore.exceptions import ClientError
+
+import history
+import summary
+import utils
+from settings import MAIL_MAX_WORKERS, IMPORT_MAX_WORKERS, WATCH_MAX_WORKERS
+from storage.base import Storage
+from writer import BufferedWriter
+
+
+class DynamoDBStorage(Storage):
+    """
+    The tables of the deployed function: books_to_watch, books_price_data (see history) and books_price_summary
+    (see summary)
+    """
+    def __init__(self, db=None):
+        """
+        The constructor for DynamoDBStorage
+        :param db: the instance of the database (a new one by default, see utils.get_db)
+        """
+        self.db = db or utils.get_db()
+
+    def get_books(self, bookstore=None, watch_status=None, limit=None):
+        attributes = ["isbn", "bookstore", "url", "watch_status", "store_name"]
+        kwargs = {
+            "ProjectionExpression": ", ".join(f"#{attribute}" for attribute in attributes),
+            "ExpressionAttributeNames": {f"#{attribute}": attribute for attribute in attributes}
+        }
+        # The deleted books are only kept for the static information of their price history
+        conditions = [Attr("deleted").not_exists()]
+        if bookstore is not None:
+            conditions.append(Attr("bookstore").eq(bookstore))
+        if watch_status is not None:
+            conditions.append(Attr("watch_status").eq(watch_status))
+        kwargs["FilterExpression"] = reduce(and_, conditions)
+        # A single segment, so the pages are only read as fast as they are consumed
+        books = utils.scan(self.db.Table("books_to_watch"), 1, **kwargs)
+        for book in islice(books, limit):
+            yield dict(book, isbn=int(book["isbn"]))
+
+    def get_books_to_watch(self, shard=None, shards=None):
+        return utils.get_books_to_watch(self.db, shard=shard, shards=shards)
+
+    def add_book(self, isbn, bookstore, url):
+        self.set_url(isbn, bookstore, url, True)
+
+    def add_books(self, books):
+        def add(book):
+            try:
+                self.set_url(book["isbn"], book["bookstore"], book["url"], book["watch_status"])
+            except ClientError as err:
+                return book, err.response["Error"]["Message"]
+
+        with ThreadPoolExecutor(max_workers=IMPORT_MAX_WORKERS) as executor:
+            return [error for error in executor.map(add, books) if error is not None]
+
+    def set_url(self, isbn, bookstore, url, watch_status):
+        """
+        Add a book to the watch list, or update the url and watch status of a book already in it, keeping the
+        static information of the book (which the price history needs)
+        :param isbn: the ISBN-13 of the book
+        :param bookstore: the name of the bookstore
+        :param url: the url of the book in the bookstore
+        :param watch_status: whether the book is scraped
+        """
+        self.db.Table("books_to_watch").update_item(
+            Key={
+                'isbn': isbn,
+                'bookstore': bookstore
+            },
+            UpdateExpression="SET #url = :url, watch_status = :r REMOVE deleted",
+            ExpressionAttributeNames={
+                '#url': 'url'
+            },
+            ExpressionAttributeValues={
+                ':url': url,
+                ':r': watch_status
+            }
+        )
+
+    def set_watch_status(self, isbn, bookstore, watch_status):
+        self.db.Table("books_to_watch").update_item(
+            Key={
+                'isbn': isbn,
+                'bookstore': bookstore
+            },
+            UpdateExpression="SET watch_status = :r REMOVE deleted",
+            ExpressionAttributeValues={
+                ':r': watch_status
+            }
+        )
+
+    def delete_book(self, isbn, bookstore):
+        self.db.Table("books_to_watch").update_item(
+            Key={
+                'isbn': isbn,
+                'bookstore': bookstore
+            },
+            UpdateExpression="SET watch_status = :r, deleted = :deleted",
+            ConditionExpression="attribute_exists(isbn)",
+            ExpressionAttributeValues={
+                ':r': False,
+                ':deleted': True
+            }
+        )
+
+    def store(self, books):
+        unchanged, changed, seen = 0, {}, []
+        with BufferedWriter(self.db, history.TABLE, keys=("isbn", "timestamp")) as price_writer:
+            # The last prices of every book, so only the ones that changed are recorded
+            summaries = summary.get_many(self.db, {book.isbn for _, book in books})
+            for book_to_watch, book in books:
+                item = book.to_item(book_to_watch["bookstore"])
+                offer = summaries.get(book.isbn, {}).get("offers", {}).get(book.url)
+                if summary.is_unchanged(offer, item):
+                    unchanged += 1
+                else:
+                    price_writer.put(history.compact(item))
+                    changed.setdefault(book.isbn, []).append(item)
+                seen.append(history.get_epoch(item["timestamp"]))
+        # The summaries are only updated once the prices they summarize are recorded
+        for isbn, items in changed.items():
+            summary.update(self.db, summaries.get(isbn), items)
+
+        def update(book, epoch):
+            return utils.update_book_to_watch(self.db, *book, epoch)
+
+        with ThreadPoolExecutor(max_workers=WATCH_MAX_WORKERS) as executor:
+            list(executor.map(update, books, seen))
+        return {"unchanged": unchanged, "books_price_data": price_writer.get_stats()}
+
+    def get_history(self, isbn, since=None, until=None, limit=None):
+        if limit:
+            return history.get_latest(self.db, isbn, limit, since, until)
+        if since or until:
+            return history.get_since(self.db, isbn, since, until)
+        return history.get_all(self.db, isbn)
+
+    def get_all_history(self):
+        attributes = ["isbn", "bookstore", "url"] + list(utils.METADATA)
+        books = utils.scan(self.db.Table("books_to_watch"),
+                           ProjectionExpression=", ".join(f"#{attribute}" for attribute in attributes),
+                           ExpressionAttributeNames={f"#{attribute}": attribute for attribute in attributes})
+        metadata = {}
+        for book in books:
+            metadata.setdefault(book["isbn"], {})[book["bookstore"]] = book
+        # A single segment, so the pages are only read as fast as they are consumed
+        for item in utils.scan(self.db.Table(history.TABLE), 1):
+            if history.is_current(item):
+                yield history.expand(item, metadata.get(item["isbn"], {}))
+
+    def get_summary(self, isbn):
+        """
+        Build the summary of a book that does not have one yet (recorded before the summaries existed) from its
+        price history, and store it so the next e-mails do not need the history again
+        :param isbn: the ISBN-13 of the book
+        :return: the books_price_summary item, or None if there are no prices recorded
+        """
+        data = history.get_all(self.db, isbn)
+        if not data:
+            return None
+        book_summary = summary.build(data)
+        summary.create(self.db, book_summary)
+        return book_summary
+
+    def get_summaries(self):
+        urls = {}
+        for book in utils.get_books_to_watch(self.db):
+            urls.setdefault(book["isbn"], set()).add(book["url"])
+        isbns = sorted(urls)
+        summaries = summary.get_many(self.db, isbns)
+        missing = [isbn for isbn in isbns if isbn not in summaries]
+        with ThreadPoolExecutor(max_workers=MAIL_MAX_WORKERS) as executor:
+            for isbn, book_summary in zip(missing, executor.map(self.get_summary, missing)):
+                if book_summary:
+                    summaries[isbn] = book_summary
+        return [(isbn, summaries[isbn], urls[isbn]) for isbn in isbns if isbn in summaries]
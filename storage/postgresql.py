@@ -0,0 +1,45 @@
+import csv
+import io
+import uuid
+from contextlib import closing
+
+import psycopg2
+
+from settings import POSTGRESQL_DSN
+from storage.sql import SQLStorage, PRICE_COLUMNS, FETCH_SIZE
+
+
+class PostgreSQLStorage(SQLStorage):
+    """
+    Storage in a PostgreSQL database, where the prices are inserted with COPY
+    """
+    def __init__(self, dsn=POSTGRESQL_DSN):
+        """
+        The constructor for PostgreSQLStorage
+        :param dsn: the connection string of the database (e.g. 'dbname=thebookisright user=postgres')
+        """
+        super().__init__(psycopg2.connect(dsn))
+
+    def prepare(self, sql):
+        # psycopg2 uses the %s placeholders, so the modulo operator must be escaped
+        return sql.replace("%", "%%").replace("?", "%s")
+
+    def query(self, sql, parameters=()):
+        # The default cursor of psycopg2 loads the whole result when the query runs, while a named one is a cursor of
+        # the server, read FETCH_SIZE rows at a time
+        with self.connection, closing(self.connection.cursor(name=f"query_{uuid.uuid4().hex}")) as cursor:
+            cursor.itersize = FETCH_SIZE
+            cursor.execute(self.prepare(sql), parameters)
+            columns = None
+            for row in cursor:
+                # The description of a named cursor is only known once the first rows are fetched
+                if columns is None:
+                    columns = [column[0] for column in cursor.description]
+                yield dict(zip(columns, row))
+
+    def insert_prices(self, cursor, rows):
+        # As CSV, which quotes the bookstores with commas, quotes or line breaks
+        data = io.StringIO()
+        csv.writer(data, lineterminator="\n").writerows(rows)
+        data.seek(0)
+        cursor.copy_expert(f"COPY books_price_data ({', '.join(PRICE_COLUMNS)}) FROM STDIN WITH (FORMAT csv)", data)
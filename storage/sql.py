@@ -0,0 +1,265 @@
+import time
+from contextlib import closing
+
+import cache
+import history
+import summary
+from storage.base import Storage
+from utils import METADATA
+
+# The rows read from the database at a time
+FETCH_SIZE = 1000
+# The prices are stored as integers in hundredths, and the time of each observation as seconds since the epoch
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS books_to_watch (
+        isbn BIGINT NOT NULL,
+        bookstore TEXT NOT NULL,
+        url TEXT NOT NULL,
+        watch_status BOOLEAN NOT NULL,
+        photo_url TEXT,
+        currency TEXT,
+        store_name TEXT,
+        promo_price INTEGER,
+        regular_price INTEGER,
+        seen BIGINT,
+        http_cache TEXT,
+        deleted BOOLEAN NOT NULL DEFAULT FALSE,
+        PRIMARY KEY (isbn, bookstore)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS books_price_data (
+        isbn BIGINT NOT NULL,
+        bookstore TEXT NOT NULL,
+        "timestamp" BIGINT NOT NULL,
+        promo_price INTEGER NOT NULL,
+        regular_price INTEGER NOT NULL
+    )
+    """,
+    'CREATE INDEX IF NOT EXISTS books_price_data_isbn_timestamp ON books_price_data (isbn, "timestamp")'
+]
+PRICE_COLUMNS = ["isbn", "bookstore", '"timestamp"', "promo_price", "regular_price"]
+# The lowest and the highest prices of each book, and the last price of each bookstore, in a single pass over the
+# price history of the watched books
+SUMMARY_QUERY = """
+    WITH ranked AS (
+        SELECT p.isbn, p.bookstore, p."timestamp", p.promo_price, p.regular_price,
+               ROW_NUMBER() OVER (PARTITION BY p.isbn ORDER BY p.promo_price, p."timestamp") AS lowest,
+               ROW_NUMBER() OVER (PARTITION BY p.isbn ORDER BY p.promo_price DESC, p."timestamp" DESC) AS highest,
+               ROW_NUMBER() OVER (PARTITION BY p.isbn, p.bookstore ORDER BY p."timestamp" DESC) AS latest
+        FROM books_price_data p
+        WHERE p.isbn IN (SELECT isbn FROM books_to_watch WHERE watch_status = ?)
+    )
+    SELECT r.isbn, r.bookstore, r."timestamp", r.promo_price, r.regular_price, r.lowest, r.highest, r.latest,
+           w.url, w.photo_url, w.currency, w.store_name, w.watch_status
+    FROM ranked r
+    LEFT JOIN books_to_watch w ON w.isbn = r.isbn AND w.bookstore = r.bookstore
+    WHERE r.lowest = 1 OR r.highest = 1 OR r.latest = 1
+"""
+
+
+def to_observation(row):
+    """
+    Get the complete price observation of a books_price_data row joined with its books_to_watch row
+    :param row: dictionary with the isbn, bookstore, timestamp and prices of the observation, and the url,
+    photo_url, currency and store_name of the book (None if it is no longer in the watch list)
+    :return: the price observation, in the format returned by history.expand
+    """
+    item = {
+        "isbn": row["isbn"],
+        "timestamp": history.get_timestamp(row["bookstore"], row["timestamp"]),
+        "p": row["promo_price"]
+    }
+    if row["regular_price"] != row["promo_price"]:
+        item["r"] = row["regular_price"]
+    watch = {key: row[key] for key in ("url", "photo_url", "currency", "store_name") if row[key] is not None}
+    return history.expand(item, {row["bookstore"]: watch})
+
+
+class SQLStorage(Storage):
+    """
+    Storage in a relational database, queried with the SQL common to SQLite and PostgreSQL.
+    The summaries of the books are not stored: they are aggregated by the database from the price history.
+    """
+    def __init__(self, connection):
+        """
+        The constructor for SQLStorage, which creates the tables that do not exist yet
+        :param connection: the DB-API connection to the database
+        """
+        self.connection = connection
+        self.execute(SCHEMA)
+
+    def prepare(self, sql):
+        """
+        Adapt a query to the parameter style of the database
+        :param sql: the query, with ? placeholders
+        :return: the query to execute
+        """
+        return sql
+
+    def execute(self, statements, parameters=()):
+        """
+        Execute statements in a single transaction
+        :param statements: list of queries, or a single query
+        :param parameters: the parameters of a single query
+        """
+        if isinstance(statements, str):
+            statements = [(statements, parameters)]
+        else:
+            statements = [(statement, ()) for statement in statements]
+        with self.connection, closing(self.connection.cursor()) as cursor:
+            for sql, parameters in statements:
+                cursor.execute(self.prepare(sql), parameters)
+
+    def query(self, sql, parameters=()):
+        """
+        Stream the rows of a query, FETCH_SIZE rows at a time
+        :param sql: the query, with ? placeholders
+        :param parameters: the parameters of the query
+        :return: generator of dictionaries, by column name
+        """
+        with self.connection, closing(self.connection.cursor()) as cursor:
+            cursor.execute(self.prepare(sql), parameters)
+            columns = [column[0] for column in cursor.description]
+            while True:
+                rows = cursor.fetchmany(FETCH_SIZE)
+                if not rows:
+                    return
+                for row in rows:
+                    yield dict(zip(columns, row))
+
+    def insert_prices(self, cursor, rows):
+        """
+        Insert price observations in bulk
+        :param cursor: the cursor of the transaction
+        :param rows: list of (isbn, bookstore, timestamp, promo_price, regular_price) tuples
+        """
+        cursor.executemany(self.prepare(f"INSERT INTO books_price_data ({', '.join(PRICE_COLUMNS)}) "
+                                        f"VALUES (?, ?, ?, ?, ?)"), rows)
+
+    def get_books(self, bookstore=None, watch_status=None, limit=None):
+        # The deleted books are only kept for the static information of their price history
+        sql = "SELECT isbn, bookstore, url, watch_status, store_name FROM books_to_watch WHERE deleted = ?"
+        parameters = [False]
+        if bookstore is not None:
+            sql += " AND bookstore = ?"
+            parameters.append(bookstore)
+        if watch_status is not None:
+            sql += " AND watch_status = ?"
+            parameters.append(watch_status)
+        sql += " ORDER BY isbn, bookstore"
+        if limit is not None:
+            sql += " LIMIT ?"
+            parameters.append(limit)
+        for book in self.query(sql, parameters):
+            book["watch_status"] = bool(book["watch_status"])
+            yield {key: value for key, value in book.items() if value is not None}
+
+    def get_books_to_watch(self, shard=None, shards=None):
+        sql = "SELECT isbn, bookstore, url, photo_url, currency, store_name, promo_price, regular_price, " \
+              "http_cache FROM books_to_watch WHERE watch_status = ?"
+        if shard is not None:
+            return self.query(sql + " AND isbn % ? = ?", (True, shards, shard))
+        return self.query(sql, (True,))
+
+    def add_book(self, isbn, bookstore, url):
+        self.add_books([{"isbn": isbn, "bookstore": bookstore, "url": url, "watch_status": True}])
+
+    def add_books(self, books):
+        with self.connection, closing(self.connection.cursor()) as cursor:
+            cursor.executemany(self.prepare(
+                "INSERT INTO books_to_watch (isbn, bookstore, url, watch_status) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (isbn, bookstore) DO UPDATE SET url = excluded.url, "
+                "watch_status = excluded.watch_status, deleted = FALSE"),
+                [(book["isbn"], book["bookstore"], book["url"], book["watch_status"]) for book in books])
+        # All of them are added in the same transaction, or none of them
+        return []
+
+    def set_watch_status(self, isbn, bookstore, watch_status):
+        self.execute("UPDATE books_to_watch SET watch_status = ?, deleted = ? WHERE isbn = ? AND bookstore = ?",
+                     (watch_status, False, isbn, bookstore))
+
+    def delete_book(self, isbn, bookstore):
+        self.execute("UPDATE books_to_watch SET watch_status = ?, deleted = ? WHERE isbn = ? AND bookstore = ?",
+                     (False, True, isbn, bookstore))
+
+    def store(self, books):
+        start = time.perf_counter()
+        prices, updates = [], []
+        for book_to_watch, book in books:
+            item = book.to_item(book_to_watch["bookstore"])
+            row = history.compact(item)
+            promo_price, regular_price = row["p"], row.get("r", row["p"])
+            epoch = history.get_epoch(item["timestamp"])
+            # The last prices are kept in the watch list, so only the ones that changed are recorded
+            last = (book_to_watch.get("promo_price"), book_to_watch.get("regular_price"),
+                    book_to_watch.get("currency"))
+            if last != (promo_price, regular_price, item["currency"]):
+                prices.append((book_to_watch["isbn"], book_to_watch["bookstore"], epoch, promo_price, regular_price))
+            updates.append([getattr(book, name) for name in METADATA.values()] +
+                           [promo_price, regular_price, epoch, cache.pop(book_to_watch["url"]), book_to_watch["isbn"],
+                            book_to_watch["bookstore"]])
+        with self.connection, closing(self.connection.cursor()) as cursor:
+            if prices:
+                self.insert_prices(cursor, prices)
+            if updates:
+                cursor.executemany(self.prepare(
+                    f"UPDATE books_to_watch SET {', '.join(f'{column} = ?' for column in METADATA)}, "
+                    f"promo_price = ?, regular_price = ?, seen = ?, http_cache = COALESCE(?, http_cache) "
+                    f"WHERE isbn = ? AND bookstore = ?"), updates)
+        elapsed = time.perf_counter() - start
+        return {
+            "unchanged": len(updates) - len(prices),
+            "books_price_data": {
+                "table": "books_price_data",
+                "items": len(prices),
+                "requests": 1 if prices else 0,
+                "retries": 0,
+                "consumed_capacity": 0.0,
+                "elapsed": elapsed,
+                "items_per_second": len(prices) / elapsed if elapsed else 0
+            }
+        }
+
+    def get_history(self, isbn, since=None, until=None, limit=None):
+        sql = "SELECT p.isbn, p.bookstore, p.\"timestamp\", p.promo_price, p.regular_price, " \
+              "w.url, w.photo_url, w.currency, w.store_name " \
+              "FROM books_price_data p " \
+              "LEFT JOIN books_to_watch w ON w.isbn = p.isbn AND w.bookstore = p.bookstore " \
+              "WHERE p.isbn = ? AND p.\"timestamp\" >= ? AND p.\"timestamp\" <= ?"
+        parameters = [isbn, history.to_epoch(since) if since is not None else 0,
+                      history.to_end(until) if until is not None else int(time.time())]
+        if limit:
+            sql += " ORDER BY p.\"timestamp\" DESC LIMIT ?"
+            parameters.append(limit)
+        else:
+            sql += " ORDER BY p.\"timestamp\""
+        return [to_observation(row) for row in self.query(sql, parameters)]
+
+    def get_all_history(self):
+        rows = self.query("SELECT p.isbn, p.bookstore, p.\"timestamp\", p.promo_price, p.regular_price, "
+                          "w.url, w.photo_url, w.currency, w.store_name "
+                          "FROM books_price_data p "
+                          "LEFT JOIN books_to_watch w ON w.isbn = p.isbn AND w.bookstore = p.bookstore "
+                          "ORDER BY p.isbn, p.\"timestamp\"")
+        return (to_observation(row) for row in rows)
+
+    def get_summaries(self):
+        urls = {}
+        for book in self.query("SELECT isbn, url FROM books_to_watch WHERE watch_status = ?", (True,)):
+            urls.setdefault(book["isbn"], set()).add(book["url"])
+        summaries = {}
+        for row in self.query(SUMMARY_QUERY, (True,)):
+            offer = summary.get_offer(to_observation(row))
+            book_summary = summaries.setdefault(row["isbn"], {"isbn": row["isbn"], "offers": {}})
+            if row["lowest"] == 1:
+                book_summary["lowest"] = offer
+            if row["highest"] == 1:
+                book_summary["highest"] = offer
+            if row["latest"] == 1 and row["watch_status"]:
+                book_summary["offers"][row["url"]] = offer
+        return [(isbn, summaries[isbn], urls[isbn]) for isbn in sorted(urls) if isbn in summaries]
+
+    def close(self):
+        self.connection.close()
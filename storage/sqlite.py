@@ -0,0 +1,34 @@
+import os
+import sqlite3
+
+from settings import SQLITE_PATH
+from storage.sql import SQLStorage
+
+# The folder of the database when SQLITE_PATH is relative, so it does not depend on the working directory
+DATA_DIR = os.path.join(os.path.expanduser("~"), ".thebookisright")
+
+
+def get_path(path):
+    """
+    Get the absolute path of the database file, creating its folder if it does not exist
+    :param path: the path of the database file, relative to DATA_DIR unless it is absolute (or ':memory:')
+    :return: the path to connect to
+    """
+    if path == ":memory:":
+        return path
+    path = os.path.join(DATA_DIR, os.path.expanduser(path))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+class SQLiteStorage(SQLStorage):
+    """
+    Storage in a local SQLite file, to run the whole pipeline on a single machine
+    """
+    def __init__(self, path=SQLITE_PATH):
+        """
+        The constructor for SQLiteStorage
+        :param path: the path of the database file, created if it does not exist (see get_path)
+        """
+        # The books are scraped in other threads, but the database is only used by one thread at a time
+        super().__init__(sqlite3.connect(get_path(path), check_same_thread=False))
@@ -0,0 +1,184 @@
+import time
+
+from botocore.exceptions import ClientError
+
+import metrics
+from history import parse_timestamp
+from settings import WRITE_MAX_RETRIES
+from writer import get_delay
+
+TABLE = "books_price_summary"
+
+
+def get_offer(item):
+    """
+    Get the offer stored in the summary from a books_price_data item
+    :param item: the books_price_data item
+    :return: the item without the isbn attribute (nor the lowest and highest prices of the aggregates)
+    """
+    return {key: value for key, value in item.items() if key not in ("isbn", "min_price", "max_price")}
+
+
+def get_extreme(item, price):
+    """
+    Get the offer with the lowest or the highest price of a books_price_data item
+    :param item: the books_price_data item
+    :param price: 'min_price' or 'max_price', which only the daily and weekly aggregates have
+    :return: the offer, with the extreme price of the aggregate as the promotional price
+    """
+    offer = get_offer(item)
+    offer["promo_price"] = item.get(price, item["promo_price"])
+    return offer
+
+
+def is_unchanged(offer, item):
+    """
+    Check if a new price observation repeats the last one of the same url
+    :param offer: the offer of the url in the summary (None if there is none)
+    :param item: the new price observation
+    :return: True if the prices and the currency are the same
+    """
+    return offer is not None and all(offer.get(key) == item[key] for key in ("promo_price", "regular_price", "currency"))
+
+
+def build(history):
+    """
+    Build the summary of a book from its price history.
+    Only the price changes are recorded, so the offer of each url is its latest observation.
+    :param history: list of price observations of the book (see history.expand)
+    :return: the books_price_summary item
+    """
+    offers = {}
+    for item in sorted(history, key=lambda i: parse_timestamp(i["timestamp"])):
+        # The books that are no longer watched have no url
+        if item["url"]:
+            offers[item["url"]] = get_offer(item)
+    return {
+        "isbn": history[0]["isbn"],
+        "lowest": get_extreme(min(history, key=lambda i: i.get("min_price", i["promo_price"])), "min_price"),
+        # Among equal prices, keep the last one recorded
+        "highest": get_extreme(max(reversed(history), key=lambda i: i.get("max_price", i["promo_price"])),
+                               "max_price"),
+        "offers": offers
+    }
+
+
+def merge(summary, items):
+    """
+    Build the summary of a book with new price observations, from the summary read before them
+    :param summary: the books_price_summary item (None if the book has no summary yet)
+    :param items: the new price observations of the book
+    :return: the new books_price_summary item, with the version of the summary it was built from
+    """
+    summary = dict(summary) if summary else {"isbn": items[0]["isbn"]}
+    offers = dict(summary.get("offers", {}))
+    for item in sorted(items, key=lambda i: parse_timestamp(i["timestamp"])):
+        offer = get_offer(item)
+        offers[item["url"]] = offer
+        if "lowest" not in summary or offer["promo_price"] < summary["lowest"]["promo_price"]:
+            summary["lowest"] = offer
+        # Among equal prices, keep the last one recorded
+        if "highest" not in summary or offer["promo_price"] >= summary["highest"]["promo_price"]:
+            summary["highest"] = offer
+    summary["offers"] = offers
+    return summary
+
+
+def get(db, isbn):
+    """
+    Get the last summary stored of a book
+    :param db: the instance of the database
+    :param isbn: the ISBN-13 of the book
+    :return: the books_price_summary item, or None if the book has no summary
+    """
+    response = db.meta.client.get_item(TableName=TABLE, Key={"isbn": isbn}, ConsistentRead=True,
+                                       ReturnConsumedCapacity="TOTAL")
+    metrics.add_capacity(response)
+    return response.get("Item")
+
+
+def create(db, summary):
+    """
+    Store the summary of a book, unless another one was stored in the meantime
+    :param db: the instance of the database
+    :param summary: the books_price_summary item
+    :return: True if the summary was stored
+    """
+    try:
+        db.meta.client.put_item(TableName=TABLE, Item=dict(summary, version=1),
+                                ConditionExpression="attribute_not_exists(isbn)")
+        return True
+    except ClientError as err:
+        if err.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
+        return False
+
+
+def save(db, summary):
+    """
+    Store the new summary of a book, unless another writer stored one since the summary it was built from was read
+    :param db: the instance of the database
+    :param summary: the books_price_summary item, with the version of the one it was built from (see merge)
+    :return: True if the summary was stored
+    """
+    version = summary.get("version")
+    if version is None:
+        # A new summary, or one stored before the summaries had versions
+        condition, values = "attribute_not_exists(#version)", {}
+    else:
+        condition, values = "#version = :version", {":version": version}
+    kwargs = {"ExpressionAttributeValues": values} if values else {}
+    try:
+        metrics.add_capacity(db.meta.client.put_item(
+            TableName=TABLE,
+            Item=dict(summary, version=(version or 0) + 1),
+            ConditionExpression=condition,
+            ExpressionAttributeNames={"#version": "version"},
+            ReturnConsumedCapacity="TOTAL",
+            **kwargs
+        ))
+        return True
+    except ClientError as err:
+        if err.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
+        return False
+
+
+def update(db, summary, items):
+    """
+    Update the summary of a book with new price observations, in a single write.
+    The write is conditional on the version of the summary, so concurrent writers never lose the lowest or the
+    highest price: when another writer stored a summary first, it is read again and the observations merged into it.
+    :param db: the instance of the database
+    :param summary: the books_price_summary item read before the observations (None if there was none)
+    :param items: the new price observations of the book, already stored in the price history
+    """
+    while not save(db, merge(summary, items)):
+        summary = get(db, items[0]["isbn"])
+
+
+def get_many(db, isbns):
+    """
+    Get the summaries of many books, 100 at a time
+    :param db: the instance of the database
+    :param isbns: the ISBN-13 of the books
+    :return: dictionary of the books_price_summary items by isbn (books without summary are missing)
+    """
+    summaries = {}
+    isbns = list(isbns)
+    for i in range(0, len(isbns), 100):
+        request = {TABLE: {"Keys": [{"isbn": isbn} for isbn in isbns[i:i + 100]]}}
+        attempt = 0
+        while request:
+            response = db.meta.client.batch_get_item(RequestItems=request, ReturnConsumedCapacity="TOTAL")
+            metrics.add_capacity(response)
+            for summary in response["Responses"].get(TABLE, []):
+                summaries[summary["isbn"]] = summary
+            request = response.get("UnprocessedKeys")
+            if request:
+                attempt += 1
+                if attempt > WRITE_MAX_RETRIES:
+                    raise RuntimeError(f"{len(request[TABLE]['Keys'])} summaries were not read after "
+                                       f"{WRITE_MAX_RETRIES} retries")
+                time.sleep(get_delay(attempt))
+    return summaries
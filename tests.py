@@ -1,9 +1,638 @@
+import importlib
+import os
+import threading
+import time
 import unittest
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from unittest import mock
 
+import boto3
+import requests
+from boto3.dynamodb.conditions import Key
+from bs4 import BeautifulSoup
 
-class MyTestCase(unittest.TestCase):
-    def test_something(self):
-        self.assertEqual(True, False)
+try:
+    from moto import mock_aws as mock_dynamodb
+except ImportError:
+    try:
+        from moto import mock_dynamodb
+    except ImportError:
+        from moto import mock_dynamodb2 as mock_dynamodb
+
+import fanout
+import history
+import mail
+import scraper
+import summary
+import utils
+from models import Book
+from settings import RAW_RETENTION_DAYS, SEEN_REFRESH_DAYS
+from storage.dynamodb import DynamoDBStorage
+from storage.sqlite import SQLiteStorage
+from writer import BufferedWriter
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks", "fixtures")
+REGION = "eu-west-1"
+# 2020-10-17 12:00:00 UTC, a Saturday
+NOW = 1602936000
+
+
+def create_tables(db):
+    """
+    Create the tables of the function, with the same keys as the deploy command
+    :param db: the instance of the database
+    """
+    tables = {
+        "books_to_watch": [("isbn", "HASH", "N"), ("bookstore", "RANGE", "S")],
+        "books_price_data": [("isbn", "HASH", "N"), ("timestamp", "RANGE", "S")],
+        "books_price_summary": [("isbn", "HASH", "N")],
+        fanout.RUNS_TABLE: [("run", "HASH", "S")]
+    }
+    for name, keys in tables.items():
+        db.create_table(
+            TableName=name,
+            KeySchema=[{"AttributeName": key, "KeyType": key_type} for key, key_type, _ in keys],
+            AttributeDefinitions=[{"AttributeName": key, "AttributeType": kind} for key, _, kind in keys],
+            BillingMode="PAY_PER_REQUEST"
+        )
+
+
+class DynamoDBTestCase(unittest.TestCase):
+    """
+    A fresh local DynamoDB (moto) with the tables of the function for each test
+    """
+    def setUp(self):
+        os.environ.update(AWS_ACCESS_KEY_ID="testing", AWS_SECRET_ACCESS_KEY="testing", AWS_DEFAULT_REGION=REGION)
+        self.mock = mock_dynamodb()
+        self.mock.start()
+        self.db = boto3.resource("dynamodb", region_name=REGION)
+        create_tables(self.db)
+        self.db.Table("books_to_watch").put_item(Item={"isbn": 1, "bookstore": "wook", "url": "https://www.wook.pt/1",
+                                                       "currency": "EUR", "store_name": "Wook"})
+
+    def tearDown(self):
+        self.mock.stop()
+
+    def put_prices(self, prices):
+        """
+        Record raw price observations of the book
+        :param prices: list of (seconds since the epoch, price in hundredths) tuples
+        """
+        with self.db.Table(history.TABLE).batch_writer() as batch:
+            for epoch, price in prices:
+                batch.put_item(Item={"isbn": 1, "timestamp": history.get_timestamp("wook", epoch), "p": price})
+
+    def get_items(self, prefix):
+        """
+        Get every books_price_data item of the book with a prefix, including the rolled up ones
+        :param prefix: RAW, DAILY or WEEKLY
+        :return: list of books_price_data items
+        """
+        return self.db.Table(history.TABLE).query(KeyConditionExpression=Key("isbn").eq(1) &
+                                                  Key("timestamp").begins_with(prefix))["Items"]
+
+
+class RollupTest(DynamoDBTestCase):
+    def setUp(self):
+        super().setUp()
+        # Three prices a day, for 60 days
+        self.day = (NOW - 60 * history.DAY) // history.DAY * history.DAY
+        self.put_prices([(self.day + day * history.DAY + hour * 3600, 1000 + day * 10 + hour)
+                         for day in range(60) for hour in (1, 2, 3)])
+
+    def test_rollup(self):
+        stats = history.rollup(self.db, NOW)
+        self.assertEqual(stats["books"], 1)
+        daily = {item["timestamp"]: item for item in self.get_items(history.DAILY)}
+        self.assertEqual(stats["raw"], 3 * len(daily))
+        first = daily[history.get_timestamp("wook", self.day, history.DAILY)]
+        self.assertEqual((first["lo"], first["hi"], first["p"]), (1001, 1003, 1003))
+        cutoff = (NOW - RAW_RETENTION_DAYS * history.DAY) // history.DAY * history.DAY
+        self.assertTrue(all("expires" in item for item in self.get_items(history.RAW)
+                            if history.get_epoch(item["timestamp"]) < cutoff))
+        # Nothing is left to roll up, and the prices read are the same
+        observations = history.get_all(self.db, 1)
+        self.assertEqual(history.rollup(self.db, NOW), {"books": 1, "raw": 0, "daily": 0})
+        self.assertEqual(history.get_all(self.db, 1), observations)
+
+    def test_interrupted(self):
+        # An aggregate written with only some of its items marked, and items marked without an aggregate
+        first, second = self.day, self.day + history.DAY
+        table = self.db.Table(history.TABLE)
+        table.put_item(Item={"isbn": 1, "timestamp": history.get_timestamp("wook", first, history.DAILY),
+                             "lo": 1001, "hi": 1003, "p": 1003})
+        for epoch in (first + 3600, first + 3 * 3600, second + 3600, second + 2 * 3600):
+            table.update_item(Key={"isbn": 1, "timestamp": history.get_timestamp("wook", epoch)},
+                              UpdateExpression="SET expires = :expires", ExpressionAttributeValues={":expires": NOW})
+        history.rollup(self.db, NOW)
+        daily = {item["timestamp"]: item for item in self.get_items(history.DAILY)}
+        for start, prices in ((first, (1001, 1003, 1003)), (second, (1011, 1013, 1013))):
+            item = daily[history.get_timestamp("wook", start, history.DAILY)]
+            self.assertEqual((item["lo"], item["hi"], item["p"]), prices)
+
+    def test_until(self):
+        # The whole last day is read
+        since = datetime.fromtimestamp(self.day, timezone.utc)
+        observations = history.get_since(self.db, 1, since.date(), since.date() + timedelta(days=1))
+        self.assertEqual(len(observations), 6)
+        observations = history.get_since(self.db, 1, since.date(), since + timedelta(days=1, hours=2))
+        self.assertEqual(len(observations), 5)
+
+
+class HistoryTest(DynamoDBTestCase):
+    def test_compact(self):
+        observation = {"isbn": 1, "timestamp": history.get_timestamp("wook", NOW), "promo_price": Decimal("9.99"),
+                       "regular_price": Decimal("9.99")}
+        item = history.compact(observation)
+        self.assertEqual(item, {"isbn": 1, "timestamp": "r#1602936000#wook", "p": 999})
+        metadata = history.get_metadata(self.db, 1)
+        expanded = history.expand(dict(item, r=1250), metadata)
+        self.assertEqual((expanded["promo_price"], expanded["regular_price"]), (Decimal("9.99"), Decimal("12.50")))
+        self.assertEqual((expanded["bookstore"], expanded["currency"], expanded["url"]),
+                         ("Wook", "EUR", "https://www.wook.pt/1"))
+        self.assertEqual(history.parse_timestamp(item["timestamp"]), datetime(2020, 10, 17, 12, tzinfo=timezone.utc))
+
+    def test_latest(self):
+        # The limit combines with the period, as in the SQL backends
+        self.put_prices([(NOW + hour * 3600, 1000 + hour) for hour in range(5)])
+        storage = DynamoDBStorage(self.db)
+        since = datetime.fromtimestamp(NOW + 3600, timezone.utc)
+        prices = [observation["promo_price"] for observation in storage.get_history(1, since=since, limit=3)]
+        self.assertEqual(prices, [Decimal("10.04"), Decimal("10.03"), Decimal("10.02")])
+        prices = [observation["promo_price"] for observation in
+                  storage.get_history(1, since=since, until=since + timedelta(hours=1), limit=3)]
+        self.assertEqual(prices, [Decimal("10.02"), Decimal("10.01")])
+        self.assertEqual(storage.get_history(1, since=datetime(2030, 1, 1), limit=5), [])
+
+    def test_migrate(self):
+        table = self.db.Table(history.TABLE)
+        for url, timestamp in (("https://www.wook.pt/1", "2020-10-17 10:00:00.123456"),
+                               ("https://www.wook.pt/old", "2020-10-17 11:00:00.123456")):
+            table.put_item(Item={"isbn": 1, "timestamp": timestamp, "promo_price": Decimal("8"),
+                                 "regular_price": Decimal("10"), "currency": "EUR", "bookstore": "Wook", "url": url,
+                                 "photo_url": "https://www.wook.pt/1.jpg"})
+        self.assertEqual(history.migrate(self.db),
+                         {"migrated": 1, "unresolved": {(1, "https://www.wook.pt/old"): 1}})
+        self.assertEqual([item["timestamp"] for item in self.get_items(history.RAW)], ["r#1602928800#wook"])
+        # The unresolved prices are kept as they are, and still read
+        self.assertEqual([observation["url"] for observation in history.get_all(self.db, 1)],
+                         ["https://www.wook.pt/1", "https://www.wook.pt/old"])
+        watch = self.db.Table("books_to_watch").get_item(Key={"isbn": 1, "bookstore": "wook"})["Item"]
+        self.assertEqual(watch["photo_url"], "https://www.wook.pt/1.jpg")
+        self.assertEqual(history.migrate(self.db)["migrated"], 0)
+
+
+class WriterTest(DynamoDBTestCase):
+    def test_retry(self):
+        writer = BufferedWriter(self.db, history.TABLE, keys=("isbn", "timestamp"), backoff=0)
+        write = writer.client.batch_write_item
+        calls = []
+
+        def batch_write_item(RequestItems, **kwargs):
+            # The first request only writes half of the items
+            calls.append(len(RequestItems[history.TABLE]))
+            if len(calls) > 1:
+                return write(RequestItems=RequestItems, **kwargs)
+            batch = RequestItems[history.TABLE]
+            response = write(RequestItems={history.TABLE: batch[:len(batch) // 2]}, **kwargs)
+            return dict(response, UnprocessedItems={history.TABLE: batch[len(batch) // 2:]})
+
+        with mock.patch.object(writer.client, "batch_write_item", batch_write_item), writer:
+            for epoch in range(10):
+                writer.put({"isbn": 1, "timestamp": history.get_timestamp("wook", NOW + epoch), "p": epoch})
+        self.assertEqual(calls, [10, 5])
+        self.assertEqual(len(self.get_items(history.RAW)), 10)
+        stats = writer.get_stats()
+        self.assertEqual((stats["items"], stats["requests"], stats["retries"]), (10, 2, 1))
+
+    def test_max_retries(self):
+        writer = BufferedWriter(self.db, history.TABLE, keys=("isbn", "timestamp"), max_retries=2, backoff=0)
+
+        def batch_write_item(RequestItems, **kwargs):
+            return {"UnprocessedItems": RequestItems}
+
+        with mock.patch.object(writer.client, "batch_write_item", batch_write_item):
+            writer.put({"isbn": 1, "timestamp": history.get_timestamp("wook", NOW), "p": 1})
+            with self.assertRaises(RuntimeError):
+                writer.flush()
+        self.assertEqual(writer.get_stats()["retries"], 2)
+
+
+def get_observation(epoch, promo_price, url="https://www.wook.pt/1"):
+    """
+    Build a price observation of the book
+    :param epoch: the seconds since the epoch of the observation
+    :param promo_price: the promotional price, as a string
+    :param url: the url of the book
+    :return: the price observation (see history.expand)
+    """
+    return {"isbn": 1, "timestamp": history.get_timestamp("wook", epoch), "promo_price": Decimal(promo_price),
+            "regular_price": Decimal("12.00"), "currency": "EUR", "bookstore": "Wook", "url": url,
+            "photo_url": None}
+
+
+class SummaryTest(DynamoDBTestCase):
+    def test_merge(self):
+        first = summary.merge(None, [get_observation(NOW, "10.00"), get_observation(NOW + 1, "9.00")])
+        self.assertEqual((first["lowest"]["promo_price"], first["highest"]["promo_price"]),
+                         (Decimal("9.00"), Decimal("10.00")))
+        self.assertEqual(list(first["offers"]), ["https://www.wook.pt/1"])
+        self.assertEqual(first["offers"]["https://www.wook.pt/1"]["promo_price"], Decimal("9.00"))
+        # Among equal prices, the lowest keeps the first one and the highest the last one
+        second = summary.merge(first, [get_observation(NOW + 2, "10.00", "https://www.wook.pt/2"),
+                                       get_observation(NOW + 3, "9.00")])
+        self.assertEqual(second["lowest"]["timestamp"], first["lowest"]["timestamp"])
+        self.assertEqual(second["highest"]["url"], "https://www.wook.pt/2")
+        self.assertEqual(len(second["offers"]), 2)
+        self.assertEqual(len(first["offers"]), 1)
+
+    def test_conflict(self):
+        summary.update(self.db, None, [get_observation(NOW, "10.00")])
+        stale = summary.get(self.db, 1)
+        self.assertEqual(stale["version"], 1)
+        summary.update(self.db, stale, [get_observation(NOW + 1, "8.00")])
+        # Built from the first version, so it is not stored, and update reads the new one again
+        self.assertFalse(summary.save(self.db, summary.merge(stale, [get_observation(NOW + 2, "11.00")])))
+        saves = []
+        save = summary.save
+        with mock.patch.object(summary, "save", side_effect=lambda *args: saves.append(save(*args)) or saves[-1]):
+            summary.update(self.db, stale, [get_observation(NOW + 2, "11.00")])
+        self.assertEqual(saves, [False, True])
+        stored = summary.get(self.db, 1)
+        self.assertEqual(stored["version"], 3)
+        self.assertEqual((stored["lowest"]["promo_price"], stored["highest"]["promo_price"]),
+                         (Decimal("8.00"), Decimal("11.00")))
+
+
+class StoreTest(DynamoDBTestCase):
+    def setUp(self):
+        super().setUp()
+        self.storage = DynamoDBStorage(self.db)
+
+    def store(self, price, epoch=NOW):
+        """
+        Store a price of every watched book, scraped at a given time
+        :param price: the promotional and regular price of the books
+        :param epoch: the seconds since the epoch of the observations
+        :return: the result of Storage.store and the books to watch read before it
+        """
+        books = list(self.storage.get_books_to_watch())
+        scraped = [(book_to_watch, Book(int(book_to_watch["isbn"]), price, price, "EUR", "Wook", book_to_watch["url"],
+                                        "https://www.wook.pt/1.jpg")) for book_to_watch in books]
+        with mock.patch.object(history.time, "time", return_value=epoch):
+            return self.storage.store(scraped)
+
+    def get_watch(self):
+        """
+        Get the books_to_watch item of the book
+        :return: the books_to_watch item
+        """
+        return self.db.Table("books_to_watch").get_item(Key={"isbn": 1, "bookstore": "wook"})["Item"]
+
+    def test_changes(self):
+        self.storage.set_watch_status(1, "wook", True)
+        stats = self.store(9.99)
+        self.assertEqual((stats["unchanged"], stats["books_price_data"]["items"]), (0, 1))
+        stats = self.store(9.99, NOW + 60)
+        self.assertEqual((stats["unchanged"], stats["books_price_data"]["items"]), (1, 0))
+        stats = self.store(8.99, NOW + 120)
+        self.assertEqual((stats["unchanged"], stats["books_price_data"]["items"]), (0, 1))
+        self.assertEqual([observation["promo_price"] for observation in history.get_all(self.db, 1)],
+                         [Decimal("9.99"), Decimal("8.99")])
+        stored = summary.get(self.db, 1)
+        self.assertEqual((stored["version"], stored["lowest"]["promo_price"], stored["highest"]["promo_price"]),
+                         (2, Decimal("8.99"), Decimal("9.99")))
+        # The last time the book was seen is only written again after SEEN_REFRESH_DAYS
+        self.assertEqual(self.get_watch()["seen"], NOW)
+        self.store(8.99, NOW + SEEN_REFRESH_DAYS * history.DAY)
+        self.assertEqual(self.get_watch()["seen"], NOW + SEEN_REFRESH_DAYS * history.DAY)
+
+    def test_concurrent_changes(self):
+        # The watch status, the url and the deletion made while the book was scraped are kept
+        self.storage.set_watch_status(1, "wook", True)
+        self.storage.add_book(2, "wook", "https://www.wook.pt/2")
+        books = list(self.storage.get_books_to_watch())
+        self.storage.set_watch_status(1, "wook", False)
+        self.storage.delete_book(2, "wook")
+        self.storage.store([(book_to_watch, Book(int(book_to_watch["isbn"]), 9.99, 9.99, "EUR", "Wook",
+                                                 book_to_watch["url"], None)) for book_to_watch in books])
+        watch = self.get_watch()
+        self.assertEqual((watch["watch_status"], watch["store_name"]), (False, "Wook"))
+        self.assertEqual([(book["isbn"], book["watch_status"]) for book in self.storage.get_books()], [(1, False)])
+
+
+def get_result(books, items, elapsed=1.0):
+    """
+    Build the result of a worker that stored its prices
+    :param books: the number of books scraped
+    :param items: the number of prices written
+    :param elapsed: the seconds spent writing them
+    :return: the result of the worker (see fanout.work)
+    """
+    return {"books": books, "unchanged": books - items, "failed": 0, "skipped": 0, "failures": [],
+            "books_price_data": {"table": "books_price_data", "items": items, "requests": 1, "retries": 0,
+                                 "consumed_capacity": float(items), "elapsed": elapsed,
+                                 "items_per_second": items / elapsed}}
+
+
+class FanoutTest(DynamoDBTestCase):
+    def setUp(self):
+        super().setUp()
+        self.report = mock.patch.object(fanout, "report").start()
+        self.addCleanup(mock.patch.stopall)
+
+    def finish(self, shard, result, shards=2, run="run"):
+        """
+        Record the result of a worker of a run
+        :param shard: the shard of the worker
+        :param result: the result of the worker
+        :param shards: the total number of shards of the run
+        :param run: the id of the run
+        :return: the result of fanout.finish
+        """
+        return fanout.finish(self.db, None, {"mode": "worker", "shard": shard, "shards": shards, "run": run}, result)
+
+    def start(self, shards=2, run="run"):
+        """
+        Record a new run, as fanout.start does before invoking the workers
+        :param shards: the total number of shards of the run
+        :param run: the id of the run
+        """
+        self.db.Table(fanout.RUNS_TABLE).put_item(Item={"run": run, "shards": shards, "results": {}})
+
+    def test_merge(self):
+        failure = {"isbn": 2, "bookstore": "wook", "url": "https://www.wook.pt/2", "error": "404", "skipped": False}
+        merged = fanout.merge([get_result(3, 2, elapsed=2.0), dict(get_result(2, 1), failed=1, failures=[failure]),
+                               dict(get_result(1, 0), books_price_data=None)])
+        self.assertEqual((merged["shards"], merged["books"], merged["unchanged"], merged["failed"]), (3, 6, 3, 1))
+        self.assertEqual(merged["failures"], [failure])
+        stats = merged["books_price_data"]
+        # The workers write at the same time, so the throughput is over the longest one
+        self.assertEqual((stats["items"], stats["requests"], stats["elapsed"], stats["items_per_second"]),
+                         (3, 2, 2.0, 1.5))
+        self.assertIsNone(fanout.merge([dict(get_result(1, 0), books_price_data=None)])["books_price_data"])
+
+    def test_finish(self):
+        self.start()
+        self.assertIsNone(self.finish(0, get_result(2, 1)))
+        # An invocation delivered twice is not counted again
+        self.assertIsNone(self.finish(0, get_result(2, 1)))
+        self.report.assert_not_called()
+        merged = self.finish(1, {"error": "Task timed out"})
+        self.assertEqual((merged["shards"], merged["books"], merged["failed_shards"]), (1, 2, {1: "Task timed out"}))
+        self.report.assert_called_once()
+        # Nor is the last shard, so the e-mail is only sent once
+        self.assertIsNone(self.finish(1, get_result(1, 1)))
+        self.assertIsNone(self.finish(0, get_result(2, 1)))
+        self.report.assert_called_once()
+
+    def test_finish_together(self):
+        # The last two shards finish at the same time, and only one of them sends the e-mail
+        self.start(shards=3)
+        self.finish(0, get_result(1, 1), shards=3)
+        barrier = threading.Barrier(2, timeout=10)
+        update_item = self.db.meta.client.update_item
+
+        def record(**kwargs):
+            response = update_item(**kwargs)
+            if "#results" in kwargs["UpdateExpression"]:
+                barrier.wait()
+            return response
+
+        merged = [None, None]
+
+        def finish(shard):
+            merged[shard - 1] = self.finish(shard, get_result(1, 1), shards=3)
+
+        with mock.patch.object(self.db.meta.client, "update_item", record):
+            threads = [threading.Thread(target=finish, args=(shard,)) for shard in (1, 2)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(sorted(result is None for result in merged), [False, True])
+        self.report.assert_called_once()
+
+    def test_work(self):
+        storage = SQLiteStorage(":memory:")
+        self.addCleanup(storage.close)
+        storage.add_books([{"isbn": isbn, "bookstore": "wook", "url": f"https://www.wook.pt/{isbn}",
+                            "watch_status": True} for isbn in (1, 2, 3)])
+
+        def get_info(url):
+            isbn = int(url.rsplit("/", 1)[1])
+            if isbn == 3:
+                raise ValueError("No price")
+            return Book(isbn, 9.99, 12.0, "EUR", "Wook", url, None)
+
+        with mock.patch.object(scraper, "get_info", get_info):
+            result = fanout.work(storage, store=False)
+            self.assertEqual((result["books"], result["failed"], result["books_price_data"]), (2, 1, None))
+            self.assertEqual([book.isbn for _, book in result["scraped"]], [1, 2])
+            self.assertEqual(storage.get_history(1), [])
+            result = fanout.work(storage)
+            self.assertEqual((result["books"], result["unchanged"], result["books_price_data"]["items"]), (2, 0, 2))
+            self.assertEqual([failure["isbn"] for failure in result["failures"]], [3])
+            self.assertNotIn("scraped", result)
+            result = fanout.work(storage, isbns={2})
+            self.assertEqual((result["books"], result["unchanged"], result["books_price_data"]["items"]), (1, 1, 0))
+
+
+class ScanTest(DynamoDBTestCase):
+    def test_stop(self):
+        with self.db.Table("books_to_watch").batch_writer() as batch:
+            for isbn in range(2, 402):
+                batch.put_item(Item={"isbn": isbn, "bookstore": "wook", "url": f"https://www.wook.pt/{isbn}"})
+        table = self.db.Table("books_to_watch")
+        self.assertEqual(len(list(utils.scan(table, 4, Limit=5))), 401)
+        # Once the consumer stops, the segments stop reading instead of reading the rest of the table
+        scan = table.meta.client.scan
+        with mock.patch.object(utils, "SCAN_POLL_SECONDS", 0.01), \
+                mock.patch.object(table.meta.client, "scan", side_effect=scan) as scans:
+            books = utils.scan(table, 4, Limit=5)
+            next(books)
+            books.close()
+            time.sleep(0.5)
+        self.assertLess(scans.call_count, 20)
+
+
+class ScrapeTest(unittest.TestCase):
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.running = Counter()
+        self.peaks = Counter()
+        self.errors = {}
+
+    def get_info(self, url):
+        """
+        Scrape a book without any request, recording the concurrent books of each host
+        :param url: the url of the book
+        :return: Book instance
+        """
+        domain = scraper.get_domain(url)
+        with self.lock:
+            self.running[domain] += 1
+            self.running["total"] += 1
+            self.peaks[domain] = max(self.peaks[domain], self.running[domain])
+            self.peaks["total"] = max(self.peaks["total"], self.running["total"])
+            error = self.errors.get(url)
+            if isinstance(error, list):
+                error = error.pop(0) if error else None
+        time.sleep(0.01)
+        with self.lock:
+            self.running[domain] -= 1
+            self.running["total"] -= 1
+        if error:
+            raise error
+        return Book(int(url.rsplit("/", 1)[1]), 10.0, 12.0, "EUR", domain, url, None)
+
+    def scrape(self, books, **kwargs):
+        """
+        Scrape books with get_info instead of the scrapers of the bookstores
+        :param books: iterable of books to watch
+        :param kwargs: the arguments of scraper.scrape
+        :return: the results and the failures (see scraper.scrape)
+        """
+        with mock.patch.object(scraper, "get_info", self.get_info):
+            return scraper.scrape(books, **kwargs)
+
+    def get_books(self, hosts, size):
+        """
+        Build a watch list spread over some hosts
+        :param hosts: the host names of the books, in turns
+        :param size: the number of books
+        :return: list of books to watch
+        """
+        return [{"isbn": i, "url": f"https://www.{hosts[i % len(hosts)]}/book/{i}"} for i in range(size)]
+
+    def test_limits(self):
+        books = self.get_books(["wook.pt", "bertrand.pt", "fca.pt"], 60)
+        results, failures = self.scrape(iter(books), max_workers=6, max_per_domain=2)
+        self.assertEqual(failures, [])
+        self.assertEqual([book for book, _ in results], books)
+        self.assertEqual([info.url for _, info in results], [book["url"] for book in books])
+        self.assertEqual(self.peaks["total"], 6)
+        self.assertTrue(all(self.peaks[f"www.{host}"] <= 2 for host in ("wook.pt", "bertrand.pt", "fca.pt")))
+
+    def test_parked(self):
+        # A single host, so the books wait for it instead of being read from the watch list
+        read = Counter()
+
+        def watch_list():
+            for book in self.get_books(["wook.pt"], 30):
+                read["books"] += 1
+                read["peak"] = max(read["peak"], read["books"] - len(done))
+                yield book
+
+        done = []
+        with mock.patch.object(scraper, "get_info", lambda url: done.append(url) or self.get_info(url)):
+            results, _ = scraper.scrape(watch_list(), max_workers=4, max_per_domain=1, max_parked=3)
+        self.assertEqual(len(results), 30)
+        self.assertLessEqual(read["peak"], 1 + 3 + 1)
+
+    def test_retry(self):
+        books = self.get_books(["wook.pt"], 3)
+        self.errors[books[0]["url"]] = [requests.ConnectionError("reset")]
+        self.errors[books[1]["url"]] = ValueError("layout")
+        results, failures = self.scrape(books, retry_backoff=0)
+        self.assertEqual([book for book, _ in results], [books[0], books[2]])
+        self.assertEqual([(failure["url"], failure["skipped"]) for failure in failures], [(books[1]["url"], False)])
+
+    def test_breaker(self):
+        books = self.get_books(["wook.pt", "fca.pt"], 20)
+        for book in books[::2]:
+            self.errors[book["url"]] = ValueError("layout")
+        results, failures = self.scrape(books, max_workers=1, breaker=scraper.CircuitBreaker(threshold=3))
+        self.assertEqual([book for book, _ in results], books[1::2])
+        self.assertEqual([failure["skipped"] for failure in failures], [False] * 3 + [True] * 7)
+
+    def test_deadline(self):
+        books = self.get_books(["wook.pt"], 5)
+        results, failures = self.scrape(books, deadline=time.time() - 1)
+        self.assertEqual(results, [])
+        self.assertEqual({failure["error"] for failure in failures}, {"not scraped before the deadline"})
+        self.assertEqual(len(failures), 5)
+
+
+class ExtractionTest(unittest.TestCase):
+    def test_parity(self):
+        # Parsing only the regions of each bookstore finds the same values as parsing the whole page
+        for name in sorted(name[:-5] for name in os.listdir(FIXTURES) if name.endswith(".html")):
+            with self.subTest(bookstore=name), open(os.path.join(FIXTURES, f"{name}.html"), "rb") as file:
+                html = file.read()
+                spec = importlib.import_module(f"bookstores.{name}").SPEC
+                values = spec.extract(BeautifulSoup(html, features="html.parser"))
+                self.assertEqual(spec.extract(BeautifulSoup(html, features=spec.features,
+                                                            parse_only=spec.strainer)), values)
+                book = spec.parse(html, f"https://{name}.example/book")
+                self.assertEqual(book.isbn, int(values["isbn"]))
+                self.assertIsNotNone(book.regular_price)
+
+
+class SQLiteTest(unittest.TestCase):
+    def setUp(self):
+        self.storage = SQLiteStorage(":memory:")
+        self.storage.add_books([
+            {"isbn": 1, "bookstore": "wook", "url": "https://www.wook.pt/1", "watch_status": True},
+            {"isbn": 1, "bookstore": "fca", "url": "https://www.fca.pt/1", "watch_status": False},
+            {"isbn": 2, "bookstore": "wook", "url": "https://www.wook.pt/2", "watch_status": True}
+        ])
+
+    def tearDown(self):
+        self.storage.close()
+
+    def store(self, price):
+        """
+        Store the same price of every watched bookstore of the first book
+        :param price: the promotional and regular price of the book
+        :return: the result of Storage.store
+        """
+        books = [(book_to_watch, Book(book_to_watch["isbn"], price, price, "EUR", "Wook", book_to_watch["url"],
+                                      "https://www.wook.pt/1.jpg"))
+                 for book_to_watch in self.storage.get_books_to_watch() if book_to_watch["isbn"] == 1]
+        return self.storage.store(books)
+
+    def test_list_books(self):
+        def keys(**kwargs):
+            return [(book["isbn"], book["bookstore"]) for book in self.storage.get_books(**kwargs)]
+
+        self.assertEqual(keys(), [(1, "fca"), (1, "wook"), (2, "wook")])
+        self.assertEqual(keys(bookstore="wook"), [(1, "wook"), (2, "wook")])
+        self.assertEqual(keys(watch_status=False), [(1, "fca")])
+        self.assertEqual(keys(bookstore="wook", watch_status=True, limit=1), [(1, "wook")])
+        self.storage.delete_book(2, "wook")
+        self.assertEqual(keys(bookstore="wook"), [(1, "wook")])
+        self.storage.add_book(2, "wook", "https://www.wook.pt/2")
+        self.assertEqual(keys(bookstore="wook"), [(1, "wook"), (2, "wook")])
+
+    def test_store(self):
+        self.assertEqual(self.store(9.99)["unchanged"], 0)
+        stats = self.store(9.99)
+        self.assertEqual((stats["unchanged"], stats["books_price_data"]["items"]), (1, 0))
+        stats = self.store(8.99)
+        self.assertEqual((stats["unchanged"], stats["books_price_data"]["items"]), (0, 1))
+        prices = [observation["promo_price"] for observation in self.storage.get_history(1)]
+        self.assertEqual(prices, [Decimal("9.99"), Decimal("8.99")])
+        self.assertEqual(self.storage.get_history(1, limit=1)[0]["bookstore"], "Wook")
+        # Only the watched books are summarized
+        (isbn, book_summary, urls), = self.storage.get_summaries()
+        self.assertEqual((isbn, urls), (1, {"https://www.wook.pt/1"}))
+        self.assertEqual(book_summary["lowest"]["promo_price"], Decimal("8.99"))
+
+    def test_not_stored(self):
+        # The e-mail of a run that does not store the prices shows them anyway
+        self.store(9.99)
+        books = [(book_to_watch, Book(book_to_watch["isbn"], 7.99, 9.99, "EUR", "Wook", book_to_watch["url"], None))
+                 for book_to_watch in self.storage.get_books_to_watch()]
+        summaries = mail.add_scraped(self.storage.get_summaries(), books)
+        self.assertEqual([(isbn, urls) for isbn, _, urls in summaries],
+                         [(1, {"https://www.wook.pt/1"}), (2, {"https://www.wook.pt/2"})])
+        self.assertEqual([book_summary["lowest"]["promo_price"] for _, book_summary, _ in summaries],
+                         [Decimal("7.99"), Decimal("7.99")])
+        self.assertEqual(summaries[0][1]["highest"]["promo_price"], Decimal("9.99"))
+        self.assertEqual(self.storage.get_history(2), [])
 
 
 if __name__ == '__main__':
@@ -1,17 +1,28 @@
 import json
-import os
-import sys
 import time
-import zipfile
+from datetime import datetime
+from typing import List
 
 import botocore
 import tabulate
 import typer
 import boto3
 
-from settings import AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_DEFAULT_REGION, CRON
+import artifact
+import fanout
+import history
+import mail
+import metrics
+import storage
+import transfer
+import utils
+from settings import AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_DEFAULT_REGION, CRON, FANOUT_SHARDS, ROLLUP_CRON, \
+    IMPORT_BATCH_SIZE, MAX_WORKERS, MAX_WORKERS_PER_DOMAIN
 
 app = typer.Typer()
+# The columns of list_books, and the books printed in each table
+LIST_COLUMNS = ["isbn", "bookstore", "store_name", "watch_status", "url"]
+LIST_PAGE_SIZE = 100
 
 
 @app.command()
@@ -23,20 +34,8 @@ def add_book(isbn: int = typer.Option(..., prompt="What is the book's ISBN?", he
     """
     Add a book to be tracked
     """
-    session = boto3.Session(
-        aws_access_key_id=AWS_ACCESS_KEY_ID,
-        aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-        region_name=AWS_DEFAULT_REGION
-    )
     try:
-        session.resource("dynamodb").Table("books_to_watch").put_item(
-            Item={
-                "isbn": isbn,
-                "bookstore": bookstore,
-                "url": url,
-                "watch_status": True
-            }
-        )
+        storage.get_storage().add_book(isbn, bookstore, url)
         typer.secho(f"Book with ISBN {isbn} from {bookstore} created successfully!", fg=typer.colors.GREEN, bold=True)
     except botocore.exceptions.ClientError as err:
         typer.echo(typer.style(err.response["Error"]["Message"], fg=typer.colors.RED, bold=True))
@@ -44,19 +43,106 @@ def add_book(isbn: int = typer.Option(..., prompt="What is the book's ISBN?", he
 
 
 @app.command()
-def list_books():
+def import_books(path: str = typer.Argument(..., help="The CSV or JSON lines file with the isbn, bookstore, url and "
+                                                      "(optionally) watch_status of each book"),
+                 file_format: str = typer.Option(None, "--format", help="csv or jsonl (by default, the extension "
+                                                                        "of the file)")):
     """
-    List all the books stored
+    Add all the books of a file to be tracked
     """
-    session = boto3.Session(
-        aws_access_key_id=AWS_ACCESS_KEY_ID,
-        aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-        region_name=AWS_DEFAULT_REGION
-    )
-    dataset = session.resource("dynamodb").Table("books_to_watch").scan()["Items"]
-    header = dataset[0].keys()
-    rows = [x.values() for x in dataset]
-    typer.echo(tabulate.tabulate(rows, header, tablefmt='grid', floatfmt=".0f"))
+    try:
+        file_format = transfer.get_format(path, file_format)
+    except ValueError as err:
+        typer.secho(str(err), fg=typer.colors.RED, bold=True)
+        raise typer.Exit()
+    backend = storage.get_storage()
+    imported = failed = 0
+    with open(path, encoding="utf-8", newline="") as file, \
+            typer.progressbar(transfer.read_books(file, file_format), label="Importing books", show_pos=True) as rows:
+        for batch in transfer.batches(rows, IMPORT_BATCH_SIZE):
+            books = []
+            for number, book, error in batch:
+                if error:
+                    typer.secho(f"Line {number}: {error}", fg=typer.colors.YELLOW, err=True)
+                    failed += 1
+                else:
+                    books.append((number, book))
+            try:
+                errors = backend.add_books([book for _, book in books])
+            except (botocore.exceptions.ClientError, RuntimeError) as err:
+                message = err.response["Error"]["Message"] if isinstance(err, botocore.exceptions.ClientError) \
+                    else str(err)
+                errors = [(book, message) for _, book in books]
+            # Only the books that could not be written are reported, by their line
+            lines = {id(book): number for number, book in books}
+            for book, message in errors:
+                typer.secho(f"Line {lines[id(book)]}: {message}", fg=typer.colors.YELLOW, err=True)
+            imported += len(books) - len(errors)
+            failed += len(errors)
+    typer.secho(f"{imported} books imported successfully!", fg=typer.colors.GREEN, bold=True)
+    if failed:
+        typer.secho(f"{failed} books could not be imported.", fg=typer.colors.RED, bold=True)
+
+
+@app.command()
+def export_history(path: str = typer.Argument(..., help="The file to write: .csv, .jsonl or .parquet"),
+                   file_format: str = typer.Option(None, "--format", help="csv, jsonl or parquet (by default, the "
+                                                                          "extension of the file)")):
+    """
+    Export the prices recorded of every book to a file
+    """
+    try:
+        file_format = transfer.get_format(path, file_format)
+        with typer.progressbar(storage.get_storage().get_all_history(), label="Exporting prices",
+                               show_pos=True) as observations:
+            exported = transfer.export_history(path, file_format, observations)
+    except (ValueError, RuntimeError) as err:
+        typer.secho(str(err), fg=typer.colors.RED, bold=True)
+        raise typer.Exit()
+    except botocore.exceptions.ClientError as err:
+        typer.echo(typer.style(err.response["Error"]["Message"], fg=typer.colors.RED, bold=True))
+        raise typer.Exit()
+    typer.secho(f"{exported} prices exported to {path} successfully!", fg=typer.colors.GREEN, bold=True)
+
+
+@app.command()
+def list_books(bookstore: str = typer.Option(None, help="List only the books of this bookstore"),
+               watching: bool = typer.Option(None, "--watching/--not-watching",
+                                             help="List only the watched, or the unwatched, books"),
+               limit: int = typer.Option(None, min=1, help="List at most this number of books"),
+               as_json: bool = typer.Option(False, "--json", help="Print one JSON object per book")):
+    """
+    List the books stored
+    """
+    books = storage.get_storage().get_books(bookstore=bookstore, watch_status=watching, limit=limit)
+    listed = 0
+    # The books are printed as they are read, a page at a time
+    for page in transfer.batches(books, LIST_PAGE_SIZE):
+        listed += len(page)
+        if as_json:
+            typer.echo("\n".join(json.dumps(book) for book in page))
+        else:
+            rows = [[book.get(column) for column in LIST_COLUMNS] for book in page]
+            typer.echo(tabulate.tabulate(rows, LIST_COLUMNS, tablefmt='grid', floatfmt=".0f"))
+    if not listed and not as_json:
+        typer.secho("There are no books to list.", fg=typer.colors.YELLOW, bold=True)
+
+
+@app.command()
+def price_history(isbn: int = typer.Option(..., prompt="What is the book's ISBN?", help="The ISBN-13 of the book"),
+                  limit: int = typer.Option(None, help="Show only the latest prices recorded"),
+                  since: datetime = typer.Option(None, formats=["%Y-%m-%d"],
+                                                 help="Show only the prices recorded since this date")):
+    """
+    List the prices recorded of a book
+    """
+    dataset = storage.get_storage().get_history(isbn, since=since, limit=limit)
+    if not dataset:
+        typer.secho(f"There are no prices recorded for the book with ISBN {isbn}.", fg=typer.colors.YELLOW, bold=True)
+        raise typer.Exit()
+    header = ["timestamp", "bookstore", "promo_price", "regular_price", "currency"]
+    rows = [[history.parse_timestamp(x["timestamp"])] + [x[column] for column in header[1:]] for x in dataset]
+    typer.echo(tabulate.tabulate(rows, header, tablefmt='grid', floatfmt=".2f"))
 
 
 @app.command()
@@ -66,23 +152,8 @@ def unwatch_book(isbn: int = typer.Option(..., prompt="What is the book's ISBN?"
     """
     Stop watching the book's price
     """
-    session = boto3.Session(
-        aws_access_key_id=AWS_ACCESS_KEY_ID,
-        aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-        region_name=AWS_DEFAULT_REGION
-    )
     try:
-        session.resource("dynamodb").Table("books_to_watch").update_item(
-            Key={
-                'isbn': isbn,
-                'bookstore': bookstore
-            },
-            UpdateExpression="set watch_status = :r",
-            ExpressionAttributeValues={
-                ':r': False
-            },
-            ReturnValues="UPDATED_NEW"
-        )
+        storage.get_storage().set_watch_status(isbn, bookstore, False)
         typer.secho(f"Book with ISBN {isbn} from {bookstore} updated successfully!", fg=typer.colors.GREEN, bold=True)
     except botocore.exceptions.ClientError as err:
         typer.echo(typer.style(err.response["Error"]["Message"], fg=typer.colors.RED, bold=True))
@@ -96,23 +167,8 @@ def watch_book(isbn: int = typer.Option(..., prompt="What is the book's ISBN?",
     """
     Resume watching the book's price
     """
-    session = boto3.Session(
-        aws_access_key_id=AWS_ACCESS_KEY_ID,
-        aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-        region_name=AWS_DEFAULT_REGION
-    )
     try:
-        session.resource("dynamodb").Table("books_to_watch").update_item(
-            Key={
-                'isbn': isbn,
-                'bookstore': bookstore
-            },
-            UpdateExpression="set watch_status = :r",
-            ExpressionAttributeValues={
-                ':r': True
-            },
-            ReturnValues="UPDATED_NEW"
-        )
+        storage.get_storage().set_watch_status(isbn, bookstore, True)
         typer.secho(f"Book with ISBN {isbn} from {bookstore} updated successfully!", fg=typer.colors.GREEN, bold=True)
     except botocore.exceptions.ClientError as err:
         typer.echo(typer.style(err.response["Error"]["Message"], fg=typer.colors.RED, bold=True))
@@ -126,24 +182,165 @@ def delete_book(isbn: int = typer.Option(..., prompt="What is the book's ISBN?",
     """
     Delete a book from the database
     """
-    session = boto3.Session(
-        aws_access_key_id=AWS_ACCESS_KEY_ID,
-        aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-        region_name=AWS_DEFAULT_REGION
-    )
     try:
-        session.resource("dynamodb").Table("books_to_watch").delete_item(
-            Key={
-                'isbn': isbn,
-                'bookstore': bookstore
-            }
-        )
+        storage.get_storage().delete_book(isbn, bookstore)
         typer.secho(f"Book with ISBN {isbn} from {bookstore} deleted successfully!", fg=typer.colors.GREEN, bold=True)
     except botocore.exceptions.ClientError as err:
         typer.echo(typer.style(err.response["Error"]["Message"], fg=typer.colors.RED, bold=True))
         raise typer.Exit()
 
 
+@app.command()
+def migrate():
+    """
+    Convert the prices recorded in the previous format into the compact one
+    """
+    typer.echo(typer.style("Converting the price history... Please wait as this may take a while.",
+                           fg=typer.colors.BRIGHT_WHITE, bold=True))
+    try:
+        result = history.migrate(utils.get_db())
+    except (botocore.exceptions.ClientError, RuntimeError) as err:
+        message = err.response["Error"]["Message"] if isinstance(err, botocore.exceptions.ClientError) else str(err)
+        typer.echo(typer.style(message, fg=typer.colors.RED, bold=True))
+        raise typer.Exit()
+    for (isbn, url), count in sorted(result["unresolved"].items()):
+        typer.secho(f"{isbn} {url}: {count} prices kept, as the url is not in the watch list", fg=typer.colors.YELLOW)
+    typer.secho(f"{result['migrated']} prices converted successfully!", fg=typer.colors.GREEN, bold=True)
+
+
+@app.command()
+def run(bookstore: List[str] = typer.Option(None, help="Scrape only this bookstore (can be repeated)"),
+        isbn: List[int] = typer.Option(None, help="Scrape only this book (can be repeated)"),
+        max_workers: int = typer.Option(MAX_WORKERS, min=1, help="The books being scraped at the same time"),
+        max_per_domain: int = typer.Option(MAX_WORKERS_PER_DOMAIN, min=1,
+                                           help="The books being scraped at the same time from the same host"),
+        store: bool = typer.Option(True, help="Record the prices scraped (otherwise, they are only added to the "
+                                              "prices already recorded in the e-mail)"),
+        send_mail: bool = typer.Option(True, "--mail/--no-mail", help="Send the e-mail, or only write it to "
+                                                                      "--mail-file"),
+        mail_file: str = typer.Option("mail.html", help="The file of the e-mail with --no-mail (the plain-text "
+                                                        "version is written next to it, with .txt)")):
+    """
+    Run the whole function in this process (scrape, store and e-mail), and print the time of each stage
+    """
+    metrics.reset()
+    backend = storage.get_storage()
+    typer.echo(typer.style("Scraping the watch list...", fg=typer.colors.BRIGHT_WHITE, bold=True))
+    try:
+        result = fanout.work(backend, bookstores=set(bookstore or ()), isbns=set(isbn or ()),
+                             max_workers=max_workers, max_per_domain=max_per_domain, store=store)
+        with metrics.timer("PreprocessTime"):
+            data = mail.preprocess(backend, result.get("scraped"))
+        if send_mail:
+            mail.send(data)
+        else:
+            text_path, html_path = mail.save(data, mail_file)
+    except botocore.exceptions.ClientError as err:
+        typer.echo(typer.style(err.response["Error"]["Message"], fg=typer.colors.RED, bold=True))
+        raise typer.Exit()
+    finally:
+        backend.close()
+
+    for failure in result["failures"]:
+        typer.secho(f"{failure['url']}: {failure['error']}", fg=typer.colors.YELLOW)
+    typer.secho(f"{result['books']} books scraped ({result['unchanged']} unchanged), {result['failed']} failed and "
+                f"{result['skipped']} skipped.", fg=typer.colors.GREEN, bold=True)
+    if send_mail:
+        typer.secho("E-mail sent successfully!", fg=typer.colors.GREEN, bold=True)
+    else:
+        typer.secho(f"E-mail written to {html_path} and {text_path}.", fg=typer.colors.GREEN, bold=True)
+    print_metrics(metrics.summarize(json.dumps(record, default=float) for record in metrics.get_records()))
+
+
+@app.command()
+def rollup():
+    """
+    Roll up the old prices into daily and weekly aggregates, as the deployed function does every week
+    """
+    db = utils.get_db()
+    typer.echo(typer.style("Rolling up the price history... Please wait as this may take a while.",
+                           fg=typer.colors.BRIGHT_WHITE, bold=True))
+    try:
+        history.enable_expiration(db)
+        result = history.rollup(db)
+    except botocore.exceptions.ClientError as err:
+        typer.echo(typer.style(err.response["Error"]["Message"], fg=typer.colors.RED, bold=True))
+        raise typer.Exit()
+    typer.secho(f"{result['raw']} prices and {result['daily']} daily aggregates of {result['books']} books rolled up "
+                f"successfully!", fg=typer.colors.GREEN, bold=True)
+
+
+@app.command()
+def dispatch(shards: int = typer.Option(FANOUT_SHARDS, min=1, help="The number of workers sharing the watch list"),
+             local: bool = typer.Option(False, help="Run the workers in local processes instead of invoking the "
+                                                    "deployed function")):
+    """
+    Scrape the watch list split over parallel workers, and send the e-mail once all of them finish
+    """
+    typer.echo(typer.style(f"Dispatching {shards} workers...", fg=typer.colors.BRIGHT_WHITE, bold=True))
+    if not local:
+        result = fanout.start(utils.get_db(), storage.get_storage(), shards)
+        typer.secho(f"Run {result['run']} started! The last of its workers sends the e-mail.",
+                    fg=typer.colors.GREEN, bold=True)
+        return
+    result = fanout.dispatch(shards)
+    for shard, error in sorted(result["failed_shards"].items()):
+        typer.secho(f"Shard {shard} failed: {error}", fg=typer.colors.RED, bold=True)
+    for failure in result["failures"]:
+        typer.secho(f"{failure['url']}: {failure['error']}", fg=typer.colors.YELLOW)
+    writes = result["books_price_data"] or {"items": 0, "consumed_capacity": 0, "elapsed": 0}
+    typer.echo(tabulate.tabulate([[result["shards"], result["books"], result["failed"], result["skipped"],
+                                   writes["items"], writes["consumed_capacity"], writes["elapsed"]]],
+                                 ["shards", "books", "failed", "skipped", "prices stored", "consumed capacity",
+                                  "write s"], tablefmt='grid', floatfmt=".1f"))
+    fanout.report(storage.get_storage())
+    typer.secho("E-mail sent successfully!", fg=typer.colors.GREEN, bold=True)
+
+
+def print_metrics(summary):
+    """
+    Print the metrics of the runs, and of each bookstore
+    :param summary: the totals of the runs (see metrics.summarize)
+    """
+    runs = max(summary["runs"], 1)
+
+    typer.secho(f"Runs: {summary['runs']}", fg=typer.colors.BRIGHT_WHITE, bold=True)
+    rows = [[name, value, value / runs] for name, value in sorted(summary["run"]["metrics"].items())]
+    typer.echo(tabulate.tabulate(rows, ["metric", "total", "per run"], tablefmt='grid', floatfmt=".1f"))
+
+    header = ["bookstore", "requests", "errors", "KiB", "fetch ms", "fetch p50", "fetch p90", "parse ms"]
+    rows = []
+    for bookstore, scope in sorted(summary["bookstores"].items()):
+        values, histograms = scope["metrics"], scope["histograms"]
+        requests = values.get("Requests", 0)
+        parsed = sum(histograms.get("ParseTime", {}).values())
+        fetch = histograms.get("FetchTime", {})
+        rows.append([
+            bookstore,
+            requests,
+            values.get("Errors", 0),
+            values.get("FetchedBytes", 0) / 1024,
+            values.get("FetchTime", 0) / requests if requests else None,
+            metrics.percentile(fetch, 0.5),
+            metrics.percentile(fetch, 0.9),
+            values.get("ParseTime", 0) / parsed if parsed else None
+        ])
+    typer.echo(tabulate.tabulate(rows, header, tablefmt='grid', floatfmt=".1f"))
+
+
+@app.command()
+def stats(log: typer.FileText = typer.Argument(..., help="The log of the Lambda function (e.g. exported from "
+                                                        "CloudWatch Logs), or - to read it from the standard input")):
+    """
+    Summarize the metrics of the runs in a log
+    """
+    summary = metrics.summarize(log)
+    if not summary["runs"] and not summary["bookstores"]:
+        typer.secho("There are no metrics in the log.", fg=typer.colors.YELLOW, bold=True)
+        raise typer.Exit()
+    print_metrics(summary)
+
+
 @app.command()
 def deploy():
     """
@@ -230,6 +427,8 @@ def deploy():
         )
 
         table.meta.client.get_waiter('table_exists').wait(TableName='books_price_data')
+        # The prices rolled up into daily and weekly aggregates are deleted by the TTL
+        history.enable_expiration(dynamodb)
 
         typer.echo(typer.style("Table 'books_price_data' created successfully!", fg=typer.colors.GREEN, bold=True))
 
@@ -237,6 +436,73 @@ def deploy():
         typer.echo(typer.style(err.response["Error"]["Message"], fg=typer.colors.RED, bold=True))
         raise typer.Exit()
 
+    typer.echo(typer.style("Creating table 'books_price_summary'... Please wait as this may take a while.",
+                           fg=typer.colors.BRIGHT_WHITE, bold=True))
+
+    try:
+        table = dynamodb.create_table(
+            TableName='books_price_summary',
+            KeySchema=[
+                {
+                    'AttributeName': 'isbn',
+                    'KeyType': 'HASH'
+                }
+            ],
+            AttributeDefinitions=[
+                {
+                    'AttributeName': 'isbn',
+                    'AttributeType': 'N'
+                }
+            ],
+            ProvisionedThroughput={
+                'ReadCapacityUnits': 1,
+                'WriteCapacityUnits': 1
+            }
+        )
+
+        table.meta.client.get_waiter('table_exists').wait(TableName='books_price_summary')
+
+        typer.echo(typer.style("Table 'books_price_summary' created successfully!", fg=typer.colors.GREEN, bold=True))
+
+    except botocore.exceptions.ClientError as err:
+        typer.echo(typer.style(err.response["Error"]["Message"], fg=typer.colors.RED, bold=True))
+        raise typer.Exit()
+
+    typer.echo(typer.style(f"Creating table '{fanout.RUNS_TABLE}'... Please wait as this may take a while.",
+                           fg=typer.colors.BRIGHT_WHITE, bold=True))
+
+    try:
+        table = dynamodb.create_table(
+            TableName=fanout.RUNS_TABLE,
+            KeySchema=[
+                {
+                    'AttributeName': 'run',
+                    'KeyType': 'HASH'
+                }
+            ],
+            AttributeDefinitions=[
+                {
+                    'AttributeName': 'run',
+                    'AttributeType': 'S'
+                }
+            ],
+            ProvisionedThroughput={
+                'ReadCapacityUnits': 1,
+                'WriteCapacityUnits': 1
+            }
+        )
+
+        table.meta.client.get_waiter('table_exists').wait(TableName=fanout.RUNS_TABLE)
+        table.meta.client.update_time_to_live(TableName=fanout.RUNS_TABLE,
+                                              TimeToLiveSpecification={"Enabled": True, "AttributeName": "expires"})
+
+        typer.echo(typer.style(f"Table '{fanout.RUNS_TABLE}' created successfully!", fg=typer.colors.GREEN,
+                               bold=True))
+
+    except botocore.exceptions.ClientError as err:
+        typer.echo(typer.style(err.response["Error"]["Message"], fg=typer.colors.RED, bold=True))
+        raise typer.Exit()
+
     iam = session.client('iam')
 
     role_policy = {
@@ -275,23 +541,11 @@ def deploy():
         typer.echo(typer.style(err.response["Error"]["Message"], fg=typer.colors.RED, bold=True))
         raise typer.Exit()
 
-    typer.echo(typer.style("Zipping all the contents of the function...", fg=typer.colors.BRIGHT_WHITE, bold=True))
+    typer.echo(typer.style("Building the function artifact...", fg=typer.colors.BRIGHT_WHITE, bold=True))
 
-    zipf = zipfile.ZipFile('function.zip', 'w', zipfile.ZIP_DEFLATED, allowZip64=True)
-    for root, dirs, files in os.walk("."):
-        if "venv" in dirs:
-            dirs.remove("venv")
-        for file in files:
-            zipf.write(os.path.join(root, file))
-    abs_src = os.path.abspath(f"venv/lib/python{sys.version_info.major}.{sys.version_info.minor}/site-packages")
-    for root, dirs, files in os.walk(f"venv/lib/python{sys.version_info.major}.{sys.version_info.minor}/site-packages"):
-        for file in files:
-            absname = os.path.abspath(os.path.join(root, file))
-            arcname = absname[len(abs_src) + 1:]
-            zipf.write(os.path.join(root, file), arcname)
-    zipf.close()
+    artifact.build()
 
-    typer.echo(typer.style("Function zipped successfully!", fg=typer.colors.GREEN, bold=True))
+    typer.echo(typer.style("Function artifact built successfully!", fg=typer.colors.GREEN, bold=True))
 
     function = session.client('lambda')
 
@@ -299,17 +553,19 @@ def deploy():
         typer.echo(typer.style("Creating and publishing the function...", fg=typer.colors.BRIGHT_WHITE, bold=True))
         function_response = function.create_function(
             FunctionName='thebookisright',
-            Runtime='python3.8',
+            Runtime=artifact.LAMBDA_RUNTIME,
             Role=role_response["Role"]["Arn"],
             Handler='lambda_function.lambda_handler',
             Code={
-                'ZipFile': open("function.zip", 'rb').read()
+                'ZipFile': open(artifact.ARTIFACT, 'rb').read()
             },
             Description='The right price for the right book! - Based on https://github.com/migueltsantana/TheBookIsRight',
             Timeout=900,
             MemorySize=1408,
             Publish=True
         )
+        # A worker that failed already recorded its shard as failed, so it must not be invoked again
+        function.put_function_event_invoke_config(FunctionName='thebookisright', MaximumRetryAttempts=0)
         typer.echo(typer.style("Function published successfully!", fg=typer.colors.GREEN, bold=True))
     except botocore.exceptions.ClientError as err:
         typer.echo(typer.style(err.response["Error"]["Message"], fg=typer.colors.RED, bold=True))
@@ -329,7 +585,26 @@ def deploy():
             Targets=[
                 {
                     "Id": function_response["FunctionName"],
-                    "Arn": function_response["FunctionArn"]
+                    "Arn": function_response["FunctionArn"],
+                    # Each run is split over parallel workers, unless there is a single shard
+                    "Input": json.dumps({"mode": "dispatch", "shards": FANOUT_SHARDS} if FANOUT_SHARDS > 1 else {})
+                },
+            ]
+        )
+        session.client("events").put_rule(
+            Name="TheBookIsRightRollup",
+            ScheduleExpression=f"cron({ROLLUP_CRON})",
+            State="ENABLED",
+            Description="Trigger for the rollup of the old prices of The Book Is Right",
+            RoleArn=role_response["Role"]["Arn"]
+        )
+        session.client("events").put_targets(
+            Rule="TheBookIsRightRollup",
+            Targets=[
+                {
+                    "Id": function_response["FunctionName"],
+                    "Arn": function_response["FunctionArn"],
+                    "Input": json.dumps({"mode": "rollup"})
                 },
             ]
         )
@@ -339,6 +614,40 @@ def deploy():
         typer.echo(typer.style(err.response["Error"]["Message"], fg=typer.colors.RED, bold=True))
         raise typer.Exit()
 
+@app.command()
+def update_function(force: bool = typer.Option(False, help="Upload the code even if it did not change")):
+    """
+    Update the code of the deployed function, only if it changed
+    """
+    session = boto3.Session(
+        aws_access_key_id=AWS_ACCESS_KEY_ID,
+        aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
+        region_name=AWS_DEFAULT_REGION
+    )
+
+    typer.echo(typer.style("Building the function artifact...", fg=typer.colors.BRIGHT_WHITE, bold=True))
+    code_hash, built = artifact.build()
+    if built:
+        typer.echo(typer.style("Function artifact built successfully!", fg=typer.colors.GREEN, bold=True))
+    else:
+        typer.echo(typer.style("Function artifact already up to date!", fg=typer.colors.GREEN, bold=True))
+
+    function = session.client('lambda')
+
+    try:
+        deployed_hash = function.get_function(FunctionName='thebookisright')["Configuration"]["CodeSha256"]
+        if deployed_hash == code_hash and not force:
+            typer.echo(typer.style("The deployed function is already up to date!", fg=typer.colors.GREEN, bold=True))
+            return
+        typer.echo(typer.style("Uploading the function...", fg=typer.colors.BRIGHT_WHITE, bold=True))
+        with open(artifact.ARTIFACT, 'rb') as file:
+            function.update_function_code(FunctionName='thebookisright', ZipFile=file.read(), Publish=True)
+        typer.echo(typer.style("Function updated successfully!", fg=typer.colors.GREEN, bold=True))
+    except botocore.exceptions.ClientError as err:
+        typer.echo(typer.style(err.response["Error"]["Message"], fg=typer.colors.RED, bold=True))
+        raise typer.Exit()
+
+
 @app.command()
 def undeploy(abort_when_fail: bool = typer.Option(True, help="Stop if any exception is raised")):
     """
@@ -374,6 +683,28 @@ def undeploy(abort_when_fail: bool = typer.Option(True, help="Stop if any except
         typer.echo(typer.style(f'ERROR: {err.response["Error"]["Message"]}', fg=typer.colors.RED, bold=True))
         if abort_when_fail: raise typer.Exit()
 
+    try:
+        typer.echo(typer.style("Deleting the table 'books_price_summary'...", fg=typer.colors.BRIGHT_WHITE, bold=True))
+        session.client('dynamodb').delete_table(
+            TableName='books_price_summary'
+        )
+        typer.echo(typer.style("Table 'books_price_summary' deleted successfully!", fg=typer.colors.GREEN, bold=True))
+    except botocore.exceptions.ClientError as err:
+        typer.echo(typer.style(f'ERROR: {err.response["Error"]["Message"]}', fg=typer.colors.RED, bold=True))
+        if abort_when_fail: raise typer.Exit()
+
+    try:
+        typer.echo(typer.style(f"Deleting the table '{fanout.RUNS_TABLE}'...", fg=typer.colors.BRIGHT_WHITE,
+                               bold=True))
+        session.client('dynamodb').delete_table(
+            TableName=fanout.RUNS_TABLE
+        )
+        typer.echo(typer.style(f"Table '{fanout.RUNS_TABLE}' deleted successfully!", fg=typer.colors.GREEN,
+                               bold=True))
+    except botocore.exceptions.ClientError as err:
+        typer.echo(typer.style(f'ERROR: {err.response["Error"]["Message"]}', fg=typer.colors.RED, bold=True))
+        if abort_when_fail: raise typer.Exit()
+
     try:
         typer.echo(typer.style("Deleting the IAM role...", fg=typer.colors.BRIGHT_WHITE, bold=True))
         session.client('iam').detach_role_policy(
@@ -407,6 +738,13 @@ def undeploy(abort_when_fail: bool = typer.Option(True, help="Stop if any except
         session.client("events").delete_rule(
             Name="TheBookIsRight"
         )
+        session.client("events").remove_targets(
+            Rule="TheBookIsRightRollup",
+            Ids=["thebookisright"]
+        )
+        session.client("events").delete_rule(
+            Name="TheBookIsRightRollup"
+        )
         typer.echo(typer.style("CloudWatch event deleted successfully!", fg=typer.colors.GREEN, bold=True))
     except botocore.exceptions.ClientError as err:
         typer.echo(typer.style(f'ERROR: {err.response["Error"]["Message"]}', fg=typer.colors.RED, bold=True))
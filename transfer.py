@@ -0,0 +1,222 @@
+import csv
+import json
+import os
+from decimal import Decimal
+from itertools import islice
+
+import history
+
+FORMATS = {".csv": "csv", ".jsonl": "jsonl", ".json": "jsonl", ".parquet": "parquet"}
+# The columns of the exported prices (see history.expand), where the lowest and the highest prices are only set in
+# the daily and weekly aggregates
+PRICE_COLUMNS = ["isbn", "timestamp", "bookstore", "promo_price", "regular_price", "currency", "url", "photo_url",
+                 "min_price", "max_price"]
+# The rows written to a Parquet file at a time (each one is a row group)
+PARQUET_BATCH_SIZE = 10000
+
+
+def get_format(path, file_format=None):
+    """
+    Get the format of a file from its extension
+    :param path: the path of the file
+    :param file_format: the format chosen by the user, if any
+    :return: 'csv', 'jsonl' or 'parquet'
+    """
+    if file_format:
+        if file_format not in FORMATS.values():
+            raise ValueError(f"Unknown format '{file_format}'. The available ones are: csv, jsonl, parquet")
+        return file_format
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in FORMATS:
+        raise ValueError(f"Unknown format of '{path}'. The available ones are: {', '.join(sorted(FORMATS))}")
+    return FORMATS[extension]
+
+
+def to_bool(value):
+    """
+    Convert the watch_status of an imported book
+    :param value: the value of the file (boolean, number, string or None)
+    :return: True unless the value is false, 0, no or empty
+    """
+    if value is None or isinstance(value, bool):
+        return value is not False
+    return str(value).strip().lower() not in ("false", "0", "no", "n", "")
+
+
+def to_book(row):
+    """
+    Validate a row of an imported file
+    :param row: dictionary with the isbn, bookstore and url of the book, and optionally its watch_status
+    :return: the books_to_watch item
+    """
+    isbn = str(row.get("isbn") or "").replace("-", "").strip()
+    if len(isbn) != 13 or not isbn.isdigit():
+        raise ValueError(f"invalid ISBN-13 '{row.get('isbn')}'")
+    bookstore = str(row.get("bookstore") or "").strip()
+    if not bookstore:
+        raise ValueError("missing bookstore")
+    url = str(row.get("url") or "").strip()
+    if not url.startswith(("http://", "https://")):
+        raise ValueError(f"invalid url '{url}'")
+    return {"isbn": int(isbn), "bookstore": bookstore, "url": url, "watch_status": to_bool(row.get("watch_status"))}
+
+
+def read_rows(file, file_format):
+    """
+    Stream the rows of a CSV or JSON lines file
+    :param file: the text file
+    :param file_format: 'csv' or 'jsonl'
+    :return: generator of (line number, dictionary) tuples, or (line number, exception) for unreadable lines
+    """
+    if file_format == "csv":
+        reader = csv.DictReader(file)
+        for row in reader:
+            yield reader.line_num, row
+    elif file_format == "jsonl":
+        for number, line in enumerate(file, 1):
+            if line.strip():
+                try:
+                    yield number, json.loads(line)
+                except ValueError as err:
+                    yield number, err
+    else:
+        raise ValueError(f"The books can only be imported from CSV or JSON lines, not {file_format}")
+
+
+def read_books(file, file_format):
+    """
+    Stream and validate the books of a CSV or JSON lines file
+    :param file: the text file, with the isbn, bookstore, url and (optionally) watch_status columns
+    :param file_format: 'csv' or 'jsonl'
+    :return: generator of (line number, books_to_watch item, error message) tuples, where either the item or the
+    error is None
+    """
+    for number, row in read_rows(file, file_format):
+        try:
+            if isinstance(row, Exception):
+                raise row
+            if not isinstance(row, dict):
+                raise ValueError("the line is not an object")
+            yield number, to_book(row), None
+        except ValueError as err:
+            yield number, None, str(err)
+
+
+def batches(iterable, size):
+    """
+    Split a stream into lists
+    :param iterable: the stream
+    :param size: the maximum length of each list
+    :return: generator of lists
+    """
+    iterator = iter(iterable)
+    batch = list(islice(iterator, size))
+    while batch:
+        yield batch
+        batch = list(islice(iterator, size))
+
+
+def to_record(observation):
+    """
+    Get the exported row of a price observation
+    :param observation: the price observation (see history.expand)
+    :return: dictionary with the PRICE_COLUMNS, where the timestamp is the UTC datetime of the observation
+    """
+    record = {column: observation.get(column) for column in PRICE_COLUMNS}
+    record["isbn"] = int(record["isbn"])
+    record["timestamp"] = history.parse_timestamp(observation["timestamp"])
+    return record
+
+
+def to_json(value):
+    """
+    Convert the values that json cannot serialize
+    :param value: a Decimal price or a datetime
+    :return: the float price or the ISO 8601 string
+    """
+    if isinstance(value, Decimal):
+        return float(value)
+    return value.isoformat()
+
+
+def write_csv(file, records):
+    """
+    Write the exported prices as CSV, one row at a time
+    :param file: the text file
+    :param records: iterable of exported rows (see to_record)
+    :return: the number of rows written
+    """
+    writer = csv.DictWriter(file, PRICE_COLUMNS)
+    writer.writeheader()
+    written = 0
+    for record in records:
+        writer.writerow(dict(record, timestamp=record["timestamp"].isoformat()))
+        written += 1
+    return written
+
+
+def write_jsonl(file, records):
+    """
+    Write the exported prices as JSON lines, one row at a time
+    :param file: the text file
+    :param records: iterable of exported rows (see to_record)
+    :return: the number of rows written
+    """
+    written = 0
+    for record in records:
+        file.write(json.dumps(record, default=to_json, ensure_ascii=False) + "\n")
+        written += 1
+    return written
+
+
+def write_parquet(path, records, batch_size=PARQUET_BATCH_SIZE):
+    """
+    Write the exported prices as Parquet, one row group at a time
+    :param path: the path of the file
+    :param records: iterable of exported rows (see to_record)
+    :param batch_size: the rows of each row group
+    :return: the number of rows written
+    """
+    # Optional, only needed for this format
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("The Parquet format requires pyarrow (pip install pyarrow)")
+    price = pyarrow.decimal128(12, 2)
+    schema = pyarrow.schema([
+        ("isbn", pyarrow.int64()),
+        ("timestamp", pyarrow.timestamp("s", tz="UTC")),
+        ("bookstore", pyarrow.string()),
+        ("promo_price", price),
+        ("regular_price", price),
+        ("currency", pyarrow.string()),
+        ("url", pyarrow.string()),
+        ("photo_url", pyarrow.string()),
+        ("min_price", price),
+        ("max_price", price)
+    ])
+    written = 0
+    with pyarrow.parquet.ParquetWriter(path, schema) as writer:
+        for batch in batches(records, batch_size):
+            columns = [pyarrow.array([record[field.name] for record in batch], field.type) for field in schema]
+            writer.write_table(pyarrow.Table.from_arrays(columns, schema=schema))
+            written += len(batch)
+    return written
+
+
+def export_history(path, file_format, observations):
+    """
+    Write price observations to a file, as they are read
+    :param path: the path of the file
+    :param file_format: 'csv', 'jsonl' or 'parquet'
+    :param observations: iterable of price observations (see history.expand)
+    :return: the number of prices written
+    """
+    records = (to_record(observation) for observation in observations)
+    if file_format == "parquet":
+        return write_parquet(path, records)
+    with open(path, "w", encoding="utf-8", newline="") as file:
+        if file_format == "csv":
+            return write_csv(file, records)
+        return write_jsonl(file, records)
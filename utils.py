@@ -1,24 +1,131 @@
+import hashlib
+import queue
+import random
+import threading
+from urllib.parse import urlparse
+
 import requests
 import boto3
+from boto3.dynamodb.conditions import Attr
+from botocore.exceptions import ClientError
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import bookstores
+import cache
+import metrics
+from models import Book
+from settings import AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_DEFAULT_REGION, HTTP_POOL_SIZE, HTTP_TIMEOUT, \
+    HTTP_RETRIES, HTTP_BACKOFF_FACTOR, SCAN_SEGMENTS, SEEN_REFRESH_DAYS
+
+# The attributes of books_to_watch with the static information of a book, by the Book attribute they come from
+METADATA = {"photo_url": "photo_url", "currency": "currency", "store_name": "bookstore"}
+# The seconds a segment of a parallel scan waits for a free slot before checking if the scan was stopped
+SCAN_POLL_SECONDS = 0.5
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+class JitteredRetry(Retry):
+    """
+    Retry policy with a random jitter on top of the exponential backoff, so concurrent requests that failed
+    together do not hit the bookstore again at the same time
+    """
+    def get_backoff_time(self):
+        """
+        Get the time to sleep before the next attempt
+        :return: a random number of seconds between 0 and the exponential backoff
+        """
+        return random.uniform(0, super().get_backoff_time())
 
-from settings import AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_DEFAULT_REGION
+
+def get_session(url):
+    """
+    Get the pooled keep-alive session of the host of the given url, creating it on first use
+    :param url: the url that is going to be requested
+    :return: requests' Session object shared by every request to the same host
+    """
+    parsed = urlparse(url)
+    key = f"{parsed.scheme}://{parsed.netloc}"
+    with _sessions_lock:
+        if key not in _sessions:
+            # Only the connections that failed are tried again here, as the request never reached the bookstore:
+            # the timeouts and the error statuses are tried again by the scraper, within its retry budget and
+            # deadline, and the Retry-After of a bookstore could block a worker past the deadline
+            retries = JitteredRetry(
+                total=HTTP_RETRIES,
+                connect=HTTP_RETRIES,
+                read=0,
+                status=0,
+                other=0,
+                backoff_factor=HTTP_BACKOFF_FACTOR,
+                respect_retry_after_header=False,
+                raise_on_status=False
+            )
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE, max_retries=retries)
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _sessions[key] = session
+        return _sessions[key]
 
 
 def get_page(url, headers=None):
     """
-    Get the page HTML content
+    Get the page of the given url
     :param headers: the headers dictionary to add to the request object
     :param url: the url to extract the contents
-    :return: Request content of the given url
+    :return: the Response of the given url, either with the page (200) or not modified (304) when the request has
+    the validators of a previous response
     """
-    if headers:
-        result = requests.get(url, headers=headers)
-    else:
-        result = requests.get(url)
-    if result.status_code != 200:
+    bookstore = bookstores.get_name(url)
+    with metrics.timer("FetchTime", bookstore):
+        result = get_session(url).get(url, headers=headers, timeout=HTTP_TIMEOUT)
+    metrics.add("Requests", bookstore=bookstore)
+    metrics.add("FetchedBytes", len(result.content), bookstore)
+    if result.status_code not in (200, 304):
         result.raise_for_status()
+    return result
+
+
+def get_book(url, parse, headers=None):
+    """
+    Get the book information of the given url, skipping the parsing when the page did not change.
+    The request is sent with the validators of the previous response (see cache), so the bookstore can answer with
+    a 304 (Not Modified); the previously extracted fields are also reused when the page body is exactly the same.
+    :param url: the url of the book in the bookstore
+    :param parse: function that receives the page HTML content and the url, and returns a Book instance
+    :param headers: the headers dictionary to add to the request object
+    :return: Book instance with the information of the given url
+    """
+    entry = cache.load(url)
+    headers = dict(headers or {})
+    if entry:
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+    result = get_page(url, headers=headers)
+    bookstore = bookstores.get_name(url)
+    if result.status_code == 304 and entry:
+        metrics.add("NotModified", bookstore=bookstore)
+        return Book(**entry["book"])
+    digest = hashlib.sha256(result.content).hexdigest()
+    # The entries read from books_to_watch only have the validators (see cache.prime)
+    if entry and entry.get("hash") == digest:
+        metrics.add("UnchangedPages", bookstore=bookstore)
+        book = Book(**entry["book"])
     else:
-        return result.content
+        with metrics.timer("ParseTime", bookstore):
+            book = parse(result.content, url)
+    cache.save(url, {
+        "etag": result.headers.get("ETag"),
+        "last_modified": result.headers.get("Last-Modified"),
+        "hash": digest,
+        "book": book.to_dict()
+    })
+    return book
 
 
 def get_db():
@@ -31,3 +138,139 @@ def get_db():
         aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
         region_name=AWS_DEFAULT_REGION
     ).resource("dynamodb")
+
+
+def scan(table, segments=SCAN_SEGMENTS, **kwargs):
+    """
+    Stream all the items of a table, following LastEvaluatedKey until the end of the table.
+    With more than one segment, the segments are read in parallel and the items are yielded as soon as each
+    page arrives, so their order is not deterministic.
+    :param table: boto3's Table object
+    :param segments: the number of segments of the parallel scan
+    :param kwargs: the remaining arguments of the scan (FilterExpression, ProjectionExpression...)
+    :return: generator of the items of the table
+    """
+    client = table.meta.client
+    kwargs["TableName"] = table.name
+    if segments <= 1:
+        yield from scan_segment(client, kwargs)
+        return
+
+    # The segments only read ahead a page each, so the memory used does not depend on the size of the table
+    pages = queue.Queue(maxsize=segments)
+    stop = threading.Event()
+    finished = object()
+
+    def put(page):
+        # Give up once the consumer stopped, instead of waiting for a free slot forever
+        while not stop.is_set():
+            try:
+                pages.put(page, timeout=SCAN_POLL_SECONDS)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def read(segment):
+        try:
+            for page in scan_segment(client, dict(kwargs, Segment=segment, TotalSegments=segments), pages=True):
+                if not put(page):
+                    return
+        except Exception as err:
+            put(err)
+        finally:
+            put(finished)
+
+    for segment in range(segments):
+        threading.Thread(target=read, args=(segment,), daemon=True).start()
+    running = segments
+    try:
+        while running:
+            page = pages.get()
+            if page is finished:
+                running -= 1
+            elif isinstance(page, Exception):
+                raise page
+            else:
+                yield from page
+    finally:
+        # The consumer stopped early or failed: the segments stop reading the table
+        stop.set()
+
+
+def scan_segment(client, kwargs, pages=False):
+    """
+    Stream the items of a scan request, one page at a time
+    :param client: boto3's DynamoDB client
+    :param kwargs: the arguments of the scan
+    :param pages: whether to yield whole pages instead of single items
+    :return: generator of the items (or lists of items) of the scan
+    """
+    kwargs = dict(kwargs, ReturnConsumedCapacity="TOTAL")
+    while True:
+        response = client.scan(**kwargs)
+        metrics.add_capacity(response)
+        if pages:
+            yield response["Items"]
+        else:
+            yield from response["Items"]
+        if "LastEvaluatedKey" not in response:
+            return
+        kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def get_books_to_watch(db, segments=SCAN_SEGMENTS, shard=None, shards=None):
+    """
+    Stream all the books to scrape prices
+    :param db: the instance of the database
+    :param segments: the number of segments of the parallel scan
+    :param shard: the only segment of the table to read, when the watch list is split over several runs
+    :param shards: the total number of segments the watch list is split into (required with shard)
+    :return: generator of the watched books_to_watch items, with all their attributes
+    """
+    # A projection would not read less capacity: a scan consumes the size of the whole items anyway
+    kwargs = {"FilterExpression": Attr("watch_status").eq(True)}
+    if shard is not None:
+        # DynamoDB assigns the items to the segments by the hash of their isbn
+        return scan(db.Table("books_to_watch"), 1, Segment=shard, TotalSegments=shards, **kwargs)
+    return scan(db.Table("books_to_watch"), segments, **kwargs)
+
+
+def update_book_to_watch(db, book_to_watch, book, seen):
+    """
+    Keep the static information of a book in a bookstore, which the price history does not repeat, the cache
+    entry of its page (see cache.pop) and the last time it was seen.
+    The book to watch is only updated when the information changed, or when it was last seen more than
+    SEEN_REFRESH_DAYS ago, so most unchanged books cost no write at all. Only those attributes are set, so the
+    changes made to the book while it was scraped (watch status, url) are kept, and a book no longer in the table
+    is not written again.
+    :param db: the instance of the database
+    :param book_to_watch: the books_to_watch item, as returned by get_books_to_watch
+    :param book: the Book instance just scraped
+    :param seen: the epoch seconds of the observation
+    :return: True if the book to watch was updated
+    """
+    changed = {attribute: getattr(book, name) for attribute, name in METADATA.items()
+               if book_to_watch.get(attribute) != getattr(book, name)}
+    http_cache = cache.pop(book_to_watch["url"])
+    if http_cache is not None and http_cache != book_to_watch.get("http_cache"):
+        changed["http_cache"] = http_cache
+    if not changed and seen - book_to_watch.get("seen", 0) < SEEN_REFRESH_DAYS * 24 * 3600:
+        return False
+    changed["seen"] = seen
+    try:
+        response = db.meta.client.update_item(
+            TableName="books_to_watch",
+            Key={"isbn": book_to_watch["isbn"], "bookstore": book_to_watch["bookstore"]},
+            UpdateExpression="SET " + ", ".join(f"#{attribute} = :{attribute}" for attribute in changed),
+            ConditionExpression="attribute_exists(isbn)",
+            ExpressionAttributeNames={f"#{attribute}": attribute for attribute in changed},
+            ExpressionAttributeValues={f":{attribute}": value for attribute, value in changed.items()},
+            ReturnConsumedCapacity="TOTAL"
+        )
+    except ClientError as err:
+        if err.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
+        return False
+    metrics.add_capacity(response)
+    return True
@@ -0,0 +1,137 @@
+import random
+import time
+
+import metrics
+from settings import WRITE_BATCH_SIZE, WRITE_MAX_RETRIES, WRITE_BACKOFF
+
+
+def get_delay(attempt, backoff=WRITE_BACKOFF):
+    """
+    Get the time to wait before retrying the unprocessed items of a batch request, with an exponential backoff and
+    a random jitter, so the retries of concurrent writers do not hit the table at the same time
+    :param attempt: the number of the retry, from 1
+    :param backoff: the base number of seconds of the exponential backoff
+    :return: the number of seconds to wait
+    """
+    return random.uniform(0, backoff * 2 ** attempt)
+
+
+class BufferedWriter:
+    """
+    Buffered writer of DynamoDB items, sent to the table in groups with BatchWriteItem
+    """
+    def __init__(self, db, table, keys, batch_size=WRITE_BATCH_SIZE, max_retries=WRITE_MAX_RETRIES,
+                 backoff=WRITE_BACKOFF):
+        """
+        The constructor for BufferedWriter
+        :param db: the instance of the database
+        :param table: the name of the table
+        :param keys: the names of the primary key attributes of the table
+        :param batch_size: the number of items of each BatchWriteItem request (25 at most)
+        :param max_retries: the maximum number of attempts to write the unprocessed items of a batch
+        :param backoff: the base number of seconds of the exponential backoff between attempts
+        """
+        self.client = db.meta.client
+        self.table = table
+        self.keys = keys
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.buffer = {}
+        self.items = 0
+        self.requests = 0
+        self.retries = 0
+        self.consumed_capacity = 0
+        self.elapsed = 0
+
+    def put(self, item):
+        """
+        Add an item to the buffer, writing the buffer when it is full.
+        An item with the same key of a buffered one replaces it, just like a put_item would.
+        :param item: the item to write
+        """
+        self.add(item, {"PutRequest": {"Item": item}})
+
+    def delete(self, key):
+        """
+        Add the deletion of an item to the buffer, writing the buffer when it is full.
+        It replaces a buffered write of the same key, just like a delete_item would.
+        :param key: the primary key of the item to delete
+        """
+        self.add(key, {"DeleteRequest": {"Key": key}})
+
+    def add(self, key, request):
+        """
+        Add a write request to the buffer, writing the buffer when it is full
+        :param key: the item or the primary key of the item written by the request
+        :param request: the PutRequest or DeleteRequest of BatchWriteItem
+        """
+        self.buffer[tuple(key[name] for name in self.keys)] = request
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Write all the buffered items
+        """
+        requests = list(self.buffer.values())
+        self.buffer = {}
+        for i in range(0, len(requests), self.batch_size):
+            self.write(requests[i:i + self.batch_size])
+
+    def write(self, requests):
+        """
+        Write a batch of items, retrying the unprocessed ones with an exponential backoff
+        :param requests: the PutRequest and DeleteRequest of the items to write
+        """
+        start = time.perf_counter()
+        attempt = 0
+        while requests:
+            response = self.client.batch_write_item(
+                RequestItems={self.table: requests},
+                ReturnConsumedCapacity="TOTAL"
+            )
+            self.requests += 1
+            self.consumed_capacity += sum(capacity.get("CapacityUnits", 0)
+                                          for capacity in response.get("ConsumedCapacity", []))
+            metrics.add_capacity(response)
+            unprocessed = response.get("UnprocessedItems", {}).get(self.table, [])
+            self.items += len(requests) - len(unprocessed)
+            requests = unprocessed
+            if requests:
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise RuntimeError(f"{len(requests)} items of '{self.table}' were not written after "
+                                       f"{self.max_retries} retries")
+                self.retries += 1
+                time.sleep(get_delay(attempt, self.backoff))
+        self.elapsed += time.perf_counter() - start
+
+    def get_stats(self):
+        """
+        Get the throughput counters of this writer
+        :return: dictionary with the number of items written, requests sent, retries, consumed capacity,
+        seconds spent writing and items written per second
+        """
+        return {
+            "table": self.table,
+            "items": self.items,
+            "requests": self.requests,
+            "retries": self.retries,
+            "consumed_capacity": float(self.consumed_capacity),
+            "elapsed": self.elapsed,
+            "items_per_second": self.items / self.elapsed if self.elapsed else 0
+        }
+
+    def __enter__(self):
+        """
+        The __enter__ method
+        :return: this BufferedWriter instance
+        """
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """
+        The __exit__ method, writes the remaining buffered items
+        """
+        self.flush()